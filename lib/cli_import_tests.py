@@ -0,0 +1,51 @@
+'''
+Checks the command-line tools start up quickly, by making sure importing them does not pull in heavy
+dependencies that only some subcommands need. Uses 'python -X importtime', so it runs in a clean interpreter.
+'''
+import os
+import sys
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that should only be imported by the subcommands that use them:
+HEAVY_MODULES = ['requests', 'urllib3', 'warcio', 'mrjob', 'hdfs', 'surt', 'numpy', 'luigi']
+
+
+def import_times(module):
+    '''
+    Import the module in a fresh interpreter, returning a dict of module name to cumulative import time in microseconds.
+    '''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = REPO_ROOT
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        cwd=REPO_ROOT, env=env, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            fields = line[len('import time:'):].split('|')
+            if fields[1].strip().isdigit():
+                times[fields[2].strip()] = int(fields[1])
+    return times
+
+
+def check_cli_imports(module):
+    times = import_times(module)
+    loaded = [name for name in HEAVY_MODULES if name in times]
+    assert loaded == [], "Importing %s took %.1f ms, as it also imported %s" % (module, times[module] / 1000.0, ", ".join(loaded))
+
+
+def test_windex_cli_imports():
+    check_cli_imports('lib.windex.cmd')
+
+
+def test_store_cli_imports():
+    check_cli_imports('lib.store.cmd')
+
+
+def test_trackdb_cli_imports():
+    check_cli_imports('lib.trackdb.cmd')
+
+
+def test_crawlctl_cli_imports():
+    check_cli_imports('lib.heritrix3.crawlctl')
@@ -17,25 +17,46 @@ import requests
 from urllib.parse import urlparse
 from lxml import html
 from lib.surt import url_to_surt
+from lib.docharvester.surt_trie import SurtPrefixTrie
+from lib.docharvester.http_cache import get_http_cache
 
 logger = logging.getLogger('luigi-interface')
 
 
+def watched_targets_trie(targets):
+    '''
+    Builds a trie mapping the host-level SURTs of the seeds of the Watched Targets to the indexes of the Targets
+    in the list. Callers handling many documents should build this once per Targets list and pass it to each
+    DocumentMDEx.
+    '''
+    trie = SurtPrefixTrie()
+    for i, t in enumerate(targets):
+        if t['watched']:
+            for seed in t['seeds']:
+                trie.add(url_to_surt(seed, host_only=True), i)
+    logger.info("Built a trie of %i watched seeds from %i Targets." % (len(trie), len(targets)))
+    return trie
+
+
 class DocumentMDEx(object):
     '''
     Given a Landing Page extract additional metadata.
     '''
 
-    def __init__(self, targets, document, source, null_if_no_target_found=True):
+    def __init__(self, targets, document, source, null_if_no_target_found=True, http_cache=None, watched=None):
         '''
-        The connection to W3ACT and the Document to be enhanced.
+        The connection to W3ACT and the Document to be enhanced. Landing pages etc. are fetched via the given
+        HttpCache, or the shared one if none is given. The trie of watched seeds is built from the Targets unless
+        one built by watched_targets_trie() is given.
         '''
         if not targets:
             raise Exception("The Targets passed to DocumentMDEx cannot by empty!")
         self.targets = targets
+        self.watched = watched if watched is not None else watched_targets_trie(targets)
         self.doc = document
         self.source = source
         self.null_if_no_target_found = null_if_no_target_found
+        self.http = http_cache or get_http_cache()
 
     def lp_wb_url(self):
         # FIXME Redirect due to timestamp goes through W3ACT! Going direct to live web for now:
@@ -54,15 +75,8 @@ class DocumentMDEx(object):
         '''
         # Find the list of Targets where a seed matches the given URL
         tsurt = url_to_surt(url)
-        matches = []
-        for t in self.targets:
-            if t['watched']:
-                a_match = False
-                for seed in t['seeds']:
-                    if tsurt.startswith(url_to_surt(seed, host_only=True)):
-                        a_match = True
-                if a_match:
-                    matches.append(t)
+        # (keeping the order of the Targets list, as the first match may be used below):
+        matches = [self.targets[i] for i in sorted(self.watched.matches(tsurt))]
 
         # No matches:
         if len(matches) == 0:
@@ -158,7 +172,7 @@ class DocumentMDEx(object):
         ''' Default extractor uses landing page for title etc.'''
         # Grab the landing page URL as HTML
         logger.info("Getting %s" % self.lp_wb_url())
-        r = requests.get(self.lp_wb_url(), stream=True, verify=False)
+        r = self.http.get(self.lp_wb_url(), verify=False)
         h = html.fromstring(r.content)
         h.make_links_absolute(self.doc["landing_page_url"])
         logger.info("Looking for links...")
@@ -217,7 +231,7 @@ class DocumentMDEx(object):
                 api_json_url = lp_url._replace( path="/api/content%s" % lp_url.path)
                 api_json_url = api_json_url.geturl()
                 logger.debug("Downloading and parsing from API: %s" % api_json_url)
-                r = requests.get(api_json_url)
+                r = self.http.get(api_json_url)
                 if r.status_code != 200:
                     logger.warning("Got status code %s for URL %s" % (r.status_code, api_json_url))
                     logger.warning("Response: %s" % r.content)
@@ -235,7 +249,7 @@ class DocumentMDEx(object):
             # Grab the landing page URL as HTML:
             # TODO This could all be pulled out of the Content API, if it's stable enough.
             logger.debug("Downloading and parsing: %s" % self.doc['landing_page_url'])
-            r = requests.get(self.lp_wb_url())
+            r = self.http.get(self.lp_wb_url())
             if r.status_code != 200:
                 logger.warning("Got status code %s for URL %s" % (r.status_code, self.lp_wb_url()))
                 logger.warning("Response: %s" % r.content)
@@ -278,7 +292,7 @@ class DocumentMDEx(object):
                 self.mdex_default()
                 return
         # Grab the landing page URL as HTML
-        r = requests.get(self.lp_wb_url())
+        r = self.http.get(self.lp_wb_url())
         h = html.fromstring(r.content)
         # Extract the metadata:
         self.doc['title'] = self._get0(h.xpath("//*[contains(@itemtype, 'http://schema.org/CreativeWork')]//*[contains(@itemprop,'name')]/text()")).strip()
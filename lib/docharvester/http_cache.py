@@ -0,0 +1,278 @@
+'''
+A local, persistent cache of HTTP GET responses for the document harvester, as many documents share the same
+landing page, and the same Content API responses.
+
+Responses are kept in a SQLite database, up to a maximum total size, dropping the least recently used ones
+first. Recently fetched responses are used as they are, for as long as their Cache-Control max-age allows, or
+DEFAULT_FRESH_FOR if they do not say. Older ones (and any marked no-cache) are revalidated using their ETag or
+Last-Modified headers, so unchanged pages are not downloaded again. Responses marked no-store or private are not
+kept, as the cache is shared by all the harvester processes on a machine.
+
+If several threads ask for the same URL at once, only one request is made. This only works within a process:
+separate Luigi worker processes share the stored responses, but may fetch the same URL at the same time, in which
+case the last one to finish replaces the others' copy.
+
+Counts of hits, misses, bytes saved etc. are kept for the current process. As Luigi may run each task in its own
+process, these can be added to the totals for a run in the database with flush_stats(), and logged once the whole
+run is done with log_stats().
+'''
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HTTP_CACHE = os.environ.get("DOC_HTTP_CACHE", os.path.join(tempfile.gettempdir(), 'doc-harvester-http-cache.db'))
+
+# Maximum total size of the cached responses, in bytes:
+DEFAULT_MAX_BYTES = int(os.environ.get("DOC_HTTP_CACHE_MAX_BYTES", 512*1024*1024))
+
+# How long to use responses without checking if they have changed, in seconds, unless they say otherwise:
+DEFAULT_FRESH_FOR = 60*60
+
+# How many of the least recently used responses to look at at a time when making space:
+EVICT_BATCH = 100
+
+STATS_FIELDS = ['hits', 'revalidated', 'misses', 'stores', 'evictions', 'shared', 'bytes_saved']
+
+
+def cache_control(headers):
+    '''
+    The Cache-Control directives in the given headers, as a dict of lower-case names to values (or None).
+    '''
+    value = ''
+    for name in headers:
+        if name.lower() == 'cache-control':
+            value = headers[name]
+    directives = {}
+    for directive in value.split(','):
+        m = re.match(r'\s*([^=\s]+)\s*(?:=\s*"?([^"]*)"?)?\s*$', directive)
+        if m:
+            directives[m.group(1).lower()] = m.group(2)
+    return directives
+
+
+def fresh_for(headers, default=DEFAULT_FRESH_FOR):
+    '''
+    How long a response with these headers can be used without revalidating it, in seconds.
+    '''
+    directives = cache_control(headers)
+    if 'no-cache' in directives:
+        return 0
+    try:
+        return int(directives['max-age'])
+    except (KeyError, TypeError, ValueError):
+        return default
+
+
+class CachedResponse(object):
+    '''
+    The parts of a requests Response the document harvester uses.
+    '''
+
+    def __init__(self, url, status_code, headers, content, from_cache=False):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class HttpCache(object):
+    '''
+    Caches HTTP GET responses in a SQLite database.
+    '''
+
+    def __init__(self, path=DEFAULT_HTTP_CACHE, max_bytes=DEFAULT_MAX_BYTES, fresh_for=DEFAULT_FRESH_FOR):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.fresh_for = fresh_for
+        # Imported here, so tools that only need the defaults above start up quickly:
+        import requests
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        # Requests that are in progress in this process, by URL:
+        self.in_flight = {}
+        self.stats = dict((name, 0) for name in STATS_FIELDS)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        with self.conn:
+            # Allow other processes to read while we write:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS http_cache "
+                "(url TEXT PRIMARY KEY, status INTEGER NOT NULL, headers TEXT NOT NULL, content BLOB NOT NULL, "
+                "size INTEGER NOT NULL, etag TEXT, last_modified TEXT, validated_at REAL NOT NULL, used_at REAL NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS http_cache_used_at ON http_cache (used_at)")
+            # The running total size of the cached responses, so it need not be summed up on every store:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS http_cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL)")
+            self.conn.execute("INSERT OR IGNORE INTO http_cache_size (id, total) SELECT 0, COALESCE(SUM(size), 0) FROM http_cache")
+            # Stats for each run, added up across processes:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS http_cache_stats "
+                "(run TEXT NOT NULL, name TEXT NOT NULL, value INTEGER NOT NULL, PRIMARY KEY (run, name))")
+
+    def _count(self, name, n=1):
+        with self.lock:
+            self.stats[name] += n
+
+    def _lookup(self, url):
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT status, headers, content, etag, last_modified, validated_at FROM http_cache WHERE url = ?",
+                (url,)).fetchone()
+            if row is not None:
+                self.conn.execute("UPDATE http_cache SET used_at = ? WHERE url = ?", (time.time(), url))
+        return row
+
+    def _store(self, r):
+        directives = cache_control(r.headers)
+        if 'no-store' in directives or 'private' in directives:
+            return
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT size FROM http_cache WHERE url = ?", (r.url,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO http_cache (url, status, headers, content, size, etag, last_modified, validated_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (r.url, r.status_code, json.dumps(dict(r.headers)), r.content, len(r.content),
+                 r.headers.get('ETag'), r.headers.get('Last-Modified'), now, now))
+            self._resize(len(r.content) - (row[0] if row else 0))
+            self.stats['stores'] += 1
+            self._evict()
+
+    def _resize(self, change):
+        self.conn.execute("UPDATE http_cache_size SET total = total + ? WHERE id = 0", (change,))
+
+    def _total_size(self):
+        return self.conn.execute("SELECT total FROM http_cache_size WHERE id = 0").fetchone()[0]
+
+    def _evict(self):
+        # Drop the least recently used responses until the cache fits:
+        total = self._total_size()
+        while total > self.max_bytes:
+            oldest = self.conn.execute("SELECT url, size FROM http_cache ORDER BY used_at LIMIT ?", (EVICT_BATCH,)).fetchall()
+            if not oldest:
+                break
+            for url, size in oldest:
+                self.conn.execute("DELETE FROM http_cache WHERE url = ?", (url,))
+                self._resize(-size)
+                self.stats['evictions'] += 1
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def _touch(self, url):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE http_cache SET validated_at = ? WHERE url = ?", (time.time(), url))
+
+    def _fetch(self, url, **kwargs):
+        row = self._lookup(url)
+        if row is not None:
+            status, headers, content, etag, last_modified, validated_at = row
+            cached = CachedResponse(url, status, json.loads(headers), content, from_cache=True)
+            if time.time() - validated_at < fresh_for(cached.headers, self.fresh_for):
+                self._count('hits')
+                self._count('bytes_saved', len(content))
+                return cached
+            # Check whether it has changed:
+            conditions = {}
+            if etag:
+                conditions['If-None-Match'] = etag
+            if last_modified:
+                conditions['If-Modified-Since'] = last_modified
+            if conditions:
+                headers = dict(kwargs.pop('headers', None) or {}, **conditions)
+                r = self.session.get(url, headers=headers, **kwargs)
+                if r.status_code == 304:
+                    self._touch(url)
+                    self._count('revalidated')
+                    self._count('bytes_saved', len(content))
+                    return cached
+                return self._fetched(url, r)
+        return self._fetched(url, self.session.get(url, **kwargs))
+
+    def _fetched(self, url, r):
+        self._count('misses')
+        response = CachedResponse(url, r.status_code, r.headers, r.content)
+        # Only keep successful responses, stored under the URL that was asked for (i.e. before any redirects):
+        if r.status_code == 200:
+            self._store(response)
+        return response
+
+    def get(self, url, **kwargs):
+        '''
+        GET the URL, using the cache where possible. Any keyword arguments are passed on to requests.
+        '''
+        with self.lock:
+            waiting_for = self.in_flight.get(url)
+            if waiting_for is None:
+                done = self.in_flight[url] = threading.Event()
+        if waiting_for is not None:
+            # Another thread is already getting this URL, so wait and then use the cached copy:
+            waiting_for.wait()
+            self._count('shared')
+            return self._fetch(url, **kwargs)
+        try:
+            return self._fetch(url, **kwargs)
+        finally:
+            with self.lock:
+                del self.in_flight[url]
+            done.set()
+
+    def flush_stats(self, run):
+        '''
+        Add the counts so far in this process to the totals for the given run, and start counting again.
+        '''
+        with self.lock, self.conn:
+            for name in STATS_FIELDS:
+                self.conn.execute("INSERT INTO http_cache_stats (run, name, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (run, name) DO UPDATE SET value = value + excluded.value", (run, name, self.stats[name]))
+                self.stats[name] = 0
+
+    def run_stats(self, run):
+        '''
+        The totals for the given run, from all the processes that have flushed their stats.
+        '''
+        stats = dict((name, 0) for name in STATS_FIELDS)
+        with self.lock:
+            for name, value in self.conn.execute("SELECT name, value FROM http_cache_stats WHERE run = ?", (run,)):
+                stats[name] = value
+        return stats
+
+    def hit_ratio(self, stats=None):
+        stats = stats or self.stats
+        hits = stats['hits'] + stats['revalidated']
+        total = hits + stats['misses']
+        return hits / total if total else 0.0
+
+    def log_stats(self, run=None):
+        '''
+        Log the stats for the given run (then clear them), or for this process so far.
+        '''
+        if run is None:
+            stats = self.stats
+        else:
+            self.flush_stats(run)
+            stats = self.run_stats(run)
+            with self.lock, self.conn:
+                self.conn.execute("DELETE FROM http_cache_stats WHERE run = ?", (run,))
+        logger.info("HTTP cache hit ratio %.1f%%, saved %i bytes: %s" % (100 * self.hit_ratio(stats), stats['bytes_saved'], json.dumps(stats)))
+
+
+# The cache shared by all the DocumentMDEx instances in this process:
+_shared_cache = None
+
+
+def get_http_cache():
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = HttpCache()
+    return _shared_cache
@@ -0,0 +1,178 @@
+import time
+import threading
+import http.server
+import pytest
+import lib.docharvester.http_cache as http_cache
+from lib.docharvester.http_cache import HttpCache, cache_control, fresh_for
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    '''
+    Serves the pages in server.pages, as (headers, body) by path, answering conditional requests with a 304 if
+    the ETag matches, and recording the requests made.
+    '''
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.path == '/slow':
+            time.sleep(0.2)
+        headers, body = self.server.pages.get(self.path, ({}, b'page %s' % self.path.encode('utf-8')))
+        if headers.get('ETag') and self.headers.get('If-None-Match') == headers['ETag']:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    s = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    s.requests = []
+    s.pages = {}
+    s.url = 'http://127.0.0.1:%i' % s.server_address[1]
+    t = threading.Thread(target=s.serve_forever, daemon=True)
+    t.start()
+    yield s
+    s.shutdown()
+    s.server_close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Lets the tests move time on, so cached responses go stale:
+    class Clock(object):
+        now = 1000000.0
+    monkeypatch.setattr(http_cache.time, 'time', lambda: Clock.now)
+    return Clock
+
+
+def cache(tmp_path, **kwargs):
+    return HttpCache(str(tmp_path / 'cache.db'), **kwargs)
+
+
+def test_cache_control():
+    assert cache_control({ 'cache-control': 'public, Max-Age="60", no-cache' }) == { 'public': None, 'max-age': '60', 'no-cache': None }
+    assert fresh_for({ 'Cache-Control': 'max-age=60' }) == 60
+    assert fresh_for({ 'Cache-Control': 'max-age=60, no-cache' }) == 0
+    assert fresh_for({ 'Cache-Control': 'max-age=soon' }, default=10) == 10
+    assert fresh_for({}, default=10) == 10
+
+
+def test_fresh_responses_reused(tmp_path, server, clock):
+    c = cache(tmp_path)
+    r = c.get(server.url + '/a')
+    assert r.text == 'page /a'
+    assert not r.from_cache
+    r = c.get(server.url + '/a')
+    assert r.from_cache
+    assert r.content == b'page /a'
+    assert len(server.requests) == 1
+    assert c.stats['hits'] == 1
+    assert c.stats['bytes_saved'] == 7
+
+
+def test_revalidation(tmp_path, server, clock):
+    server.pages['/a'] = ({ 'ETag': '"v1"' }, b'one')
+    c = cache(tmp_path, fresh_for=60)
+    c.get(server.url + '/a')
+    clock.now += 61
+    # Unchanged, so the cached copy is used after a 304:
+    r = c.get(server.url + '/a')
+    assert r.from_cache
+    assert r.content == b'one'
+    assert server.requests[-1] == ('/a', '"v1"')
+    assert c.stats['revalidated'] == 1
+    # Which counts as validating it again:
+    c.get(server.url + '/a')
+    assert len(server.requests) == 2
+
+    # Changed, so the new copy replaces it:
+    server.pages['/a'] = ({ 'ETag': '"v2"' }, b'two')
+    clock.now += 61
+    r = c.get(server.url + '/a')
+    assert not r.from_cache
+    assert r.content == b'two'
+    assert c.get(server.url + '/a').content == b'two'
+
+
+def test_cache_control_honoured(tmp_path, server, clock):
+    server.pages['/max-age'] = ({ 'Cache-Control': 'max-age=10' }, b'x')
+    server.pages['/no-cache'] = ({ 'Cache-Control': 'no-cache', 'ETag': '"nc"' }, b'x')
+    server.pages['/no-store'] = ({ 'Cache-Control': 'no-store' }, b'x')
+    server.pages['/private'] = ({ 'Cache-Control': 'private, max-age=600' }, b'x')
+    c = cache(tmp_path, fresh_for=3600)
+    for path in ['/max-age', '/no-cache', '/no-store', '/private']:
+        c.get(server.url + path)
+    clock.now += 11
+    for path in ['/max-age', '/no-cache', '/no-store', '/private']:
+        c.get(server.url + path)
+    # Everything was asked for again, but the no-cache one was only revalidated:
+    assert [path for path, etag in server.requests[4:]] == ['/max-age', '/no-cache', '/no-store', '/private']
+    assert server.requests[5] == ('/no-cache', '"nc"')
+    assert c.stats['revalidated'] == 1
+    assert c.stats['stores'] == 3
+
+
+def test_least_recently_used_evicted(tmp_path, server, clock, monkeypatch):
+    monkeypatch.setattr(http_cache, 'EVICT_BATCH', 2)
+    for path in ['/a', '/b', '/c', '/d']:
+        server.pages[path] = ({}, b'x' * 100)
+    c = cache(tmp_path, max_bytes=300)
+    for path in ['/a', '/b', '/c']:
+        c.get(server.url + path)
+        clock.now += 1
+    # Using /a makes /b the least recently used:
+    assert c.get(server.url + '/a').from_cache
+    clock.now += 1
+    c.get(server.url + '/d')
+    assert c.stats['evictions'] == 1
+    assert c._total_size() == 300
+    assert [url for url, in c.conn.execute("SELECT url FROM http_cache ORDER BY used_at")] == \
+        [server.url + path for path in ['/c', '/a', '/d']]
+
+    # The running total carries over to a new instance, and replacing a response only counts the difference:
+    c = cache(tmp_path, max_bytes=300)
+    assert c._total_size() == 300
+    server.pages['/d'] = ({}, b'x' * 50)
+    clock.now += 3600
+    c.get(server.url + '/d')
+    assert c._total_size() == 250
+    assert c.stats['evictions'] == 0
+
+
+def test_concurrent_requests_collapsed(tmp_path, server, clock):
+    c = cache(tmp_path)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(c.get(server.url + '/slow'))) for i in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    assert len(server.requests) == 1
+    assert [r.content for r in results] == [b'page /slow'] * 5
+    assert c.stats['misses'] == 1
+    assert c.stats['shared'] == 4
+
+
+def test_run_stats(tmp_path, server, clock):
+    # Two processes doing parts of the same run:
+    c1 = cache(tmp_path)
+    c2 = cache(tmp_path)
+    c1.get(server.url + '/a')
+    c1.flush_stats('job/1')
+    c2.get(server.url + '/a')
+    c2.flush_stats('job/1')
+    stats = c1.run_stats('job/1')
+    assert stats['misses'] == 1
+    assert stats['hits'] == 1
+    assert c1.hit_ratio(stats) == 0.5
+    c1.log_stats('job/1')
+    assert c1.run_stats('job/1')['misses'] == 0
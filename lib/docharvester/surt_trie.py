@@ -0,0 +1,63 @@
+'''
+A prefix trie of SURTs, for quickly finding which of a large set of SURT prefixes (e.g. the seeds of all the
+Watched Targets) a URL falls under.
+
+The trie is built once for a set of prefixes, and then each lookup takes time proportional to the length of
+the SURT being looked up, no matter how many prefixes there are.
+'''
+
+# Key used to hold the values stored at a node (never clashes with a single character):
+_VALUES = None
+
+
+class SurtPrefixTrie(object):
+    '''
+    Maps SURT prefixes to values, where more than one value can be stored under each prefix.
+    '''
+
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, prefix, value):
+        node = self.root
+        for ch in prefix:
+            node = node.setdefault(ch, {})
+        node.setdefault(_VALUES, []).append(value)
+        self.size += 1
+
+    def _walk(self, surt):
+        # Yields the nodes for each prefix of the SURT that is in the trie, shortest first:
+        node = self.root
+        if _VALUES in node:
+            yield node
+        for ch in surt:
+            node = node.get(ch)
+            if node is None:
+                return
+            if _VALUES in node:
+                yield node
+
+    def matches(self, surt):
+        '''
+        Returns the distinct values stored under any prefix of the given SURT, shortest prefix first.
+        '''
+        found = []
+        seen = set()
+        for node in self._walk(surt):
+            for value in node[_VALUES]:
+                if value not in seen:
+                    seen.add(value)
+                    found.append(value)
+        return found
+
+    def has_match(self, surt):
+        '''
+        Is the given SURT under any of the prefixes?
+        '''
+        for node in self._walk(surt):
+            return True
+        return False
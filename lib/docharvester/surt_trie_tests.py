@@ -0,0 +1,49 @@
+from lib.docharvester.surt_trie import SurtPrefixTrie
+
+
+def test_empty_trie():
+    trie = SurtPrefixTrie()
+    assert len(trie) == 0
+    assert trie.matches('http://(uk,gov,') == []
+    assert not trie.has_match('http://(uk,gov,')
+    assert not trie.has_match('')
+
+
+def test_matches_shortest_prefix_first():
+    trie = SurtPrefixTrie()
+    trie.add('http://(uk,gov,www,', 'www')
+    trie.add('http://(uk,gov,', 'gov')
+    trie.add('http://(uk,', 'uk')
+    trie.add('http://(uk,gov,www,)/government/', 'government')
+    assert len(trie) == 4
+    assert trie.matches('http://(uk,gov,www,)/government/publications') == ['uk', 'gov', 'www', 'government']
+    assert trie.matches('http://(uk,gov,www,)/news') == ['uk', 'gov', 'www']
+    assert trie.matches('http://(uk,co,bbc,') == ['uk']
+    # Only whole prefixes count, not partial matches along the way:
+    assert trie.matches('http://(u') == []
+    assert trie.matches('http://(com,example,') == []
+
+
+def test_many_values_per_prefix():
+    trie = SurtPrefixTrie()
+    trie.add('http://(uk,gov,', 2)
+    trie.add('http://(uk,gov,', 1)
+    trie.add('http://(uk,gov,www,', 1)
+    trie.add('http://(uk,gov,www,', 3)
+    assert len(trie) == 4
+    # Values are kept in the order they were added, and only given once:
+    assert trie.matches('http://(uk,gov,www,)/') == [2, 1, 3]
+    assert trie.matches('http://(uk,gov,)/') == [2, 1]
+
+
+def test_has_match():
+    trie = SurtPrefixTrie()
+    trie.add('http://(uk,gov,', 0)
+    assert trie.has_match('http://(uk,gov,)/')
+    assert trie.has_match('http://(uk,gov,')
+    assert not trie.has_match('http://(uk,go')
+    assert not trie.has_match('https://(uk,gov,')
+    # An empty prefix matches everything:
+    trie.add('', 1)
+    assert trie.has_match('https://(com,example,)/')
+    assert trie.matches('http://(uk,gov,)/') == [1, 0]
@@ -5,11 +5,16 @@ import json
 import time
 import socket
 import requests
+import threading
 from prometheus_client import start_http_server
 from prometheus_client.core import GaugeMetricFamily, REGISTRY
 import logging
 from hapy import hapy
-from multiprocessing import Pool, Process
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from lib.heritrix3.fanout import FanOut
+from lib.heritrix3.history import RateTracker
+from lib.heritrix3.kafka_lag import TopicEndOffsets, partition_lag
 
 # Avoid warnings about certs.
 import urllib3
@@ -23,17 +28,161 @@ logger = logging.getLogger(__name__)
 TIMEOUT = 10
 socket.setdefaulttimeout(TIMEOUT)
 
+# The (connect, read) timeouts for each crawler API request. The FanOut cannot interrupt a call that is
+# blocked, so these are what make sure the threads making the calls are freed:
+REQUEST_TIMEOUT = (TIMEOUT / 2, TIMEOUT)
+
+# The longest a whole scrape can take, however slow the crawlers are:
+SCRAPE_TIMEOUT = 3 * TIMEOUT
+
+# Number of crawler API calls to run at once:
+MAX_WORKERS = 20
+
+# How often to poll the crawlers, in seconds:
+POLL_INTERVAL = int(os.environ.get("HERITRIX_POLL_INTERVAL", 30))
+
+# How long to use the results of DNS service discovery before looking again, in seconds:
+DISCOVERY_TTL = int(os.environ.get("HERITRIX_DISCOVERY_TTL", 300))
+
+# Kafka servers to get topic end offsets from, for crawl jobs that have a 'kafka_topic' set:
+KAFKA_BOOTSTRAP_SERVERS = os.environ.get("KAFKA_BOOTSTRAP_SERVERS")
+
 # Config file:
 CRAWL_JOBS_FILE = os.environ.get("CRAWL_JOBS_FILE", '../../dash/crawl-jobs-localhost-test.json')
 
 
 class Heritrix3Collector(object):
-
-    def __init__(self):
-        self.pool = Pool(20)
+    '''
+    Collects the status of all the Heritrix3 crawlers.
+
+    The API calls for all the crawlers are run concurrently by a FanOut, using a shared pool of threads and a
+    shared HTTP session, so polling only takes as long as the slowest crawler (and never longer than
+    SCRAPE_TIMEOUT).
+
+    Once start() has been called, the crawlers are polled in the background, and collect() serves the latest
+    snapshot straight away. If a crawler cannot be reached, its last good metrics are kept, and the snapshot
+    age metric shows how stale they are.
+
+    Crawlers found via DNS service discovery are cached for DISCOVERY_TTL seconds, and refreshed in the
+    background once that has passed, so DNS lookups are kept out of the polling loop.
+
+    A short history of the counters from each poll is kept, so URI, byte and Kafka consumption rates can be
+    exported directly, allowing for counters being reset when crawlers restart. If KAFKA_BOOTSTRAP_SERVERS
+    is set, the lag behind the end of each crawl job's 'kafka_topic' is exported too.
+    '''
+
+    def __init__(self, poll_interval=POLL_INTERVAL, max_workers=MAX_WORKERS, timeout=SCRAPE_TIMEOUT, crawl_jobs_file=None,
+                 request_timeout=REQUEST_TIMEOUT):
+        self.crawl_jobs_file = crawl_jobs_file or CRAWL_JOBS_FILE
+        self.fanout = FanOut(max_workers=max_workers, timeout=timeout)
+        # The (connect, read) timeouts for each crawler API request:
+        self.request_timeout = request_timeout
+        self.session = requests.Session()
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.poller = None
+        # Latest results for each crawler, by ID:
+        self.snapshot = {}
+        self.last_poll = None
+        # Results of DNS service discovery, by DNS SD name:
+        self.dns_lock = threading.Lock()
+        self.dns_cache = {}
+        self.dns_refreshing = set()
+        self.dns_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        # History of the counters, by (job ID, counter) keys:
+        self.rates = RateTracker()
+        self.end_offsets = TopicEndOffsets(KAFKA_BOOTSTRAP_SERVERS) if KAFKA_BOOTSTRAP_SERVERS else None
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.pool.close()
+        self.stop()
+        self.fanout.shutdown()
+        self.dns_executor.shutdown(wait=False)
+        self.session.close()
+
+    def start(self):
+        '''
+        Start polling the crawlers in the background.
+        '''
+        self.poller = threading.Thread(target=self._poll, name='heritrix3-poller', daemon=True)
+        self.poller.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def _poll(self):
+        while not self.stopping.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.exception("Exception while polling the crawlers!")
+            self.stopping.wait(self.poll_interval)
+
+    def refresh(self):
+        '''
+        Poll all the crawlers, and update the snapshot.
+        '''
+        start = time.time()
+        services = self.run_api_requests()
+        topic_offsets = self.fetch_topic_offsets(services)
+        now = time.time()
+        snapshot = {}
+        with self.lock:
+            for job in services:
+                entry = {
+                    'job': job,
+                    'up': job['state'].get('status') not in ["DOWN", "LOOKUP FAILED"],
+                    'updated_at': now,
+                    'fetch_secs': { 'status': job['state'].get('fetch_secs'), 'kafka': job.get('kafka_fetch_secs') }
+                }
+                previous = self.snapshot.get(job['id'])
+                if not entry['up'] and previous:
+                    # Keep serving the last good metrics, which will show up as getting stale:
+                    entry['job'] = previous['job']
+                    entry['updated_at'] = previous['updated_at']
+                else:
+                    self._update_rates(entry, now, topic_offsets)
+                snapshot[job['id']] = entry
+            self.rates.forget(lambda key: key[0] in snapshot)
+            self.snapshot = snapshot
+            self.last_poll = { 'duration': now - start, 'finished_at': now }
+        logger.info("Polled %i crawlers in %.2f seconds." % (len(services), now - start))
+
+    def fetch_topic_offsets(self, services):
+        '''
+        Get the end offsets of the Kafka topics the crawlers are consuming from, by topic.
+        '''
+        topic_offsets = {}
+        if self.end_offsets is None:
+            return topic_offsets
+        for topic in set(job['kafka_topic'] for job in services if job.get('kafka_topic')):
+            try:
+                topic_offsets[topic] = self.end_offsets.fetch(topic)
+            except Exception as e:
+                logger.warning("Could not get the end offsets for Kafka topic %s: %s" % (topic, e))
+        return topic_offsets
+
+    def _update_rates(self, entry, now, topic_offsets):
+        job = entry['job']
+        ji = ((job['state'] or {}).get('details') or {}).get('job') or {}
+        self.rates.add((job['id'], 'uris'), now, float((ji.get('uriTotalsReport') or {}).get('downloadedUriCount', 0.0)))
+        self.rates.add((job['id'], 'novel-bytes'), now, float((ji.get('sizeTotalsReport') or {}).get('novel', 0.0)))
+        entry['rates'] = {
+            'uris': self.rates.rate((job['id'], 'uris')),
+            'novel-bytes': self.rates.rate((job['id'], 'novel-bytes')),
+            'kafka': {},
+        }
+        for p, offset in job.get('kafka_partitions', {}).items():
+            self.rates.add((job['id'], 'kafka', p), now, float(offset))
+            entry['rates']['kafka'][p] = self.rates.rate((job['id'], 'kafka', p))
+        entry['kafka_lag'] = partition_lag(job.get('kafka_partitions', {}), topic_offsets.get(job.get('kafka_topic'), {}))
+
+    def get_snapshot(self):
+        '''
+        The latest snapshot entries, sorted by crawler ID.
+        '''
+        with self.lock:
+            return [self.snapshot[job_id] for job_id in sorted(self.snapshot.keys())]
 
     def load_as_json(self, filename):
         script_dir = os.path.dirname(__file__)
@@ -41,9 +190,18 @@ class Heritrix3Collector(object):
         with open(file_path, 'r') as fi:
             return json.load(fi)
 
+    def crawl_jobs_path(self):
+        '''
+        The crawl jobs file, relative to the working directory, or failing that, to this package (where the
+        default one lives).
+        '''
+        if os.path.exists(self.crawl_jobs_file):
+            return os.path.abspath(self.crawl_jobs_file)
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), self.crawl_jobs_file)
+
     def lookup_services(self):
         # Load the config file:
-        service_list = self.load_as_json(os.path.join(os.path.dirname(__file__), CRAWL_JOBS_FILE))
+        service_list = self.load_as_json(self.crawl_jobs_path())
 
         # Find the services. If there are any DNS Service Discovery entries, filter them out.
         services = []
@@ -54,70 +212,147 @@ class Heritrix3Collector(object):
             else:
                 services.append(job)
 
-        # For each DNS SD entry, use DNS to discover the service:
+        # For each DNS SD entry, use the cached results of DNS discovery:
         for job in dns_sd:
-            # DNS SD under Docker uses this form of naming to discover services:
-            dns_name = 'tasks.%s' % job['dns_sd_name']
-            #
-            # WARNING Under 'alpine' builds this only ever returned 12 or less entries!
-            #
-            try:
-                # Look up service IP addresses via DNS:
-                (hostname, alias, ipaddrlist) = socket.gethostbyname_ex(dns_name)
-                for ip in ipaddrlist:
-                    logger.debug("For %s got (%s,%s,%s)" % (dns_name, hostname, alias, ipaddrlist))
-                    # Make a copy of the dict to put the values in:
-                    dns_job = dict(job)
-                    # Default to using the IP address:
-                    dns_host = ip
-                    dns_job['id'] = '%s:%s' % (dns_job['id'], ip)
-                    # Find the IP-level hostname via reverse lookup:
-                    (r_hostname, r_aliaslist, r_ipaddrlist) = socket.gethostbyaddr(ip)
-                    # look for a domain alias that matches the expected form:
-                    for r_alias in r_aliaslist:
-                        if r_alias.startswith(job['dns_sd_name']):
-                            # Use this instead of the raw IP:
-                            dns_host = r_alias
-                            dns_job['id'] = r_alias
-                            break
-                    # Set the URL:
-                    dns_job['url'] = 'https://%s:8443/' % dns_host
-                    # Remember:
-                    services.append(dns_job)
-            except socket.gaierror as e:
-                print(e)
-                pass
+            services.extend(self._discovered(job))
 
         return services
 
-    def do(self, action):
-        # Find the list of Heritrixen to talk to
-        services = self.lookup_services()
+    def _discovered(self, job):
+        '''
+        The crawlers found for a DNS SD entry, from the cache. The first time, this waits for DNS. After
+        that, a refresh is started in the background when the entry expires, and the cached list is used
+        until it is done.
+        '''
+        name = job['dns_sd_name']
+        with self.dns_lock:
+            cached = self.dns_cache.get(name)
+            if cached and cached['expires'] < time.time() and name not in self.dns_refreshing:
+                self.dns_refreshing.add(name)
+                threading.Thread(target=self._refresh_discovery, args=(job,), name='dns-%s' % name, daemon=True).start()
+        if cached is None:
+            self._refresh_discovery(job)
+            with self.dns_lock:
+                cached = self.dns_cache[name]
+        # Copies, as the crawl status gets added to these:
+        return [dict(j) for j in cached['jobs']]
+
+    def _refresh_discovery(self, job):
+        name = job['dns_sd_name']
+        ttl = DISCOVERY_TTL
+        with self.dns_lock:
+            previous = self.dns_cache.get(name, {}).get('jobs', [])
+        jobs = previous
+        try:
+            jobs = self.discover_services(job, previous)
+            logger.info("Discovered %i crawlers for %s" % (len(jobs), name))
+        except Exception as e:
+            # Keep using what we found last time:
+            logger.warning("DNS service discovery for %s failed, keeping %i known crawlers: %s" % (name, len(previous), e))
+            # Try again sooner than usual:
+            ttl = min(DISCOVERY_TTL, POLL_INTERVAL)
+        finally:
+            with self.dns_lock:
+                self.dns_cache[name] = { 'jobs': jobs, 'expires': time.time() + ttl }
+                self.dns_refreshing.discard(name)
+
+    def discover_services(self, job, previous=[]):
+        '''
+        Use DNS to discover the crawlers for a DNS SD entry. The reverse lookups are run concurrently, and if
+        one fails, the crawler's entry from the previous discovery is used, if there is one.
+        '''
+        # DNS SD under Docker uses this form of naming to discover services:
+        dns_name = 'tasks.%s' % job['dns_sd_name']
+        #
+        # WARNING Under 'alpine' builds this only ever returned 12 or less entries!
+        #
+        # Look up service IP addresses via DNS:
+        (hostname, alias, ipaddrlist) = socket.gethostbyname_ex(dns_name)
+        logger.debug("For %s got (%s,%s,%s)" % (dns_name, hostname, alias, ipaddrlist))
+        known = { j['ip']: j for j in previous }
+        services = []
+        for ip, dns_job in zip(ipaddrlist, self.dns_executor.map(partial(self._reverse_lookup, job), ipaddrlist)):
+            if dns_job is None:
+                dns_job = known.get(ip)
+            if dns_job is None:
+                # Default to using the IP address:
+                dns_job = dict(job, ip=ip, id='%s:%s' % (job['id'], ip), url='https://%s:8443/' % ip)
+            services.append(dns_job)
+        return services
 
-        # Parallel check for H3 job status:
-        argsv = []
-        for job in services:
-            logger.debug("Looking up %s" % job)
-            server_url = job['url']
-            server_user = os.getenv('HERITRIX_USERNAME', "admin")
-            server_pass = os.getenv('HERITRIX_PASSWORD', "heritrix")
-            # app.logger.info(json.dumps(server, indent=4))
-            argsv.append((job['id'], job['job_name'], server_url, server_user, server_pass, action))
-        # Wait for all...
-        result_list = self.pool.map(do_h3_action, argsv)
-        self.pool.terminate()
-        self.pool.join()
-        # Collect:
-        results = {}
-        for job, status in result_list:
-            results[job] = status
-
-        # Merge the results in:
+    def _reverse_lookup(self, job, ip):
+        try:
+            # Find the IP-level hostname via reverse lookup:
+            (r_hostname, r_aliaslist, r_ipaddrlist) = socket.gethostbyaddr(ip)
+        except (socket.herror, socket.gaierror, socket.timeout) as e:
+            logger.warning("Reverse lookup of %s failed: %s" % (ip, e))
+            return None
+        # Make a copy of the dict to put the values in:
+        dns_job = dict(job, ip=ip)
+        # Default to using the IP address:
+        dns_host = ip
+        dns_job['id'] = '%s:%s' % (dns_job['id'], ip)
+        # look for a domain alias that matches the expected form:
+        for r_alias in r_aliaslist:
+            if r_alias.startswith(job['dns_sd_name']):
+                # Use this instead of the raw IP:
+                dns_host = r_alias
+                dns_job['id'] = r_alias
+                break
+        # Set the URL:
+        dns_job['url'] = 'https://%s:8443/' % dns_host
+        return dns_job
+
+    def _job_args(self, job):
+        logger.debug("Looking up %s" % job)
+        server_user = os.getenv('HERITRIX_USERNAME', "admin")
+        server_pass = os.getenv('HERITRIX_PASSWORD', "heritrix")
+        return (job['id'], job['job_name'], job['url'], server_user, server_pass)
+
+    def _run_all(self, calls):
+        '''
+        Run the given (job_id, callable) pairs concurrently, returning their (job_id, state) results in order.
+        '''
+        return [self._to_state(result) for result in self.fanout.run_all(calls)]
+
+    def _to_state(self, result):
+        if result.error:
+            state = { 'status': "DOWN", 'error': "%s while checking Heritrix!" % result.error }
+        else:
+            job_id, state = result.value
+        state['fetch_secs'] = result.secs
+        return result.key, state
+
+    def _merge_states(self, services, results):
         for job in services:
             job['state'] = results[job['id']]
             if not job['url']:
                 job['state']['status'] = "LOOKUP FAILED"
 
+    def _action_call(self, job, action):
+        if action == 'status':
+            return partial(get_h3_status, self._job_args(job), timeout=self.request_timeout)
+        return partial(do_h3_action, self._job_args(job) + (action,), session=self.session, timeout=self.request_timeout)
+
+    def stream(self, action, services=None):
+        '''
+        Run an action on all the crawlers (or just the given ones) at once, yielding each crawler's job
+        dict, with the outcome in job['state'], as soon as it answers.
+        '''
+        if services is None:
+            services = self.lookup_services()
+        jobs = { job['id']: job for job in services }
+        calls = [(job['id'], self._action_call(job, action)) for job in services]
+        for result in self.fanout.stream(calls):
+            job_id, state = self._to_state(result)
+            job = jobs[job_id]
+            self._merge_states([job], { job_id: state })
+            yield job
+
+    def do(self, action):
+        # Run the action on all of the Heritrixen at once:
+        services = list(self.stream(action))
+
         # Sort services by ID:
         services = sorted(services, key=lambda k: k['id'])
 
@@ -161,37 +396,22 @@ class Heritrix3Collector(object):
         # Find the list of Heritrixen to talk to
         services = self.lookup_services()
 
-        # Parallel check for H3 job status:
-        argsv = []
+        # Get the job status and the KafkaReport from all of them at once:
+        calls = []
         for job in services:
-            logger.debug("Looking up %s" % job)
-            server_url = job['url']
-            server_user = os.getenv('HERITRIX_USERNAME', "admin")
-            server_pass = os.getenv('HERITRIX_PASSWORD', "heritrix")
-            # app.logger.info(json.dumps(server, indent=4))
-            argsv.append((job['id'], job['job_name'], server_url, server_user, server_pass))
-        # Wait for all...
-        result_list = self.pool.map(get_h3_status, argsv)
-        self.pool.terminate()
-        self.pool.join()
-        # Collect:
-        results = {}
-        for job, status in result_list:
-            results[job] = status
-
-        # Merge the results in:
+            calls.append((job['id'], self._action_call(job, 'status')))
         for job in services:
-            job['state'] = results[job['id']]
-            if not job['url']:
-                job['state']['status'] = "LOOKUP FAILED"
-
-        # Also get the KafkaReport:
-        kafka_results = Heritrix3Collector().do('kafka-report')
-        for h in services:
-            for k in kafka_results['services']:
-                if h['url'] == k['url']:
-                    h['kafka_consumed'] = k['kafka_consumed']
-                    h['kafka_partitions'] = k['kafka_partitions']
+            calls.append((job['id'], self._action_call(job, 'kafka-report')))
+        results = self._run_all(calls)
+        self._merge_states(services, dict(results[:len(services)]))
+
+        # Work out the Kafka offsets from the reports:
+        reports = [dict(job, state=state) for job, (job_id, state) in zip(services, results[len(services):])]
+        self.aggregate_kafka_reports(reports)
+        for h, k in zip(services, reports):
+            h['kafka_consumed'] = k['kafka_consumed']
+            h['kafka_partitions'] = k['kafka_partitions']
+            h['kafka_fetch_secs'] = k['state']['fetch_secs']
 
         # Sort services by ID:
         services = sorted(services, key=lambda k: k['id'])
@@ -199,10 +419,13 @@ class Heritrix3Collector(object):
         return services
 
     def collect(self):
+        # If not polling in the background, poll now:
+        if self.poller is None:
+            self.refresh()
         for m in self._collect():
             filtered = []
             for s in m.samples:
-                name, labels, value = s
+                name, labels, value = s[:3]
                 if not isinstance(value, float):
                     logger.warning("This sample is not a float! %s, %s, %s" % (name, labels, value))
                 else:
@@ -253,9 +476,61 @@ class Heritrix3Collector(object):
             'Kafka total offset, indicating messages consumed by client.',
             labels=["jobname", "deployment", "id"]) # No hyphens in label names please!
 
-        result = self.run_api_requests()
+        m_rates = GaugeMetricFamily(
+            'heritrix3_crawl_job_rate_per_second',
+            'Recent rates of a Heritrix3 crawl job, worked out by the exporter, labeled by kind',
+            labels=["jobname", "deployment", "id", "kind"]) # No hyphens in label names please!
+
+        m_kr = GaugeMetricFamily(
+            'kafka_consumer_rate_per_second',
+            'Recent rate of Kafka messages consumed by client, per partition.',
+            labels=["jobname", "deployment", "id", "partition"]) # No hyphens in label names please!
+
+        m_kl = GaugeMetricFamily(
+            'kafka_consumer_lag',
+            'Estimated number of Kafka messages not yet consumed by client, per partition.',
+            labels=["jobname", "deployment", "id", "partition"]) # No hyphens in label names please!
+
+        m_klt = GaugeMetricFamily(
+            'kafka_consumer_lag_total',
+            'Estimated total number of Kafka messages not yet consumed by client.',
+            labels=["jobname", "deployment", "id"]) # No hyphens in label names please!
+
+        m_up = GaugeMetricFamily(
+            'heritrix3_exporter_crawler_up',
+            'Whether the last attempt to get the status of a Heritrix3 crawl job worked (1) or not (0)',
+            labels=["jobname", "deployment", "id"]) # No hyphens in label names please!
+
+        m_age = GaugeMetricFamily(
+            'heritrix3_exporter_snapshot_age_seconds',
+            'How long ago the metrics for a Heritrix3 crawl job were last updated',
+            labels=["jobname", "deployment", "id"]) # No hyphens in label names please!
+
+        m_fetch = GaugeMetricFamily(
+            'heritrix3_exporter_fetch_duration_seconds',
+            'How long the last requests to a Heritrix3 crawl job took, labeled by kind',
+            labels=["jobname", "deployment", "id", "kind"]) # No hyphens in label names please!
+
+        m_poll = GaugeMetricFamily(
+            'heritrix3_exporter_poll_duration_seconds',
+            'How long the last poll of all the Heritrix3 crawl jobs took')
+
+        m_poll_ts = GaugeMetricFamily(
+            'heritrix3_exporter_last_poll_timestamp_seconds',
+            'When the last poll of all the Heritrix3 crawl jobs finished')
 
-        for job in result:
+        m_overdue = GaugeMetricFamily(
+            'heritrix3_exporter_overdue_calls',
+            'Number of crawler API calls that timed out but are still tying up a thread')
+        m_overdue.add_metric([], float(self.fanout.overdue))
+
+        now = time.time()
+        if self.last_poll:
+            m_poll.add_metric([], float(self.last_poll['duration']))
+            m_poll_ts.add_metric([], float(self.last_poll['finished_at']))
+
+        for entry in self.get_snapshot():
+            job = entry['job']
             #print(json.dumps(job))
             # Get hold of the state and flags etc
             name = job['job_name']
@@ -264,6 +539,26 @@ class Heritrix3Collector(object):
             state = job['state'] or {}
             status = state['status'] or None
 
+            # Record how fresh the metrics are:
+            m_up.add_metric([name, deployment, id], 1.0 if entry['up'] else 0.0)
+            m_age.add_metric([name, deployment, id], float(now - entry['updated_at']))
+            for kind, secs in entry['fetch_secs'].items():
+                if secs is not None:
+                    m_fetch.add_metric([name, deployment, id, kind], float(secs))
+
+            # Rates and lag, if there is enough recent history:
+            rates = entry.get('rates', {})
+            for kind in ['uris', 'novel-bytes']:
+                if rates.get(kind) is not None:
+                    m_rates.add_metric([name, deployment, id, kind], float(rates[kind]))
+            for p, rate in rates.get('kafka', {}).items():
+                if rate is not None:
+                    m_kr.add_metric([name, deployment, id, str(p)], float(rate))
+            if entry.get('kafka_lag'):
+                for p, lag in entry['kafka_lag'].items():
+                    m_kl.add_metric([name, deployment, id, str(p)], float(lag))
+                m_klt.add_metric([name, deployment, id], float(sum(entry['kafka_lag'].values())))
+
             # Get the URI metrics
             try:
                 # URIs:
@@ -334,7 +629,7 @@ class Heritrix3Collector(object):
                     steps = ji.get('threadReport', {}).get('steps', {})
                     if steps is not None:
                         steps = steps.get('value',[])
-                        if isinstance(steps, basestring):
+                        if isinstance(steps, str):
                             steps = [steps]
                         for step_value in steps:
                             splut = re.split(' ', step_value, maxsplit=1)
@@ -348,7 +643,7 @@ class Heritrix3Collector(object):
                     procs = ji.get('threadReport', {}).get('processors', {})
                     if procs is not None:
                         procs = procs.get('value',[])
-                        if isinstance(procs, basestring):
+                        if isinstance(procs, str):
                             procs = [procs]
                         for proc_value in procs:
                             splut = re.split(' ', proc_value, maxsplit=1)
@@ -377,6 +672,16 @@ class Heritrix3Collector(object):
         yield m_ts
         yield m_kc
         yield m_kt
+        yield m_rates
+        yield m_kr
+        yield m_kl
+        yield m_klt
+        yield m_up
+        yield m_age
+        yield m_fetch
+        yield m_poll
+        yield m_poll_ts
+        yield m_overdue
 
 
 def dict_values_to_floats(d, k, excluding=list()):
@@ -388,10 +693,10 @@ def dict_values_to_floats(d, k, excluding=list()):
                     d[k][sk] = None
 
 
-def get_h3_status(args):
+def get_h3_status(args, timeout=REQUEST_TIMEOUT):
     job_id, job_name, server_url, server_user, server_pass = args
     # Set up connection to H3:
-    h = hapy.Hapy(server_url, username=server_user, password=server_pass, timeout=TIMEOUT)
+    h = hapy.Hapy(server_url, username=server_user, password=server_pass, timeout=timeout)
     state = {}
     try:
         logger.info("Getting status for job %s on %s" % (job_name, server_url))
@@ -419,10 +724,11 @@ def get_h3_status(args):
     return job_id, state
 
 
-def do_h3_action(args):
+def do_h3_action(args, session=None, timeout=REQUEST_TIMEOUT):
     job_id, job_name, server_url, server_user, server_pass, action = args
+    session = session or requests
     # Set up connection to H3:
-    h = hapy.Hapy(server_url, username=server_user, password=server_pass, timeout=TIMEOUT)
+    h = hapy.Hapy(server_url, username=server_user, password=server_pass, timeout=timeout)
     state = {}
     try:
         if action == 'pause':
@@ -454,13 +760,13 @@ def do_h3_action(args):
         elif action == 'kafka-report':
             logger.info("Requesting KafkaReport from job %s on server %s." % (job_name, server_url))
             url = '%s/job/%s/report/KafkaUrlReceiverReport' % (h.base_url, job_name)
-            r = requests.get(
+            r = session.get(
                 url=url,
                 auth=h.auth,
                 verify=not h.insecure,
                 timeout=h.timeout
             )
-            state['message'] = "Requested Kafka Report of job %s on server %s:\n%s" % (job_name, server_url, r.content)
+            state['message'] = "Requested Kafka Report of job %s on server %s:\n%s" % (job_name, server_url, r.text)
         else:
             logger.warning("Unrecognised crawler action! '%s'" % action)
             state['error'] = "Unrecognised crawler action! '%s'" % action
@@ -474,7 +780,9 @@ def do_h3_action(args):
 
 
 if __name__ == "__main__":
-    REGISTRY.register(Heritrix3Collector())
+    collector = Heritrix3Collector()
+    collector.start()
+    REGISTRY.register(collector)
     start_http_server(9118)
     while True: time.sleep(1)
 
@@ -0,0 +1,215 @@
+import json
+import time
+import socket
+import threading
+import pytest
+
+# The collector talks to the crawlers via hapy:
+pytest.importorskip('hapy.hapy')
+
+import lib.heritrix3.collector as collector
+from lib.heritrix3.collector import Heritrix3Collector
+from prometheus_client import CollectorRegistry
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out waiting!"
+        time.sleep(0.01)
+
+
+class FakeCrawlers(object):
+    '''
+    Answers status and Kafka report calls for the crawlers, which are up unless listed in `down`.
+    '''
+
+    def __init__(self):
+        self.down = set()
+        self.downloaded = 0
+        self.calls = 0
+        self.timeouts = []
+        self.lock = threading.Lock()
+
+    def get_h3_status(self, args, timeout=None):
+        job_id = args[0]
+        with self.lock:
+            self.calls += 1
+            self.timeouts.append(timeout)
+        if job_id in self.down:
+            return job_id, { 'status': 'DOWN', 'error': 'Simulated failure' }
+        return job_id, { 'status': 'RUNNING', 'details': { 'job': { 'uriTotalsReport': { 'downloadedUriCount': float(self.downloaded) } } } }
+
+    def do_h3_action(self, args, session=None, timeout=None):
+        with self.lock:
+            self.timeouts.append(timeout)
+        return args[0], { 'message': '' }
+
+
+@pytest.fixture
+def crawlers(monkeypatch):
+    c = FakeCrawlers()
+    monkeypatch.setattr(collector, 'get_h3_status', c.get_h3_status)
+    monkeypatch.setattr(collector, 'do_h3_action', c.do_h3_action)
+    return c
+
+
+def jobs_file(tmp_path, jobs):
+    path = tmp_path / 'crawl-jobs.json'
+    path.write_text(json.dumps(jobs))
+    return str(path)
+
+
+def static_jobs(tmp_path):
+    return jobs_file(tmp_path, [{ 'id': i, 'job_name': 'frequent', 'deployment': 'test', 'url': 'http://%s:8443/' % i } for i in ['a', 'b']])
+
+
+def samples(h3):
+    registry = CollectorRegistry()
+    registry.register(h3)
+    return registry
+
+
+def test_stale_crawler_keeps_last_good_metrics(tmp_path, crawlers):
+    h3 = Heritrix3Collector(crawl_jobs_file=static_jobs(tmp_path))
+    crawlers.downloaded = 10
+    h3.refresh()
+    first = dict((entry['job']['id'], entry) for entry in h3.get_snapshot())
+    assert first['a']['up'] and first['b']['up']
+
+    # Crawler 'b' stops answering:
+    crawlers.down.add('b')
+    crawlers.downloaded = 20
+    time.sleep(0.05)
+    h3.refresh()
+    second = dict((entry['job']['id'], entry) for entry in h3.get_snapshot())
+    assert second['a']['updated_at'] > first['a']['updated_at']
+    assert not second['b']['up']
+    assert second['b']['updated_at'] == first['b']['updated_at']
+    assert second['b']['job']['state']['status'] == 'RUNNING'
+
+    # So it is reported as down, with its last good metrics, which are getting older:
+    registry = samples(h3)
+    labels = { 'jobname': 'frequent', 'deployment': 'test', 'id': 'b' }
+    assert registry.get_sample_value('heritrix3_exporter_crawler_up', labels) == 0.0
+    assert registry.get_sample_value('heritrix3_exporter_snapshot_age_seconds', labels) >= 0.05
+    assert registry.get_sample_value('heritrix3_crawl_job_uris_total', dict(labels, kind='downloaded')) == 10.0
+    assert registry.get_sample_value('heritrix3_crawl_job_uris_total', dict(labels, kind='downloaded', id='a')) == 20.0
+    h3.__exit__(None, None, None)
+
+
+def test_request_timeout_passed_to_each_call(tmp_path, crawlers):
+    h3 = Heritrix3Collector(crawl_jobs_file=static_jobs(tmp_path), request_timeout=(5, 60))
+    list(h3.stream('checkpoint', h3.lookup_services()))
+    list(h3.stream('status', h3.lookup_services()))
+    assert crawlers.timeouts == [(5, 60)] * 4
+    h3.__exit__(None, None, None)
+
+
+def test_background_polling(tmp_path, crawlers):
+    h3 = Heritrix3Collector(poll_interval=0.05, crawl_jobs_file=static_jobs(tmp_path))
+    h3.start()
+    try:
+        wait_until(lambda: h3.last_poll is not None)
+        first_poll = h3.last_poll['finished_at']
+        # The snapshot is refreshed in the background:
+        crawlers.downloaded = 5
+        wait_until(lambda: h3.last_poll['finished_at'] > first_poll)
+        wait_until(lambda: h3.get_snapshot()[0]['job']['state']['details']['job']['uriTotalsReport']['downloadedUriCount'] == 5)
+        # And collecting serves the snapshot, rather than polling the crawlers:
+        h3.stop()
+        h3.poller.join(5)
+        calls = crawlers.calls
+        registry = samples(h3)
+        assert registry.get_sample_value('heritrix3_exporter_crawler_up', { 'jobname': 'frequent', 'deployment': 'test', 'id': 'a' }) == 1.0
+        assert crawlers.calls == calls
+    finally:
+        h3.__exit__(None, None, None)
+
+
+class FakeDNS(object):
+    '''
+    Resolves the DNS SD name to the IPs in `ips`, with reverse lookups failing for any listed in `no_reverse`.
+    '''
+
+    def __init__(self, ips):
+        self.ips = ips
+        self.no_reverse = set()
+        self.fail = False
+        self.lookups = 0
+
+    def gethostbyname_ex(self, name):
+        self.lookups += 1
+        assert name == 'tasks.heritrix-worker'
+        if self.fail:
+            raise socket.gaierror("Simulated DNS failure")
+        return name, [], list(self.ips)
+
+    def gethostbyaddr(self, ip):
+        if ip in self.no_reverse:
+            raise socket.herror("Simulated reverse lookup failure")
+        return 'host-%s' % ip, ['heritrix-worker.%s.net' % ip.split('.')[-1]], [ip]
+
+
+@pytest.fixture
+def dns(monkeypatch):
+    d = FakeDNS(['10.0.0.1', '10.0.0.2'])
+    monkeypatch.setattr(collector.socket, 'gethostbyname_ex', d.gethostbyname_ex)
+    monkeypatch.setattr(collector.socket, 'gethostbyaddr', d.gethostbyaddr)
+    return d
+
+
+def dns_jobs(tmp_path):
+    return jobs_file(tmp_path, [{ 'id': 'automatic', 'job_name': 'frequent', 'deployment': 'automatic', 'dns_sd_name': 'heritrix-worker' }])
+
+
+def ids(services):
+    return sorted(job['id'] for job in services)
+
+
+def test_discovery_cached_until_it_expires(tmp_path, dns, monkeypatch):
+    monkeypatch.setattr(collector, 'DISCOVERY_TTL', 0.2)
+    h3 = Heritrix3Collector(crawl_jobs_file=dns_jobs(tmp_path))
+    assert ids(h3.lookup_services()) == ['heritrix-worker.1.net', 'heritrix-worker.2.net']
+    assert h3.lookup_services()[0]['url'] == 'https://heritrix-worker.1.net:8443/'
+    assert dns.lookups == 1
+
+    # Within the TTL, the cached results are used, even if DNS has changed:
+    dns.ips = ['10.0.0.3']
+    assert ids(h3.lookup_services()) == ['heritrix-worker.1.net', 'heritrix-worker.2.net']
+    assert dns.lookups == 1
+
+    # Once it expires, the old results are used while DNS is checked in the background:
+    time.sleep(0.25)
+    assert ids(h3.lookup_services()) == ['heritrix-worker.1.net', 'heritrix-worker.2.net']
+    wait_until(lambda: ids(h3.lookup_services()) == ['heritrix-worker.3.net'])
+    assert dns.lookups == 2
+    h3.__exit__(None, None, None)
+
+
+def test_discovery_failures_keep_what_was_known(tmp_path, dns, monkeypatch):
+    monkeypatch.setattr(collector, 'DISCOVERY_TTL', 0.1)
+    monkeypatch.setattr(collector, 'POLL_INTERVAL', 0.05)
+    h3 = Heritrix3Collector(crawl_jobs_file=dns_jobs(tmp_path))
+    h3.lookup_services()
+
+    # If DNS fails, the crawlers found last time are kept, and DNS is retried sooner:
+    dns.fail = True
+    time.sleep(0.15)
+    h3.lookup_services()
+    wait_until(lambda: dns.lookups == 2 and not h3.dns_refreshing)
+    assert ids(h3.lookup_services()) == ['heritrix-worker.1.net', 'heritrix-worker.2.net']
+    assert h3.dns_cache['heritrix-worker']['expires'] - time.time() <= 0.05
+
+    # If a reverse lookup fails, the crawler's previous entry is used, and new crawlers get their IP address:
+    dns.fail = False
+    dns.ips = ['10.0.0.2', '10.0.0.4']
+    dns.no_reverse = set(['10.0.0.2', '10.0.0.4'])
+    time.sleep(0.1)
+    h3.lookup_services()
+    wait_until(lambda: dns.lookups == 3 and not h3.dns_refreshing)
+    services = dict((job['ip'], job) for job in h3.lookup_services())
+    assert services['10.0.0.2']['id'] == 'heritrix-worker.2.net'
+    assert services['10.0.0.4']['id'] == 'automatic:10.0.0.4'
+    assert services['10.0.0.4']['url'] == 'https://10.0.0.4:8443/'
+    h3.__exit__(None, None, None)
@@ -0,0 +1,159 @@
+'''
+Controls all the Heritrix3 crawlers at once, e.g. to pause, checkpoint or resume the whole fleet.
+
+The requests are sent to all the crawlers concurrently, and a JSON line is printed for each crawler as soon
+as it answers. The exit code is non-zero if any of them failed.
+'''
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ['status', 'pause', 'unpause', 'launch', 'resume', 'checkpoint', 'terminate', 'kafka-report']
+
+# Default number of crawlers to talk to at once:
+DEFAULT_PARALLELISM = 20
+
+# Default deadline for each crawler to answer, in seconds:
+DEFAULT_TIMEOUT = 30
+
+# The most time to allow for connecting to each crawler, in seconds:
+CONNECT_TIMEOUT = 5
+
+# How long to wait for checkpoints to appear, and how often to check, in seconds:
+DEFAULT_VERIFY_TIMEOUT = 600
+DEFAULT_VERIFY_INTERVAL = 10
+
+
+def latest_checkpoint(job):
+    '''
+    The name of the most recent checkpoint listed in a crawler's status, if any.
+    '''
+    details = job['state'].get('details') or {}
+    files = (details.get('job') or {}).get('checkpointFiles') or []
+    if isinstance(files, dict):
+        files = files.get('value') or []
+    if isinstance(files, str):
+        files = [files]
+    # Checkpoint names start with a sequence number, e.g. 'cp00012-20200101120000':
+    return max(files) if files else None
+
+
+def failed(job):
+    return 'error' in job['state'] or job['state'].get('status') in ["DOWN", "LOOKUP FAILED"]
+
+
+def summarise(job, action):
+    state = job['state']
+    result = {
+        'id': job['id'],
+        'job_name': job['job_name'],
+        'url': job['url'],
+        'action': action,
+        'ok': not failed(job),
+        'secs': round(state.get('fetch_secs', 0), 3),
+    }
+    for key in ['status', 'message', 'error', 'checkpoint', 'verified']:
+        if key in state:
+            result[key] = state[key]
+    return result
+
+
+def verify_checkpoints(h3, jobs, before, timeout=DEFAULT_VERIFY_TIMEOUT, interval=DEFAULT_VERIFY_INTERVAL):
+    '''
+    Poll the given crawlers until each one lists a newer checkpoint than it did before, yielding each one as
+    it is verified, and then any that did not manage it in time.
+    '''
+    waiting = { job['id']: job for job in jobs }
+    deadline = time.time() + timeout
+    while waiting and time.time() < deadline:
+        time.sleep(min(interval, max(0, deadline - time.time())))
+        for job in h3.stream('status', list(waiting.values())):
+            checkpoint = latest_checkpoint(job)
+            if checkpoint and checkpoint != before.get(job['id']):
+                job['state']['checkpoint'] = checkpoint
+                job['state']['verified'] = True
+                del waiting[job['id']]
+                yield job
+    for job in waiting.values():
+        job['state']['verified'] = False
+        job['state'].setdefault('error', "No new checkpoint after %i seconds!" % timeout)
+        yield job
+
+
+def main():
+    # Set up a parser:
+    parser = argparse.ArgumentParser(prog='crawlctl', description='Run an action on all the Heritrix3 crawlers at once.')
+
+    parser.add_argument('-v', '--verbose', action='store_true', help='Verbose logging.')
+    parser.add_argument('-j', '--jobs-file', type=str, default=os.environ.get("CRAWL_JOBS_FILE"),
+        help='The JSON file listing the crawl jobs, relative to the working directory (defaults to $CRAWL_JOBS_FILE).')
+    parser.add_argument('--only', type=str, action='append',
+        help='Only talk to the crawler with this ID. Can be given more than once.')
+    parser.add_argument('-P', '--parallelism', type=int, default=DEFAULT_PARALLELISM,
+        help='The maximum number of crawlers to talk to at once (defaults to %i).' % DEFAULT_PARALLELISM)
+    parser.add_argument('-T', '--timeout', type=int, default=DEFAULT_TIMEOUT,
+        help='How long to wait for each crawler to answer each request, in seconds (defaults to %i).' % DEFAULT_TIMEOUT)
+    parser.add_argument('--verify', action='store_true',
+        help='For checkpoint: wait until each crawler lists a new checkpoint.')
+    parser.add_argument('--verify-timeout', type=int, default=DEFAULT_VERIFY_TIMEOUT,
+        help='How long to wait for the checkpoints, in seconds (defaults to %i).' % DEFAULT_VERIFY_TIMEOUT)
+    parser.add_argument('--verify-interval', type=int, default=DEFAULT_VERIFY_INTERVAL,
+        help='How often to check for the checkpoints, in seconds (defaults to %i).' % DEFAULT_VERIFY_INTERVAL)
+    parser.add_argument('action', choices=ACTIONS, help='The action to run on the crawlers.')
+
+    # And PARSE it:
+    args = parser.parse_args()
+
+    if args.verify and args.action != 'checkpoint':
+        parser.error("--verify can only be used with the checkpoint action.")
+
+    # Imported here, so the help works even without the crawler client libraries:
+    from lib.heritrix3.collector import Heritrix3Collector
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+
+    # Each API request gets the whole deadline to answer in, as e.g. checkpointing a big crawl can take a while:
+    request_timeout = (min(CONNECT_TIMEOUT, args.timeout), args.timeout)
+    h3 = Heritrix3Collector(max_workers=args.parallelism, timeout=args.timeout, crawl_jobs_file=args.jobs_file,
+        request_timeout=request_timeout)
+    services = h3.lookup_services()
+    if args.only:
+        services = [job for job in services if job['id'] in args.only]
+    if len(services) == 0:
+        logger.error("No crawlers found!")
+        sys.exit(1)
+
+    # For checkpoint-then-verify, note the current checkpoints first:
+    before = {}
+    if args.verify:
+        for job in h3.stream('status', services):
+            before[job['id']] = latest_checkpoint(job)
+
+    # Run the action, reporting on each crawler as it answers:
+    all_ok = True
+    done = []
+    for job in h3.stream(args.action, services):
+        if failed(job):
+            all_ok = False
+        elif args.verify:
+            # Report once verified, below:
+            done.append(job)
+            continue
+        print(json.dumps(summarise(job, args.action)), flush=True)
+
+    if args.verify:
+        for job in verify_checkpoints(h3, done, before, args.verify_timeout, args.verify_interval):
+            if not job['state']['verified']:
+                all_ok = False
+            print(json.dumps(summarise(job, args.action)), flush=True)
+
+    if not all_ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import sys
+import json
+import types
+import pytest
+from lib.heritrix3 import crawlctl
+
+
+class StubCollector(object):
+    '''
+    Stands in for the Heritrix3Collector, with crawlers that answer from canned states.
+    '''
+    instances = []
+    # The checkpoints crawlers add when asked to checkpoint:
+    new_checkpoints = { 'a': 'cp00002-2020', 'b': 'cp00001-2020' }
+
+    def __init__(self, max_workers=None, timeout=None, crawl_jobs_file=None, request_timeout=None):
+        self.crawl_jobs_file = crawl_jobs_file
+        self.timeout = timeout
+        self.request_timeout = request_timeout
+        self.calls = []
+        # The checkpoints each crawler lists:
+        self.checkpoints = { 'a': ['cp00001-2020'], 'b': [], 'down': [] }
+        StubCollector.instances.append(self)
+
+    def lookup_services(self):
+        return [{ 'id': i, 'job_name': 'frequent', 'url': 'http://%s:8443/' % i } for i in ['a', 'b', 'down']]
+
+    def stream(self, action, services):
+        self.calls.append((action, [job['id'] for job in services]))
+        for job in services:
+            if job['id'] == 'down':
+                job['state'] = { 'status': 'DOWN', 'error': 'Simulated failure', 'fetch_secs': 0.1 }
+            elif action == 'status':
+                files = self.checkpoints[job['id']]
+                job['state'] = { 'status': 'RUNNING', 'fetch_secs': 0.1,
+                    'details': { 'job': { 'checkpointFiles': { 'value': list(files) } } } }
+            else:
+                if action == 'checkpoint' and job['id'] in self.new_checkpoints:
+                    self.checkpoints[job['id']].append(self.new_checkpoints[job['id']])
+                job['state'] = { 'message': 'Requested %s' % action, 'fetch_secs': 0.1 }
+            yield job
+
+
+@pytest.fixture(autouse=True)
+def stub_collector(monkeypatch):
+    # So the real collector (and the crawler client library) is never imported:
+    module = types.ModuleType('lib.heritrix3.collector')
+    module.Heritrix3Collector = StubCollector
+    monkeypatch.setitem(sys.modules, 'lib.heritrix3.collector', module)
+    StubCollector.instances = []
+
+
+def run(monkeypatch, capsys, *args):
+    monkeypatch.setattr(sys, 'argv', ['crawlctl'] + list(args))
+    code = 0
+    try:
+        crawlctl.main()
+    except SystemExit as e:
+        code = e.code
+    return code, [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_action_fans_out(monkeypatch, capsys):
+    code, results = run(monkeypatch, capsys, '-j', 'jobs.json', 'pause')
+    h3 = StubCollector.instances[0]
+    assert h3.crawl_jobs_file == 'jobs.json'
+    assert h3.calls == [('pause', ['a', 'b', 'down'])]
+    assert [(r['id'], r['ok']) for r in results] == [('a', True), ('b', True), ('down', False)]
+    # One of the crawlers failed:
+    assert code == 1
+
+
+def test_only(monkeypatch, capsys):
+    code, results = run(monkeypatch, capsys, '--only', 'b', 'status')
+    assert [r['id'] for r in results] == ['b']
+    assert code == 0
+
+
+def test_verify_checkpoints(monkeypatch, capsys):
+    code, results = run(monkeypatch, capsys, '--only', 'a', '--only', 'b', '--verify', '--verify-interval', '0', 'checkpoint')
+    assert StubCollector.instances[0].calls[:2] == [('status', ['a', 'b']), ('checkpoint', ['a', 'b'])]
+    assert sorted((r['id'], r['verified'], r['checkpoint']) for r in results) == [('a', True, 'cp00002-2020'), ('b', True, 'cp00001-2020')]
+    assert code == 0
+
+
+def test_verify_times_out(monkeypatch, capsys):
+    # Crawler 'a' never lists a new checkpoint, so counts as failed once the time is up:
+    monkeypatch.setattr(StubCollector, 'new_checkpoints', { 'b': 'cp00001-2020' })
+    code, results = run(monkeypatch, capsys, '--only', 'a', '--only', 'b', '--verify', '--verify-timeout', '1', '--verify-interval', '0', 'checkpoint')
+    results = dict((r['id'], r) for r in results)
+    assert results['b']['verified'] is True
+    assert results['a']['verified'] is False
+    assert 'No new checkpoint' in results['a']['error']
+    assert code == 1
+
+
+def test_verify_only_for_checkpoints(monkeypatch, capsys):
+    code, results = run(monkeypatch, capsys, '--verify', 'pause')
+    assert code == 2
+
+
+def test_timeout_applies_to_each_request(monkeypatch, capsys):
+    # A slow checkpoint must get the whole deadline, not the collector's default request timeout:
+    code, results = run(monkeypatch, capsys, '--only', 'a', '-T', '60', 'checkpoint')
+    assert code == 0
+    h3 = StubCollector.instances[0]
+    assert h3.timeout == 60
+    assert h3.request_timeout == (crawlctl.CONNECT_TIMEOUT, 60)
+    # And a short deadline caps the connection time too:
+    run(monkeypatch, capsys, '--only', 'a', '-T', '2', 'status')
+    assert StubCollector.instances[1].request_timeout == (2, 2)
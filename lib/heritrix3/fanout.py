@@ -0,0 +1,117 @@
+'''
+Runs the same kind of request against many crawlers at once.
+
+The calls are made from a shared pool of threads, driven by an asyncio event loop, with a limit on how many
+run at once and a deadline for each one. Results are yielded as each call completes, so a slow crawler does
+not hold up reporting on the others. The pool is kept between runs, so the same FanOut can be used over and
+over (e.g. by the exporter's polling loop).
+
+A thread that is blocked cannot be interrupted, so the calls must set their own network timeouts (see
+REQUEST_TIMEOUT in the collector) to make sure the threads are freed. Calls that have not started by their
+deadline are cancelled, and calls still running after it are counted as overdue, until they finish. If
+all the threads are tied up with overdue calls, new calls fail straight away rather than queueing.
+'''
+import time
+import asyncio
+import threading
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Number of calls to run at once:
+DEFAULT_MAX_WORKERS = 20
+
+# The longest any one call can take, in seconds:
+DEFAULT_TIMEOUT = 30
+
+# The outcome of one call. Exactly one of value and error is set:
+FanOutResult = namedtuple('FanOutResult', ['key', 'value', 'error', 'secs'])
+
+
+class FanOut():
+    '''
+    Runs (key, callable) pairs concurrently, with at most max_workers running at once, and gives up on any
+    call that takes longer than timeout seconds.
+    '''
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, timeout=DEFAULT_TIMEOUT):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Calls we have given up on, but which are still tying up a thread:
+        self.lock = threading.Lock()
+        self.overdue = 0
+
+    def shutdown(self):
+        # Don't wait, as there may be calls that have timed out but are still running:
+        self.executor.shutdown(wait=False)
+
+    def _overdue_finished(self, future):
+        with self.lock:
+            self.overdue -= 1
+
+    async def _call(self, semaphore, key, call):
+        async with semaphore:
+            start = time.time()
+            with self.lock:
+                if self.overdue >= self.max_workers:
+                    logger.warning("Not calling %s, as all %i threads are busy with overdue calls" % (key, self.max_workers))
+                    return FanOutResult(key, None, "All threads busy with overdue calls", 0.0)
+            future = self.executor.submit(call)
+            try:
+                value = await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+                return FanOutResult(key, value, None, time.time() - start)
+            except asyncio.TimeoutError:
+                # Calls that have not started yet get cancelled, but running ones carry on in their thread:
+                if not future.cancelled():
+                    with self.lock:
+                        self.overdue += 1
+                    future.add_done_callback(self._overdue_finished)
+                logger.warning("Timed out talking to %s (%i calls overdue)" % (key, self.overdue))
+                return FanOutResult(key, None, "Timed out after %i seconds" % self.timeout, time.time() - start)
+            except Exception as e:
+                logger.exception("Call to %s failed" % key)
+                return FanOutResult(key, None, str(e), time.time() - start)
+
+    async def _start(self, calls):
+        # The semaphore has to be created inside the event loop it is used from:
+        semaphore = asyncio.Semaphore(self.max_workers)
+        return { asyncio.ensure_future(self._call(semaphore, key, call)): i for i, (key, call) in enumerate(calls) }
+
+    def _run(self, calls):
+        # Yields (index, result) pairs as the calls complete:
+        loop = asyncio.new_event_loop()
+        tasks = {}
+        try:
+            tasks = loop.run_until_complete(self._start(calls))
+            pending = set(tasks.keys())
+            while pending:
+                done, pending = loop.run_until_complete(asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED))
+                for task in done:
+                    yield tasks[task], task.result()
+        finally:
+            # If the caller stopped early, cancel whatever is still waiting to run:
+            unfinished = [task for task in tasks if not task.done()]
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                loop.run_until_complete(asyncio.wait(unfinished))
+            loop.close()
+
+    def stream(self, calls):
+        '''
+        Run the calls, yielding a FanOutResult for each one as it completes.
+        '''
+        for i, result in self._run(calls):
+            yield result
+
+    def run_all(self, calls):
+        '''
+        Run the calls, returning the list of FanOutResults in the same order as the calls.
+        '''
+        results = [None] * len(calls)
+        for i, result in self._run(calls):
+            results[i] = result
+        return results
@@ -0,0 +1,42 @@
+import time
+import threading
+from lib.heritrix3.fanout import FanOut
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out waiting!"
+        time.sleep(0.01)
+
+
+def test_run_all():
+    def fail():
+        raise Exception("Simulated failure")
+    fanout = FanOut(max_workers=2)
+    results = fanout.run_all([('a', lambda: 1), ('b', fail), ('c', lambda: 3)])
+    assert [(r.key, r.value, r.error) for r in results] == [('a', 1, None), ('b', None, 'Simulated failure'), ('c', 3, None)]
+    fanout.shutdown()
+
+
+def test_stream_yields_fastest_first():
+    fanout = FanOut(max_workers=3)
+    calls = [('slow', lambda: time.sleep(0.3)), ('fast', lambda: None)]
+    assert [r.key for r in fanout.stream(calls)] == ['fast', 'slow']
+    fanout.shutdown()
+
+
+def test_overdue_calls_tracked_until_they_finish():
+    release = threading.Event()
+    fanout = FanOut(max_workers=1, timeout=0.1)
+    results = fanout.run_all([('stuck', release.wait), ('next', lambda: 2)])
+    assert results[0].error.startswith('Timed out')
+    # The only thread is still tied up, so the next call fails rather than queueing behind it:
+    assert results[1].error == 'All threads busy with overdue calls'
+    assert fanout.overdue == 1
+
+    # Once the stuck call returns, the thread is free again:
+    release.set()
+    wait_until(lambda: fanout.overdue == 0)
+    assert fanout.run_all([('next', lambda: 2)])[0].value == 2
+    fanout.shutdown()
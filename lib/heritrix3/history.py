@@ -0,0 +1,67 @@
+'''
+Keeps a short history of counter values, so rates can be worked out in the exporter itself, rather than
+relying on Prometheus rate() over irregular scrapes.
+'''
+import collections
+
+# Number of samples to keep for each counter (i.e. the rate is averaged over this many polls):
+HISTORY_SIZE = 10
+
+
+class CounterHistory():
+    '''
+    A ring buffer of (timestamp, value) samples of a counter.
+
+    If the counter goes down (e.g. because the crawler was restarted), it is assumed to have been reset to
+    zero in between, so the new value is all counted as an increase. This is how Prometheus handles resets.
+    '''
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.samples = collections.deque(maxlen=size)
+
+    def add(self, timestamp, value):
+        # Ignore repeated samples, e.g. from stale data:
+        if self.samples and timestamp <= self.samples[-1][0]:
+            return
+        self.samples.append((timestamp, value))
+
+    def increase(self):
+        total = 0
+        for (t0, v0), (t1, v1) in zip(self.samples, list(self.samples)[1:]):
+            total += v1 - v0 if v1 >= v0 else v1
+        return total
+
+    def rate(self):
+        '''
+        The average increase per second over the samples, or None if there are not enough of them.
+        '''
+        if len(self.samples) < 2:
+            return None
+        secs = self.samples[-1][0] - self.samples[0][0]
+        return self.increase() / secs
+
+
+class RateTracker():
+    '''
+    Keeps a CounterHistory for each of a set of keys, e.g. (job ID, counter name) pairs.
+    '''
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        self.histories = {}
+
+    def add(self, key, timestamp, value):
+        if key not in self.histories:
+            self.histories[key] = CounterHistory(self.size)
+        self.histories[key].add(timestamp, value)
+
+    def rate(self, key):
+        history = self.histories.get(key)
+        return history.rate() if history else None
+
+    def forget(self, keep):
+        '''
+        Drop the histories for any keys that keep(key) says are no longer needed.
+        '''
+        for key in [key for key in self.histories if not keep(key)]:
+            del self.histories[key]
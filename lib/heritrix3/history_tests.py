@@ -0,0 +1,49 @@
+from lib.heritrix3.history import CounterHistory, RateTracker
+
+
+def test_rate_needs_two_samples():
+    h = CounterHistory()
+    assert h.rate() is None
+    h.add(100, 5)
+    assert h.rate() is None
+    h.add(110, 25)
+    assert h.rate() == 2.0
+
+
+def test_repeated_samples_ignored():
+    h = CounterHistory()
+    h.add(100, 0)
+    h.add(110, 10)
+    h.add(110, 50)
+    h.add(105, 50)
+    assert list(h.samples) == [(100, 0), (110, 10)]
+
+
+def test_window_rollover():
+    h = CounterHistory(size=3)
+    for t, v in [(0, 0), (10, 1000), (20, 1010), (30, 1020)]:
+        h.add(t, v)
+    # The big jump at the start has dropped out of the window:
+    assert list(h.samples) == [(10, 1000), (20, 1010), (30, 1020)]
+    assert h.increase() == 20
+    assert h.rate() == 1.0
+
+
+def test_counter_reset():
+    h = CounterHistory()
+    for t, v in [(0, 100), (10, 200), (20, 50), (30, 150)]:
+        h.add(t, v)
+    # The drop is taken as a reset to zero, so 100 + 50 + 100:
+    assert h.increase() == 250
+    assert h.rate() == 250 / 30
+
+
+def test_rate_tracker():
+    rt = RateTracker(size=5)
+    assert rt.rate(('job', 'uris')) is None
+    rt.add(('job', 'uris'), 0, 0)
+    rt.add(('job', 'uris'), 10, 100)
+    rt.add(('old-job', 'uris'), 0, 0)
+    assert rt.rate(('job', 'uris')) == 10.0
+    rt.forget(lambda key: key[0] == 'job')
+    assert list(rt.histories.keys()) == [('job', 'uris')]
@@ -0,0 +1,59 @@
+'''
+Looks up the end offsets of the Kafka topics the crawlers consume from, so the exporter can estimate how far
+behind each crawler is.
+'''
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TopicEndOffsets():
+    '''
+    Fetches the latest offset of every partition of a topic, using one long-lived Kafka client.
+    '''
+
+    def __init__(self, bootstrap_servers, consumer=None):
+        '''
+        :param bootstrap_servers: The Kafka servers to connect to.
+        :param consumer: A KafkaConsumer to use, rather than creating one when first needed.
+        '''
+        self.bootstrap_servers = bootstrap_servers
+        self.consumer = consumer
+
+    def _get_consumer(self):
+        if self.consumer is None:
+            # Imported here, so the exporter still works when Kafka is not configured:
+            from kafka import KafkaConsumer
+            self.consumer = KafkaConsumer(bootstrap_servers=self.bootstrap_servers, enable_auto_commit=False)
+        return self.consumer
+
+    def topic_partition(self, topic, partition):
+        from kafka import TopicPartition
+        return TopicPartition(topic, partition)
+
+    def fetch(self, topic):
+        '''
+        Returns a dict of partition number to end offset for the given topic.
+        '''
+        consumer = self._get_consumer()
+        partitions = consumer.partitions_for_topic(topic)
+        if not partitions:
+            logger.warning("No partitions found for Kafka topic %s" % topic)
+            return {}
+        offsets = consumer.end_offsets([self.topic_partition(topic, p) for p in partitions])
+        return { tp.partition: offset for tp, offset in offsets.items() }
+
+    def close(self):
+        if self.consumer is not None:
+            self.consumer.close()
+            self.consumer = None
+
+
+def partition_lag(consumed_offsets, end_offsets):
+    '''
+    How far behind the end of each partition a consumer is, given dicts of partition number to offset.
+
+    Partitions with no known end offset are left out. As the end offsets are fetched separately, the consumer
+    can appear to be ahead, so the lag is never less than zero.
+    '''
+    return { p: max(0, end_offsets[p] - offset) for p, offset in consumed_offsets.items() if p in end_offsets }
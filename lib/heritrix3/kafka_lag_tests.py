@@ -0,0 +1,47 @@
+import collections
+from lib.heritrix3.kafka_lag import TopicEndOffsets, partition_lag
+
+TopicPartition = collections.namedtuple('TopicPartition', ['topic', 'partition'])
+
+
+class FakeConsumer(object):
+    '''
+    Stands in for a KafkaConsumer, with the end offsets of each partition of each topic.
+    '''
+
+    def __init__(self, topics):
+        self.topics = topics
+        self.closed = False
+
+    def partitions_for_topic(self, topic):
+        return set(self.topics[topic].keys()) if topic in self.topics else None
+
+    def end_offsets(self, partitions):
+        return { tp: self.topics[tp.topic][tp.partition] for tp in partitions }
+
+    def close(self):
+        self.closed = True
+
+
+def end_offsets(topics):
+    offsets = TopicEndOffsets('localhost:9092', consumer=FakeConsumer(topics))
+    offsets.topic_partition = TopicPartition
+    return offsets
+
+
+def test_fetch():
+    offsets = end_offsets({ 'fc.tocrawl': { 0: 100, 1: 250 }, 'other': { 0: 1 } })
+    assert offsets.fetch('fc.tocrawl') == { 0: 100, 1: 250 }
+    assert offsets.fetch('missing') == {}
+    consumer = offsets.consumer
+    offsets.close()
+    assert consumer.closed
+    assert offsets.consumer is None
+
+
+def test_lag():
+    offsets = end_offsets({ 'fc.tocrawl': { 0: 100, 1: 250, 2: 10 } })
+    consumed = { 0: 40, 1: 260, 3: 5 }
+    # Partitions with no end offset are left out, and being ahead counts as no lag:
+    assert partition_lag(consumed, offsets.fetch('fc.tocrawl')) == { 0: 60, 1: 0 }
+    assert partition_lag(consumed, {}) == {}
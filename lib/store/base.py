@@ -0,0 +1,232 @@
+'''
+The common interface for file store back-ends, and the shared helpers they use.
+
+Back-ends are selected using a store URI, e.g.
+
+- webhdfs://access@hdfs.api.wa.bl.uk/ to talk to HDFS via the WebHDFS API.
+- file:///mnt/hdfs to work with a local (or NFS) mount of the same data.
+
+'''
+
+import os
+import abc
+import string
+import logging
+import hashlib
+import datetime
+import urllib.parse
+from lib.store.hdfs_layout import HdfsPathParser
+from lib.store.scheduler import DEFAULT_TRANSFER_CLASS
+
+HDFS_ID_PREFIX = "hdfs://hdfs:54310"
+
+# Size of the chunks to read and write at once:
+CHUNK_SIZE = 10485760
+
+logger = logging.getLogger(__name__)
+
+def permissions_octal_to_string(octal):
+    result = ''
+    for _ in range(3):
+        octal, digit = divmod(octal, 10)
+        for value, letter in reversed([(4, "r"), (2, "w"), (1, "x")]):
+            result = (letter if digit & value else "-") + result
+    return result
+
+def check_sha512_hash(path, file_hash):
+    '''
+    Utility funtion to check if a hash is well-formed.
+    '''
+    logger.debug("Checking file %s hash %s" % (path, file_hash))
+    if len(file_hash) != 128:
+        raise Exception("%s hash not 128 character length [%s]" % (path, len(file_hash)))
+    if not all(c in string.hexdigits for c in file_hash):
+        raise Exception("%s hash not all hex [%s]" % (path, file_hash))
+
+def calculate_sha512_local(path):
+    with open(path, 'rb') as reader:
+        file_hash = calculate_reader_hash(reader, path)
+
+    return file_hash
+
+def calculate_reader_hash(reader, path="unknown-path"):
+    """
+    Reads a file-like object in chunks, building up the SHA512 hash.
+
+    :param reader: A file-like object that allows the data to be read
+    :param path: The path of this file-like object, for reporting purposes
+    :return:
+    """
+    sha = hashlib.sha512()
+    while True:
+        data = reader.read(CHUNK_SIZE)
+        if not data:
+            reader.close()
+            break
+        sha.update(data)
+    path_hash = sha.hexdigest()
+
+    # check hash is not obviously wrong:
+    check_sha512_hash(path, path_hash)
+
+    # return it:
+    return path_hash
+
+
+def open_store(store_uri):
+    '''
+    Set up a store client based on the scheme of the given store URI.
+    '''
+    uri = urllib.parse.urlparse(store_uri)
+    if uri.scheme == 'webhdfs':
+        from lib.store.webhdfs import WebHDFSStore, DEFAULT_WEBHDFS_USER
+        webhdfs_url = "http://%s/" % uri.hostname
+        if uri.port:
+            webhdfs_url = "http://%s:%i/" % (uri.hostname, uri.port)
+        return WebHDFSStore(webhdfs_url, uri.username or DEFAULT_WEBHDFS_USER)
+    elif uri.scheme == 'file':
+        from lib.store.local import LocalStore
+        return LocalStore(uri.path or '/')
+    else:
+        raise Exception("Unsupported store URI scheme '%s' in %s" % (uri.scheme, store_uri))
+
+
+class Store(abc.ABC):
+    '''
+    The operations every file store back-end supports.
+
+    Paths are always absolute store paths, like '/heritrix/output/...', whatever the back-end.
+    '''
+    # Set a refresh-date to indicate when we did this lookup:
+    refresh_date = datetime.datetime.utcnow().isoformat(timespec='milliseconds')+'Z'
+
+    # Which class of transfer this client's traffic counts as (see lib.store.scheduler):
+    transfer_class = DEFAULT_TRANSFER_CLASS
+
+    @abc.abstractmethod
+    def put(self, local_path, path, backup_and_replace=False):
+        '''
+        Upload a local file, returning True once the copy in the store is known to match it (raising an
+        exception if not).
+        '''
+
+    @abc.abstractmethod
+    def list(self, path, recursive=False):
+        pass
+
+    @abc.abstractmethod
+    def exists(self, path):
+        pass
+
+    @abc.abstractmethod
+    def rm(self, path):
+        pass
+
+    @abc.abstractmethod
+    def stream(self, path, offset=0, length=None):
+        '''
+        Returns a file-like context manager for reading from the given file.
+        '''
+
+    def read(self, path, offset=0, length=None):
+        with self.stream(path, offset, length) as reader:
+            while True:
+                data = reader.read(CHUNK_SIZE)
+                if not data:
+                    break
+                yield data
+
+    def download(self, path, writer, offset=0, length=None):
+        '''
+        Copy a file, or a byte range of it, into the given binary file object.
+        '''
+        for data in self.read(path, offset=offset, length=length):
+            writer.write(data)
+
+    def calculate_sha512(self, path):
+        '''
+        Calculate the SHA512 hash of a single file on the store
+        '''
+        with self.stream(path) as reader:
+            file_hash = calculate_reader_hash(reader, path)
+
+        return file_hash
+
+    def move(self, local_path, path):
+        '''
+        Upload a local file, and then delete it, but only once put() has checked that the hash of the copy in
+        the store matches. That is also the case if the file was already in the store, so a move that was
+        interrupted after the upload can just be run again.
+        '''
+        # Perform the PUT first:
+        success = self.put(local_path, path)
+        # And delete the local file if that worked:
+        if success == True:
+            os.remove(local_path)
+
+    def _to_info(self, path, status):
+        # Add the file path:
+        status['file_path'] = path
+        # Classify based on HDFS storage conventions:
+        item = HdfsPathParser(status).to_dict()
+        # Work out the permissions string:
+        if status['permission'].isnumeric():
+            permissions = permissions_octal_to_string(int(status['permission']))
+            if status['type'] == 'DIRECTORY':
+                permissions = "d" + permissions
+            else:
+                permissions = "-" + permissions
+        else:
+            permissions = status['permission']
+        # And return as a 'standard' dict:
+        return {
+                'id': '%s%s' % (HDFS_ID_PREFIX, item['file_path']),
+                'refresh_date_dt': self.refresh_date,
+                'file_path_s': item['file_path'],
+                'file_size_l': item['file_size'],
+                'file_ext_s': item['file_ext'],
+                'file_name_s': item['file_name'],
+                'permissions_s': permissions,
+                'hdfs_replicas_i': item['number_of_replicas'],
+                'hdfs_user_s': item['user_id'],
+                'hdfs_group_s': item['group_id'],
+                'modified_at_dt': "%sZ" % item['modified_at'],
+                'timestamp_dt': "%sZ" % item['timestamp'],
+                'year_i': item['timestamp'][0:4],
+                'recognised_b': item['recognised'],
+                'kind_s': item['kind'],
+                'collection_s': item['collection'],
+                'stream_s': item['stream'],
+                'job_s': item['job'],
+                'layout_s': item['layout']
+            }
+
+    def lsr_to_items(self, reader):
+        """
+        This task processes a raw list of files generated by the hadoop fs -lsr command.
+
+        As this can be a very large list, it avoids reading it all into memory. It
+        parses each line, and yields a suitable stream of parsed objects matching the WebHDFS API.
+        """
+        for line in reader:
+            if "lsr: DEPRECATED: Please use 'ls -R' instead." in line:
+                logger.warning(line)
+            else:
+                permissions, number_of_replicas, userid, groupid, filesize, modification_date, modification_time, filename = line.split(None, 7)
+                filename = filename.strip()
+                timestamp = datetime.datetime.strptime('%s %s' % (modification_date, modification_time), '%Y-%m-%d %H:%M')
+                info = {
+                    'permission' : permissions,
+                    'replication': number_of_replicas,
+                    'owner': userid,
+                    'group': groupid,
+                    'length': filesize,
+                    'modificationTime': timestamp.timestamp() * 1000,
+                    'pathSuffix': filename
+                }
+                # Skip directories:
+                if permissions[0] != 'd':
+                    yield self._to_info(filename,info)
+                    info['type'] = 'DIRECTORY'
+                else:
+                    info['type'] = 'FILE'
@@ -7,15 +7,18 @@ import sys
 import json
 import logging
 import argparse
-from lib.store.webhdfs import WebHDFSStore
+# n.b. the store back-ends are only imported once we know which one is needed, so the CLI starts up quickly:
+from lib.store.sync import StoreSync, DEFAULT_SYNC_WORKERS
+from lib.store.diff import diff_listings, REMOVED
+from lib.store.scheduler import get_scheduler, parse_bytes, DEFAULT_TRANSFER_CLASS
 
 logging.basicConfig(level=logging.WARNING, format='%(asctime)s: %(levelname)s - %(name)s - %(message)s')
 
 logger = logging.getLogger(__name__)
 
-# Defaults to using the production HDFS (via 'safe' gateway):
-# TODO Switch to a variable store URI for different backends.
-DEFAULT_STORE = os.environ.get("STORE_URI", "webhdfs://access@hdfs.api.wa.bl.uk/")
+# Defaults to using the production HDFS (via 'safe' gateway), unless a store URI is set, e.g.
+# webhdfs://access@hdfs.api.wa.bl.uk/ or file:///mnt/hdfs
+DEFAULT_STORE = os.environ.get("STORE_URI", None)
 DEFAULT_WEBHDFS = os.environ.get("WEBHDFS_URL", "http://hdfs.api.wa.bl.uk/")
 DEFAULT_WEBHDFS_USER = os.environ.get("WEBHDFS_USERNAME", "access")
 
@@ -31,8 +34,13 @@ def main():
         default=DEFAULT_WEBHDFS)
     parser.add_argument('-u', '--webhdfs-user', type=str, help='The WebHDFS user to act as (defaults to %s).' % DEFAULT_WEBHDFS_USER, 
         default=DEFAULT_WEBHDFS_USER)
+    parser.add_argument('-s', '--store-uri', type=str, help='The store to talk to, as a URI like webhdfs://USER@HOST/ or file:///PATH. Overrides the WebHDFS options (defaults to $STORE_URI if set).',
+        default=DEFAULT_STORE)
+    parser.add_argument('-b', '--bandwidth', type=str, help='Limit the overall transfer rate to this many bytes per second, e.g. "100M" (defaults to $STORE_BANDWIDTH, or no limit).')
+    parser.add_argument('-T', '--transfer-class', type=str, default=DEFAULT_TRANSFER_CLASS,
+        help='The class of transfer this is, which sets its share of the bandwidth, e.g. "crawl" or "backfill" (default is %s).' % DEFAULT_TRANSFER_CLASS)
     parser.add_argument('-v', '--verbose', action='store_true', help='Verbose logging.')
-    parser.add_argument('--dry-run', action='store_true', help='Do not modify the TrackDB.')
+    parser.add_argument('--dry-run', action='store_true', help='Do not modify the TrackDB, or just report what a sync would transfer.')
     parser.add_argument('-i', '--indent', type=int, help='Number of spaces to indent when emitting JSON.')
 
     # Use sub-parsers for different operations:
@@ -60,6 +68,25 @@ def main():
     parser_up.add_argument('local_path', type=str, help='The local path to read.')
     parser_up.add_argument('path', type=str, help='The store path to write to.')
 
+    # 'sync' subcommand - incrementally mirror a folder to or from the store:
+    parser_sync = subparsers.add_parser('sync', help='Sync a local folder to the store, or a store folder to local disk, only transferring missing or changed files.')
+    parser_sync.add_argument('-m', '--manifest', type=str, help='The manifest file to use (defaults to a hidden file in the local folder).')
+    parser_sync.add_argument('-c', '--checksum', action='store_true', help='Also compare SHA512 hashes of files that appear unchanged (hashes are cached in the manifest).')
+    parser_sync.add_argument('-r', '--rescan', action='store_true', help='Ignore any existing manifest and scan the destination instead.')
+    parser_sync.add_argument('-W', '--workers', type=int, default=DEFAULT_SYNC_WORKERS, help='Number of concurrent transfers (default is %i).' % DEFAULT_SYNC_WORKERS)
+    parser_sync.add_argument('src', type=str, help='The folder to sync from. Prefix store paths with "store:", e.g. "store:/heritrix/output/...".')
+    parser_sync.add_argument('dest', type=str, help='The folder to sync to. Prefix store paths with "store:".')
+
+    # 'diff' subcommand - compare two JSONL listings:
+    parser_diff = subparsers.add_parser('diff', help='Compare two JSONL listings (e.g. from "list -r -j"), outputting added and modified files as JSONL.')
+    parser_diff.add_argument('-B', '--buffer-size', type=str, default='64M', help='Amount of listing to sort in memory at once, e.g. 512M (default is 64M).')
+    parser_diff.add_argument('-t', '--tmp-dir', type=str, help='Folder to use for temporary sort files (defaults to the system temporary folder).')
+    parser_diff.add_argument('-U', '--unchanged', action='store_true', help='Also output files that have not changed.')
+    parser_diff.add_argument('-r', '--removed', type=str, help='Write the records of files that have been removed to this file.')
+    parser_diff.add_argument('-S', '--with-status', action='store_true', help='Output all differences, including removed files, with a "diff_status_s" field added. For reporting, not for importing into TrackDB.')
+    parser_diff.add_argument('old_jsonl', type=str, help='The older listing. Can be "-" for STDIN.')
+    parser_diff.add_argument('new_jsonl', type=str, help='The newer listing. Can be "-" for STDIN.')
+
     # 'delete' subcommand - delete a file from the store:
     parser_rm = subparsers.add_parser('delete', help='Delete a file from the store.')
     parser_rm.add_argument('path', type=str, help='The file to delete.')
@@ -76,8 +103,22 @@ def main():
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
 
-    # Set up client:
-    st = WebHDFSStore(args.webhdfs_url, args.webhdfs_user)
+    # Set up the bandwidth budget, if specified:
+    scheduler = get_scheduler()
+    if args.bandwidth:
+        scheduler.set_rate(parse_bytes(args.bandwidth))
+
+    # Set up client (not needed for comparing listings):
+    if args.op == 'diff':
+        st = None
+    elif args.store_uri:
+        from lib.store.base import open_store
+        st = open_store(args.store_uri)
+    else:
+        from lib.store.webhdfs import WebHDFSStore
+        st = WebHDFSStore(args.webhdfs_url, args.webhdfs_user)
+    if st:
+        st.transfer_class = args.transfer_class
 
     # Ops:
     logger.debug("Got args: %s" % args)
@@ -97,20 +138,43 @@ def main():
             for info in st.list(args.path, args.recursive):
                 print(info['file_path_s'])
     elif args.op == 'get':
-        reader = st.read(args.path, offset = args.offset, length = args.length)
         if args.local_path == '-':
-            for data in reader:
-                sys.stdout.buffer.write(data)
+            st.download(args.path, sys.stdout.buffer, offset = args.offset, length = args.length)
         else:
             if os.path.exists(args.local_path):
                 raise Exception("Path %s already exists! Refusing to overwrite.")
             else:
                 with open(args.local_path, 'wb') as f:
-                    for data in reader:
-                        f.write(data)
+                    st.download(args.path, f, offset = args.offset, length = args.length)
 
     elif args.op == 'put':
         st.put(args.local_path, args.path, args.backup_and_replace)
+    elif args.op == 'sync':
+        syncer = StoreSync(st, args.src, args.dest, manifest_path=args.manifest, checksum=args.checksum, workers=args.workers, rescan=args.rescan)
+        stats = syncer.run(dry_run=args.dry_run)
+        print(json.dumps(stats, indent=args.indent))
+        if stats['failed_i'] > 0:
+            raise Exception("%i transfers failed!" % stats['failed_i'])
+    elif args.op == 'diff':
+        old_reader = sys.stdin if args.old_jsonl == '-' else open(args.old_jsonl, 'r')
+        new_reader = sys.stdin if args.new_jsonl == '-' else open(args.new_jsonl, 'r')
+        removed_writer = open(args.removed, 'w') if args.removed else None
+        counts = {}
+        for status, item in diff_listings(old_reader, new_reader, parse_bytes(args.buffer_size), args.tmp_dir, args.unchanged):
+            counts[status] = counts.get(status, 0) + 1
+            if args.with_status:
+                item['diff_status_s'] = status
+            elif status == REMOVED:
+                # Keep removed files out of the main output, so it can be imported as-is:
+                if removed_writer:
+                    removed_writer.write(json.dumps(item))
+                    removed_writer.write("\n")
+                continue
+            sys.stdout.write(json.dumps(item))
+            sys.stdout.write("\n")
+        if removed_writer:
+            removed_writer.close()
+        logger.info("Differences: %s" % json.dumps(counts))
     elif args.op == 'rm':
         st.rm(args.path)
     elif args.op == 'lsr-to-jsonl':
@@ -139,6 +203,8 @@ def main():
     else:
         raise Exception("Not implemented!")
 
+    logger.debug("Transfer stats: %s" % json.dumps(scheduler.stats()))
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,157 @@
+'''
+Streaming comparison of two store listings, e.g. yesterday's and today's `store list -r -j` output.
+
+Listings can be far too big to hold in memory, so each one is first sorted by path using an
+external merge sort (sorted runs written to temporary files, then merged), and the two sorted
+streams are then walked together in a single pass, like a merge-join.
+
+The differences come out as (status, record) pairs, where the records are the usual JSONL listing
+records, unmodified, so added and modified ones can be passed straight to `trackdb files import`.
+'''
+import os
+import json
+import heapq
+import logging
+import tempfile
+import itertools
+
+logger = logging.getLogger(__name__)
+
+# Amount of listing text to sort in memory at once, in bytes:
+DEFAULT_BUFFER_BYTES = 64*1024*1024
+
+# Maximum number of sorted runs to merge at once, to stay well within open file limits:
+MAX_MERGE_FILES = 256
+
+# Fields that indicate a file has changed:
+DIFF_FIELDS = ['file_size_l', 'modified_at_dt']
+
+ADDED = 'added'
+REMOVED = 'removed'
+MODIFIED = 'modified'
+UNCHANGED = 'unchanged'
+
+
+def _path_of(line):
+    return json.loads(line)['file_path_s']
+
+
+def _keyed_lines(reader):
+    '''
+    Yields (path, line) tuples from a JSONL listing, skipping blank lines.
+    '''
+    for line in reader:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if line:
+            yield (_path_of(line), line)
+
+
+def _write_run(items, tmp_dir):
+    fd, run_path = tempfile.mkstemp(prefix='store-diff-', suffix='.run', dir=tmp_dir)
+    with os.fdopen(fd, 'w') as f:
+        for path, line in items:
+            f.write(line)
+            f.write("\n")
+    return run_path
+
+
+def _read_run(run_path):
+    with open(run_path) as f:
+        for item in _keyed_lines(f):
+            yield item
+
+
+def _merge(run_paths):
+    # Only compare paths, so entries for the same path stay in input order:
+    return heapq.merge(*[_read_run(p) for p in run_paths], key=lambda item: item[0])
+
+
+def _merge_runs(run_paths, tmp_dir):
+    '''
+    Merges sorted runs down to at most MAX_MERGE_FILES, writing intermediate runs as needed.
+    '''
+    while len(run_paths) > MAX_MERGE_FILES:
+        merged_paths = []
+        for i in range(0, len(run_paths), MAX_MERGE_FILES):
+            group = run_paths[i:i + MAX_MERGE_FILES]
+            merged_paths.append(_write_run(_merge(group), tmp_dir))
+            for p in group:
+                os.remove(p)
+        run_paths = merged_paths
+    return run_paths
+
+
+def sorted_listing(reader, buffer_bytes=DEFAULT_BUFFER_BYTES, tmp_dir=None):
+    '''
+    Yields (path, line) tuples for a listing in path order, using bounded memory.
+
+    If the same path appears more than once, the last entry wins.
+    '''
+    run_paths = []
+    try:
+        # Split the input into sorted runs of roughly buffer_bytes of text each:
+        items = []
+        items_bytes = 0
+        for seq, (path, line) in enumerate(_keyed_lines(reader)):
+            items.append((path, seq, line))
+            items_bytes += len(line)
+            if items_bytes >= buffer_bytes:
+                run_paths.append(_write_run([(p, l) for p, s, l in sorted(items)], tmp_dir))
+                items = []
+                items_bytes = 0
+        # Everything fitted in memory, so no need for temporary files:
+        if not run_paths:
+            merged = ((p, l) for p, s, l in sorted(items))
+        else:
+            if items:
+                run_paths.append(_write_run([(p, l) for p, s, l in sorted(items)], tmp_dir))
+            items = None
+            run_paths = _merge_runs(run_paths, tmp_dir)
+            logger.info("Merging %i sorted runs..." % len(run_paths))
+            merged = _merge(run_paths)
+        # Drop duplicate paths, keeping the last one:
+        for path, group in itertools.groupby(merged, key=lambda item: item[0]):
+            for item in group:
+                pass
+            yield item
+    finally:
+        for p in run_paths:
+            if os.path.exists(p):
+                os.remove(p)
+
+
+def _is_modified(old, new):
+    for field in DIFF_FIELDS:
+        if old.get(field, None) != new.get(field, None):
+            return True
+    return False
+
+
+def diff_listings(old_reader, new_reader, buffer_bytes=DEFAULT_BUFFER_BYTES, tmp_dir=None, include_unchanged=False):
+    '''
+    Compares two listings, yielding a (status, record) pair for each file that differs.
+
+    Added and modified files get the new record, removed files get the old one.
+    '''
+    old_items = sorted_listing(old_reader, buffer_bytes, tmp_dir)
+    new_items = sorted_listing(new_reader, buffer_bytes, tmp_dir)
+    old = next(old_items, None)
+    new = next(new_items, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[0] < new[0]):
+            yield REMOVED, json.loads(old[1])
+            old = next(old_items, None)
+        elif old is None or new[0] < old[0]:
+            yield ADDED, json.loads(new[1])
+            new = next(new_items, None)
+        else:
+            old_item = json.loads(old[1])
+            item = json.loads(new[1])
+            if _is_modified(old_item, item):
+                yield MODIFIED, item
+            elif include_unchanged:
+                yield UNCHANGED, item
+            old = next(old_items, None)
+            new = next(new_items, None)
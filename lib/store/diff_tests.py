@@ -0,0 +1,98 @@
+import os
+import io
+import json
+import lib.store.diff as diff
+from lib.store.diff import diff_listings, sorted_listing, ADDED, REMOVED, MODIFIED, UNCHANGED
+
+
+def listing(*records):
+    return io.StringIO("".join("%s\n" % json.dumps(r) for r in records))
+
+
+def record(path, size=10, modified='2020-01-01T00:00:00.000Z'):
+    return { 'file_path_s': path, 'file_size_l': size, 'modified_at_dt': modified }
+
+
+def test_sorted_listing_in_memory(tmp_path):
+    items = list(sorted_listing(listing(record('/c'), record('/a'), record('/b')), tmp_dir=str(tmp_path)))
+    assert [path for path, line in items] == ['/a', '/b', '/c']
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_sorted_listing_spills_runs(tmp_path, monkeypatch):
+    paths = ['/%04d' % i for i in range(200)]
+    records = [record(p) for p in reversed(paths)]
+    written = []
+    write_run = diff._write_run
+
+    def counting_write_run(items, tmp_dir):
+        run_path = write_run(items, tmp_dir)
+        written.append(run_path)
+        return run_path
+    monkeypatch.setattr(diff, '_write_run', counting_write_run)
+
+    # Each record is about 80 bytes, so this should give runs of about ten records:
+    items = list(sorted_listing(listing(*records), buffer_bytes=800, tmp_dir=str(tmp_path)))
+    assert [path for path, line in items] == paths
+    assert len(written) >= 15
+    # The temporary runs are all cleaned up:
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_multi_level_merge(tmp_path, monkeypatch):
+    # Force the runs to be merged in several passes:
+    monkeypatch.setattr(diff, 'MAX_MERGE_FILES', 3)
+    paths = ['/%04d' % i for i in range(100)]
+    records = [record(p) for p in paths[::2] + paths[1::2]]
+    items = list(sorted_listing(listing(*records), buffer_bytes=200, tmp_dir=str(tmp_path)))
+    assert [path for path, line in items] == paths
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_duplicate_paths_last_wins(tmp_path):
+    records = [record('/a', size=1), record('/b'), record('/a', size=2), record('/a', size=3)]
+    for buffer_bytes in [diff.DEFAULT_BUFFER_BYTES, 50]:
+        items = list(sorted_listing(listing(*records), buffer_bytes=buffer_bytes, tmp_dir=str(tmp_path)))
+        assert [path for path, line in items] == ['/a', '/b']
+        assert json.loads(items[0][1])['file_size_l'] == 3
+
+
+def test_diff_classification(tmp_path):
+    old = listing(
+        record('/same'),
+        record('/removed'),
+        record('/resized', size=10),
+        record('/touched'),
+        # Duplicates in the old listing, where the last one matches the new listing:
+        record('/dup', size=1),
+        record('/dup', size=2),
+    )
+    new = listing(
+        record('/touched', modified='2020-02-02T00:00:00.000Z'),
+        record('/added'),
+        record('/same'),
+        record('/resized', size=11),
+        record('/dup', size=2),
+        # Duplicates in the new listing, where the last one differs:
+        record('/added2', size=1),
+        record('/added2', size=5),
+    )
+    for buffer_bytes in [diff.DEFAULT_BUFFER_BYTES, 100]:
+        old.seek(0)
+        new.seek(0)
+        results = [(status, item['file_path_s'], item['file_size_l']) for status, item in
+            diff_listings(old, new, buffer_bytes=buffer_bytes, tmp_dir=str(tmp_path))]
+        assert results == [
+            (ADDED, '/added', 10),
+            (ADDED, '/added2', 5),
+            (REMOVED, '/removed', 10),
+            (MODIFIED, '/resized', 11),
+            (MODIFIED, '/touched', 10),
+        ]
+
+
+def test_diff_records_unmodified(tmp_path):
+    results = list(diff_listings(listing(record('/a')), listing(record('/a'), record('/b')), include_unchanged=True))
+    assert results == [(UNCHANGED, record('/a')), (ADDED, record('/b'))]
+    for status, item in results:
+        assert 'diff_status_s' not in item
@@ -0,0 +1,269 @@
+'''
+File storage back-end for a local or NFS mount of the store.
+
+Store paths are mapped onto a root folder, so e.g. with a root of /mnt/hdfs the store
+path /heritrix/output/x.warc.gz is read from /mnt/hdfs/heritrix/output/x.warc.gz
+
+Reads and hashes go via mmap, and copies use os.copy_file_range/os.sendfile where the
+platform supports them, so data does not have to pass through Python buffers.
+'''
+
+import os
+import io
+import pwd
+import grp
+import mmap
+import stat
+import logging
+import hashlib
+import datetime
+import posixpath as psp
+from lib.store.base import Store, CHUNK_SIZE, calculate_sha512_local, check_sha512_hash
+
+logger = logging.getLogger(__name__)
+
+
+def copy_fd_range(in_fd, out_fd, offset=0, count=None):
+    '''
+    Copy bytes between file descriptors in the kernel where possible.
+
+    Tries copy_file_range (file to file), then sendfile (file to anything), then falls back to read/write.
+
+    :return: the number of bytes copied.
+    '''
+    if count is None:
+        count = os.fstat(in_fd).st_size - offset
+    copied = 0
+    for method in ['copy_file_range', 'sendfile', None]:
+        try:
+            while copied < count:
+                size = min(count - copied, CHUNK_SIZE)
+                if method == 'copy_file_range' and hasattr(os, 'copy_file_range'):
+                    sent = os.copy_file_range(in_fd, out_fd, size, offset + copied)
+                elif method == 'sendfile' and hasattr(os, 'sendfile'):
+                    sent = os.sendfile(out_fd, in_fd, offset + copied, size)
+                elif method is None:
+                    data = os.pread(in_fd, size, offset + copied)
+                    sent = os.write(out_fd, data) if data else 0
+                else:
+                    break
+                if sent == 0:
+                    # Reached the end of the input:
+                    return copied
+                copied += sent
+            if copied >= count:
+                return copied
+        except OSError as e:
+            # Not supported for this pair of file descriptors, so try the next method (only if nothing sent yet):
+            if copied > 0:
+                raise
+            logger.debug("Could not use %s, falling back: %s" % (method, e))
+    return copied
+
+
+class MappedRangeReader(io.RawIOBase):
+    '''
+    A read-only file-like object over a byte range of a memory-mapped file.
+    '''
+
+    def __init__(self, path, offset=0, length=None):
+        self.path = path
+        self._f = open(path, 'rb')
+        size = os.fstat(self._f.fileno()).st_size
+        offset = offset or 0
+        if length is None or offset + length > size:
+            length = max(size - offset, 0)
+        self._start = offset
+        self._end = offset + length
+        self._pos = offset
+        # Zero-length files cannot be mapped:
+        self._mm = None
+        self._view = None
+        if size > 0:
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mm)
+
+    def readable(self):
+        return True
+
+    def view(self, size=-1):
+        '''
+        Return the next chunk as a memoryview of the mapped file, without copying.
+        '''
+        if size is None or size < 0:
+            end = self._end
+        else:
+            end = min(self._pos + size, self._end)
+        if self._view is None or end <= self._pos:
+            return memoryview(b'')
+        chunk = self._view[self._pos:end]
+        self._pos = end
+        return chunk
+
+    def read(self, size=-1):
+        return self.view(size).tobytes()
+
+    def readinto(self, b):
+        chunk = self.view(len(b))
+        n = len(chunk)
+        b[:n] = chunk
+        return n
+
+    def readline(self, size=-1):
+        if self._mm is None or self._pos >= self._end:
+            return b''
+        end = self._mm.find(b'\n', self._pos, self._end)
+        end = self._end if end == -1 else end + 1
+        if size is not None and size >= 0:
+            end = min(end, self._pos + size)
+        return self.read(end - self._pos)
+
+    def tell(self):
+        return self._pos - self._start
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:
+                # Callers still hold views, so leave it to the garbage collector:
+                pass
+            self._mm = None
+        self._f.close()
+        super(MappedRangeReader, self).close()
+
+
+class LocalStore(Store):
+    '''
+    A file store based on a local filesystem (or a mount of the store).
+    '''
+
+    def __init__(self, root='/'):
+        self.root = root
+
+    def _local_path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def _store_path(self, local_path):
+        return '/' + os.path.relpath(local_path, self.root).replace(os.path.sep, '/')
+
+    def put(self, local_path, path, backup_and_replace=False):
+        if os.path.isdir(local_path):
+            raise Exception("Cannot upload anything other than single files at this time!")
+        elif not os.path.isfile(local_path):
+            raise Exception("Unknown path type! Can't handle %s" % local_path)
+
+        # If the path is a directory, combine the paths:
+        dest_path = self._local_path(path)
+        if os.path.isdir(dest_path):
+            path = psp.join(path, os.path.basename(local_path))
+            dest_path = self._local_path(path)
+
+        # Calculate hash of local file:
+        local_hash = calculate_sha512_local(local_path)
+        logger.info("Local %s hash is %s " % (local_path, local_hash))
+
+        already_exists = os.path.exists(dest_path)
+        if already_exists and not backup_and_replace:
+            logger.warning("Path %s already exists! No upload will be attempted." % path)
+        else:
+            # Copy to a temporary path, and then move into place:
+            tmp_path = "%s_temp_" % dest_path
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            logger.info("Copying as %s" % tmp_path)
+            with open(local_path, 'rb') as reader, open(tmp_path, 'wb') as writer:
+                copy_fd_range(reader.fileno(), writer.fileno())
+                os.fsync(writer.fileno())
+            if backup_and_replace and already_exists:
+                date_stamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+                backup_path = "%s.bkp_%s" %( dest_path, date_stamp)
+                logger.warning("Renaming %s to %s..."% (dest_path, backup_path))
+                os.rename(dest_path, backup_path)
+            logger.info("Renaming %s to %s..."% (tmp_path, dest_path))
+            os.rename(tmp_path, dest_path)
+
+        store_hash = self.calculate_sha512(path)
+        if local_hash != store_hash:
+            raise Exception("Local & store hashes do not match for %s" % local_path)
+
+        logger.warning("Upload completed for %s" % path)
+        return True
+
+    def _status(self, local_path):
+        st = os.stat(local_path)
+        try:
+            owner = pwd.getpwuid(st.st_uid).pw_name
+        except KeyError:
+            owner = str(st.st_uid)
+        try:
+            group = grp.getgrgid(st.st_gid).gr_name
+        except KeyError:
+            group = str(st.st_gid)
+        # Mimic the WebHDFS FileStatus fields:
+        return {
+            'permission': '%o' % stat.S_IMODE(st.st_mode),
+            'replication': 0,
+            'owner': owner,
+            'group': group,
+            'length': st.st_size,
+            'modificationTime': st.st_mtime * 1000,
+            'type': 'DIRECTORY' if stat.S_ISDIR(st.st_mode) else 'FILE'
+        }
+
+    def list(self, path, recursive=False):
+        local_path = self._local_path(path)
+        if not os.path.exists(local_path):
+            raise Exception("No such file or directory: %s" % path)
+        elif os.path.isfile(local_path):
+            yield self._to_info(path, self._status(local_path))
+        elif recursive:
+            for dir_path, dir_names, file_names in os.walk(local_path):
+                for file_name in file_names:
+                    file_path = os.path.join(dir_path, file_name)
+                    yield self._to_info(self._store_path(file_path), self._status(file_path))
+        else:
+            for entry in os.scandir(local_path):
+                yield self._to_info(psp.join(path, entry.name), self._status(entry.path))
+
+    def exists(self, path):
+        return os.path.exists(self._local_path(path))
+
+    def rm(self, path):
+        # Hard-coded to never act recursively, as for WebHDFS:
+        os.remove(self._local_path(path))
+
+    def stream(self, path, offset=0, length=None):
+        return MappedRangeReader(self._local_path(path), offset, length)
+
+    def read(self, path, offset=0, length=None):
+        with self.stream(path, offset, length) as reader:
+            while True:
+                data = reader.view(CHUNK_SIZE)
+                if not data:
+                    break
+                yield data
+
+    def download(self, path, writer, offset=0, length=None):
+        # Make sure anything already buffered goes out first:
+        writer.flush()
+        with open(self._local_path(path), 'rb') as reader:
+            copy_fd_range(reader.fileno(), writer.fileno(), offset or 0, length)
+
+    def calculate_sha512(self, path):
+        '''
+        Calculate the SHA512 hash of a single file, hashing straight from the mapped file.
+        '''
+        sha = hashlib.sha512()
+        with self.stream(path) as reader:
+            while True:
+                data = reader.view(CHUNK_SIZE)
+                if not data:
+                    break
+                sha.update(data)
+                data.release()
+        file_hash = sha.hexdigest()
+        check_sha512_hash(path, file_hash)
+        return file_hash
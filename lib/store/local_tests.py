@@ -0,0 +1,78 @@
+import io
+import os
+import pytest
+import lib.store.local as local
+from lib.store.local import LocalStore, copy_fd_range
+
+DATA = b''.join(b'line %04d\n' % i for i in range(1000))
+
+
+def setup_store(tmp_path):
+    st = LocalStore(str(tmp_path / 'store'))
+    os.makedirs(st.root)
+    with open(os.path.join(st.root, 'data.txt'), 'wb') as f:
+        f.write(DATA)
+    with open(os.path.join(st.root, 'empty.txt'), 'wb') as f:
+        pass
+    return st
+
+
+def test_range_reads(tmp_path):
+    st = setup_store(tmp_path)
+    with st.stream('/data.txt', offset=10, length=25) as r:
+        assert r.readline() == b'line 0001\n'
+        assert r.tell() == 10
+        assert r.read() == DATA[20:35]
+        assert r.read() == b''
+    assert b''.join(st.read('/data.txt', offset=9990)) == DATA[9990:]
+    # Lengths past the end are cut short:
+    assert b''.join(st.read('/data.txt', offset=9995, length=100)) == DATA[9995:]
+    assert b''.join(st.read('/empty.txt')) == b''
+    # Buffered readers work too:
+    with io.BufferedReader(st.stream('/data.txt', length=30)) as r:
+        assert list(r) == [b'line 0000\n', b'line 0001\n', b'line 0002\n']
+
+
+def test_download_range(tmp_path):
+    st = setup_store(tmp_path)
+    out_path = str(tmp_path / 'out.txt')
+    with open(out_path, 'wb') as f:
+        f.write(b'header\n')
+        st.download('/data.txt', f, offset=100, length=50)
+    with open(out_path, 'rb') as f:
+        assert f.read() == b'header\n' + DATA[100:150]
+
+
+@pytest.mark.parametrize('unsupported', [[], ['copy_file_range'], ['copy_file_range', 'sendfile']])
+def test_copy_fallbacks(tmp_path, monkeypatch, unsupported):
+    def not_supported(*args):
+        raise OSError(95, "Operation not supported")
+    for name in unsupported:
+        monkeypatch.setattr(os, name, not_supported)
+    in_path = str(tmp_path / 'in.bin')
+    out_path = str(tmp_path / 'out.bin')
+    data = os.urandom(local.CHUNK_SIZE * 2 + 123)
+    with open(in_path, 'wb') as f:
+        f.write(data)
+    with open(in_path, 'rb') as fin, open(out_path, 'wb') as fout:
+        copied = copy_fd_range(fin.fileno(), fout.fileno(), offset=7)
+    with open(out_path, 'rb') as f:
+        assert f.read() == data[7:]
+    assert copied == len(data) - 7
+
+
+def test_move(tmp_path):
+    st = setup_store(tmp_path)
+    local_path = str(tmp_path / 'upload.txt')
+    with open(local_path, 'wb') as f:
+        f.write(b'upload')
+    st.move(local_path, '/')
+    assert not os.path.exists(local_path)
+    assert b''.join(st.read('/upload.txt')) == b'upload'
+
+    # If the copy in the store does not match, the local file is kept:
+    with open(local_path, 'wb') as f:
+        f.write(b'different')
+    with pytest.raises(Exception):
+        st.move(local_path, '/upload.txt')
+    assert os.path.exists(local_path)
@@ -0,0 +1,298 @@
+'''
+Process-wide scheduling of store transfers, so uploads and downloads share a bandwidth budget.
+
+Every chunk sent to or read from the store asks the scheduler for permission first. The scheduler
+runs a token bucket that refills at the configured rate, and when transfers are competing for
+tokens they are served in weighted fair queueing order, so higher-weight classes of transfer
+(e.g. crawl output) get a proportionally bigger share than lower-weight ones (e.g. backfill).
+
+With no rate set, transfers are never held up, but throughput is still measured.
+
+The defaults can be set using environment variables, e.g.
+
+    STORE_BANDWIDTH=200M
+    STORE_TRANSFER_WEIGHTS=crawl:8,default:4,backfill:1
+
+'''
+import io
+import os
+import re
+import time
+import heapq
+import logging
+import threading
+import itertools
+import collections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRANSFER_CLASS = 'default'
+
+# Relative shares of the bandwidth for the different classes of transfer:
+DEFAULT_WEIGHTS = { 'crawl': 8, 'default': 4, 'backfill': 1 }
+
+# How far back to look when working out the current throughput, in seconds:
+DEFAULT_WINDOW = 10.0
+
+BYTE_UNITS = { '': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4, 'P': 1024**5 }
+
+
+def parse_bytes(value):
+    '''
+    Parse a human-friendly size like '100M' or '2T' (powers of 1024) into a number of bytes.
+    '''
+    if value is None:
+        return None
+    m = re.match(r'^\s*([0-9.]+)\s*([KMGTP]?)(i?B)?\s*$', str(value), re.IGNORECASE)
+    if not m:
+        raise Exception("Could not parse '%s' as a number of bytes!" % value)
+    return int(float(m.group(1)) * BYTE_UNITS[m.group(2).upper()])
+
+
+def parse_weights(value):
+    '''
+    Parse transfer class weights in the form 'crawl:8,backfill:1'.
+    '''
+    weights = dict(DEFAULT_WEIGHTS)
+    if value:
+        for pair in value.split(','):
+            name, weight = pair.split(':')
+            weights[name.strip()] = float(weight)
+    return weights
+
+
+class ThrottledReader(io.RawIOBase):
+    '''
+    Wraps a file-like object, so reading from it is paced by the scheduler.
+
+    It behaves like any other binary file, so it can be read a line at a time, iterated over, or wrapped in an
+    io.BufferedReader. fileno() and tell() are passed through so HTTP clients can still work out the content
+    length.
+    '''
+
+    def __init__(self, reader, scheduler, transfer_class=DEFAULT_TRANSFER_CLASS):
+        super().__init__()
+        self.reader = reader
+        self.scheduler = scheduler
+        self.transfer_class = transfer_class
+
+    def read(self, size=-1):
+        data = self.reader.read(size)
+        if data:
+            self.scheduler.acquire(len(data), self.transfer_class)
+        return data
+
+    def readinto(self, b):
+        if hasattr(self.reader, 'readinto'):
+            n = self.reader.readinto(b)
+        else:
+            data = self.reader.read(len(b))
+            n = len(data)
+            b[:n] = data
+        if n:
+            self.scheduler.acquire(n, self.transfer_class)
+        return n
+
+    def readline(self, size=-1):
+        line = self.reader.readline(size)
+        if line:
+            self.scheduler.acquire(len(line), self.transfer_class)
+        return line
+
+    def readable(self):
+        return True
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def tell(self):
+        return self.reader.tell()
+
+    def close(self):
+        if not self.closed:
+            self.reader.close()
+        super().close()
+
+
+class TransferScheduler(object):
+    '''
+    A token bucket with weighted fair queueing between classes of transfer.
+    '''
+
+    def __init__(self, rate=None, burst=None, weights=None, window=DEFAULT_WINDOW, clock=time.monotonic):
+        '''
+        :param rate: The overall bandwidth budget in bytes per second, or None for no limit.
+        :param burst: The most bytes that can be sent at once after a quiet period (defaults to one second's worth).
+        :param weights: Dict of transfer class to relative weight.
+        :param window: Period over which to calculate the throughput, in seconds.
+        :param clock: Function returning the current time in seconds (e.g. a fake one for testing).
+        '''
+        self.clock = clock
+        self._cond = threading.Condition()
+        self.weights = weights or dict(DEFAULT_WEIGHTS)
+        self.window = window
+        self.set_rate(rate, burst)
+        # Weighted fair queueing state:
+        self._queue = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._finish_tags = {}
+        # Metrics:
+        self._bytes = collections.Counter()
+        self._chunks = collections.Counter()
+        self._waiting = collections.Counter()
+        self._wait_secs = collections.Counter()
+        self._samples = collections.deque()
+        self._started = self.clock()
+
+    def set_rate(self, rate, burst=None):
+        with self._cond:
+            self.rate = rate
+            self.burst = burst or rate
+            self._tokens = self.burst or 0
+            self._last_refill = self.clock()
+            self._cond.notify_all()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self, nbytes, transfer_class=DEFAULT_TRANSFER_CLASS):
+        '''
+        Block until the given number of bytes may be transferred.
+        '''
+        weight = self.weights.get(transfer_class, self.weights.get(DEFAULT_TRANSFER_CLASS, 1))
+        started = self.clock()
+        with self._cond:
+            if self.rate:
+                # Each request gets a virtual finish time, and requests are served in that order:
+                start_tag = max(self._virtual_time, self._finish_tags.get(transfer_class, 0.0))
+                finish_tag = start_tag + nbytes / weight
+                self._finish_tags[transfer_class] = finish_tag
+                ticket = (finish_tag, next(self._seq))
+                heapq.heappush(self._queue, ticket)
+                self._waiting[transfer_class] += 1
+                try:
+                    while self.rate:
+                        self._refill()
+                        if self._queue[0] == ticket:
+                            # Requests bigger than the bucket go through once it is full, and leave a debt:
+                            needed = min(nbytes, self.burst)
+                            if self._tokens >= needed:
+                                break
+                            self._cond.wait((needed - self._tokens) / self.rate)
+                        else:
+                            self._cond.wait()
+                    self._tokens -= nbytes
+                    self._virtual_time = finish_tag
+                finally:
+                    self._waiting[transfer_class] -= 1
+                    self._queue.remove(ticket)
+                    heapq.heapify(self._queue)
+                    self._cond.notify_all()
+            # Record what happened:
+            now = self.clock()
+            self._bytes[transfer_class] += nbytes
+            self._chunks[transfer_class] += 1
+            self._wait_secs[transfer_class] += now - started
+            self._samples.append((now, transfer_class, nbytes))
+            self._expire_samples(now)
+
+    def _expire_samples(self, now):
+        while self._samples and self._samples[0][0] < now - self.window:
+            self._samples.popleft()
+
+    def reader(self, reader, transfer_class=DEFAULT_TRANSFER_CLASS):
+        return ThrottledReader(reader, self, transfer_class)
+
+    def throughput(self, transfer_class=None):
+        '''
+        The recent throughput in bytes per second, overall or for one class of transfer.
+        '''
+        with self._cond:
+            now = self.clock()
+            self._expire_samples(now)
+            total = sum(n for t, c, n in self._samples if transfer_class is None or c == transfer_class)
+        # Avoid under-reporting when the scheduler has not been running for a whole window yet:
+        return total / max(min(self.window, now - self._started), 1.0)
+
+    def stats(self):
+        '''
+        A snapshot of the scheduler state, per class of transfer.
+        '''
+        with self._cond:
+            classes = set(self._bytes) | set(self._waiting)
+        stats = {
+            'rate_limit_bytes_per_sec': self.rate,
+            'throughput_bytes_per_sec': self.throughput(),
+            'classes': {}
+        }
+        for transfer_class in sorted(classes):
+            stats['classes'][transfer_class] = {
+                'weight': self.weights.get(transfer_class, self.weights.get(DEFAULT_TRANSFER_CLASS, 1)),
+                'bytes_total': self._bytes[transfer_class],
+                'chunks_total': self._chunks[transfer_class],
+                'waiting': self._waiting[transfer_class],
+                'wait_secs_total': self._wait_secs[transfer_class],
+                'throughput_bytes_per_sec': self.throughput(transfer_class)
+            }
+        return stats
+
+
+class TransferSchedulerCollector(object):
+    '''
+    Prometheus collector exposing the live state of a transfer scheduler.
+    '''
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    def collect(self):
+        from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+        stats = self.scheduler.stats()
+
+        m_limit = GaugeMetricFamily('ukwa_store_transfer_rate_limit_bytes',
+            'The bandwidth budget for store transfers, in bytes per second (0 if unlimited).')
+        m_limit.add_metric([], float(stats['rate_limit_bytes_per_sec'] or 0))
+
+        m_tp = GaugeMetricFamily('ukwa_store_transfer_throughput_bytes',
+            'Recent store transfer throughput, in bytes per second, labeled by transfer class.',
+            labels=['transfer_class'])
+        m_bytes = CounterMetricFamily('ukwa_store_transfer_bytes',
+            'Total bytes transferred to or from the store, labeled by transfer class.',
+            labels=['transfer_class'])
+        m_wait = CounterMetricFamily('ukwa_store_transfer_wait_seconds',
+            'Total time spent waiting for bandwidth, labeled by transfer class.',
+            labels=['transfer_class'])
+        m_waiting = GaugeMetricFamily('ukwa_store_transfer_waiting',
+            'Number of transfers currently waiting for bandwidth, labeled by transfer class.',
+            labels=['transfer_class'])
+        for transfer_class, cs in stats['classes'].items():
+            m_tp.add_metric([transfer_class], float(cs['throughput_bytes_per_sec']))
+            m_bytes.add_metric([transfer_class], float(cs['bytes_total']))
+            m_wait.add_metric([transfer_class], float(cs['wait_secs_total']))
+            m_waiting.add_metric([transfer_class], float(cs['waiting']))
+
+        yield m_limit
+        yield m_tp
+        yield m_bytes
+        yield m_wait
+        yield m_waiting
+
+
+# The shared, process-wide scheduler:
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    '''
+    Get the process-wide scheduler, setting it up from the environment if needed.
+    '''
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = TransferScheduler(
+                rate=parse_bytes(os.environ.get('STORE_BANDWIDTH', None)),
+                weights=parse_weights(os.environ.get('STORE_TRANSFER_WEIGHTS', None)))
+        return _scheduler
@@ -0,0 +1,135 @@
+import io
+import time
+import threading
+import pytest
+from lib.store.scheduler import TransferScheduler, parse_bytes, parse_weights
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise Exception("Timed out waiting!")
+        time.sleep(0.001)
+
+
+def advance(scheduler, clock, secs):
+    # Move time on, and wake up anything waiting for tokens:
+    with scheduler._cond:
+        clock.now += secs
+        scheduler._cond.notify_all()
+
+
+def in_background(scheduler, nbytes, transfer_class='default'):
+    t = threading.Thread(target=scheduler.acquire, args=(nbytes, transfer_class), daemon=True)
+    t.start()
+    wait_until(lambda: scheduler._waiting[transfer_class] == 1)
+    return t
+
+
+def test_parse_bytes():
+    assert parse_bytes('100') == 100
+    assert parse_bytes('2K') == 2048
+    assert parse_bytes('1.5MiB') == 1572864
+    assert parse_bytes(None) is None
+    with pytest.raises(Exception):
+        parse_bytes('lots')
+    assert parse_weights('crawl:2,new:3')['new'] == 3
+
+
+def test_rate_limit():
+    clock = FakeClock()
+    scheduler = TransferScheduler(rate=100, clock=clock)
+    # The bucket starts full, so the first second's worth goes straight through:
+    scheduler.acquire(100)
+    t = in_background(scheduler, 50)
+    advance(scheduler, clock, 0.4)
+    time.sleep(0.05)
+    assert t.is_alive()
+    advance(scheduler, clock, 0.1)
+    t.join(5)
+    assert not t.is_alive()
+    assert scheduler.stats()['classes']['default']['bytes_total'] == 150
+
+
+def test_burst():
+    clock = FakeClock()
+    scheduler = TransferScheduler(rate=100, burst=200, clock=clock)
+    # After a long quiet period, only up to the burst size can be sent at once:
+    advance(scheduler, clock, 3600)
+    scheduler.acquire(200)
+    t = in_background(scheduler, 1)
+    advance(scheduler, clock, 0.01)
+    t.join(5)
+    assert not t.is_alive()
+
+    # A request bigger than the bucket goes through once it is full, but leaves a debt:
+    advance(scheduler, clock, 2)
+    scheduler.acquire(500)
+    t = in_background(scheduler, 100)
+    advance(scheduler, clock, 3.5)
+    time.sleep(0.05)
+    assert t.is_alive()
+    advance(scheduler, clock, 0.5)
+    t.join(5)
+    assert not t.is_alive()
+
+
+def test_unlimited_never_waits():
+    scheduler = TransferScheduler(clock=FakeClock())
+    for i in range(100):
+        scheduler.acquire(1024**3, 'crawl')
+    assert scheduler.stats()['classes']['crawl']['chunks_total'] == 100
+
+
+def test_weighted_shares():
+    clock = FakeClock()
+    scheduler = TransferScheduler(rate=100, weights={ 'crawl': 3, 'backfill': 1 }, clock=clock)
+    scheduler._tokens = 0
+    rounds = 12
+
+    def transfer(transfer_class):
+        for i in range(rounds):
+            scheduler.acquire(100, transfer_class)
+    threads = [threading.Thread(target=transfer, args=(c,), daemon=True) for c in ['crawl', 'backfill']]
+    for t in threads:
+        t.start()
+
+    # Release one chunk's worth of tokens at a time, once every running transfer is queued up:
+    served = []
+    while any(t.is_alive() for t in threads):
+        wait_until(lambda: sum(scheduler._waiting.values()) == sum(t.is_alive() for t in threads))
+        if not any(t.is_alive() for t in threads):
+            break
+        before = dict(scheduler._chunks)
+        advance(scheduler, clock, 1.0)
+        wait_until(lambda: scheduler._chunks != before)
+        served.extend(c for c in scheduler._chunks if scheduler._chunks[c] != before.get(c, 0))
+
+    # While both are busy, crawl transfers get three times the share of backfill ones:
+    assert served[:16].count('crawl') == 12
+    assert served[:16].count('backfill') == 4
+    # And then backfill gets everything:
+    assert served[16:] == ['backfill'] * 8
+
+
+def test_throttled_reader_is_file_like():
+    scheduler = TransferScheduler()
+    with scheduler.reader(io.BytesIO(b'one\ntwo\nthree'), 'crawl') as r:
+        assert r.readable()
+        assert r.readline() == b'one\n'
+        assert list(r) == [b'two\n', b'three']
+    assert r.closed
+    # It can also be buffered, and everything read is counted:
+    with io.BufferedReader(scheduler.reader(io.BytesIO(b'four\nfive\n'), 'crawl')) as r:
+        assert [line for line in r] == [b'four\n', b'five\n']
+    assert scheduler.stats()['classes']['crawl']['bytes_total'] == 23
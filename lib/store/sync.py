@@ -0,0 +1,263 @@
+'''
+Incremental synchronisation between a local folder and the store, driven by manifests.
+
+A manifest is a JSON file recording what was last transferred for each file (relative path,
+size, modification time and, optionally, the SHA512 hash). The manifest for a sync is written
+once the transfers are done, so the next sync can compare the source against it rather than
+re-scanning the destination.
+'''
+import os
+import json
+import logging
+import datetime
+import posixpath as psp
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from lib.store.base import calculate_sha512_local
+
+logger = logging.getLogger(__name__)
+
+# Prefix used to indicate which side of a sync is on the store, e.g. 'store:/heritrix/output/...'
+STORE_PREFIX = 'store:'
+
+# Default name of the manifest file, placed in the local folder unless set explicitly:
+DEFAULT_MANIFEST_NAME = '.store-sync-manifest.json'
+
+DEFAULT_SYNC_WORKERS = 4
+
+
+def is_store_path(path):
+    return path.startswith(STORE_PREFIX)
+
+
+def strip_store_prefix(path):
+    return path[len(STORE_PREFIX):]
+
+
+def modified_at_to_timestamp(modified_at):
+    '''
+    Convert the 'modified_at_dt' value from a store listing into a POSIX timestamp.
+    '''
+    dt = datetime.datetime.strptime(modified_at.rstrip('Z'), '%Y-%m-%dT%H:%M:%S.%f')
+    return dt.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def scan_local(root, exclude=()):
+    '''
+    Build a manifest dict of all the files under a local folder, keyed by relative path.
+    '''
+    files = {}
+    if not os.path.isdir(root):
+        return files
+    for dir_path, dir_names, file_names in os.walk(root):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            if os.path.abspath(path) in exclude:
+                continue
+            st = os.stat(path)
+            rel_path = os.path.relpath(path, root).replace(os.path.sep, '/')
+            files[rel_path] = { 'size': st.st_size, 'mtime': st.st_mtime }
+    return files
+
+
+def scan_store(st, root):
+    '''
+    Build a manifest dict of all the files under a store folder, keyed by relative path.
+    '''
+    files = {}
+    if not st.exists(root):
+        return files
+    for info in st.list(root, recursive=True):
+        rel_path = psp.relpath(info['file_path_s'], root)
+        files[rel_path] = {
+            'size': int(info['file_size_l']),
+            'mtime': modified_at_to_timestamp(info['modified_at_dt'])
+        }
+    return files
+
+
+def load_manifest(manifest_path, src, dest):
+    '''
+    Load a previous manifest, if there is one and it describes the same sync.
+    '''
+    if not manifest_path or not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('src') != src or manifest.get('dest') != dest:
+        logger.warning("Manifest %s is for a different sync (%s -> %s), ignoring it." % (manifest_path, manifest.get('src'), manifest.get('dest')))
+        return None
+    return manifest
+
+
+def save_manifest(manifest_path, manifest):
+    '''
+    Write the manifest atomically, via a temporary file.
+    '''
+    tmp_path = "%s_temp_" % manifest_path
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+class StoreSync(object):
+    '''
+    Mirrors a local folder to the store, or a store folder to local disk.
+
+    Exactly one of src and dest should be a store path, prefixed with 'store:'.
+    Files are only ever added or replaced at the destination, never deleted.
+    '''
+
+    def __init__(self, st, src, dest, manifest_path=None, checksum=False, workers=DEFAULT_SYNC_WORKERS, rescan=False):
+        if is_store_path(src) == is_store_path(dest):
+            raise Exception("Exactly one of the sync paths must be on the store, e.g. '%s/path/on/store'" % STORE_PREFIX)
+        self.st = st
+        self.src = src
+        self.dest = dest
+        self.upload = is_store_path(dest)
+        if self.upload:
+            self.local_root = src
+            self.store_root = strip_store_prefix(dest)
+        else:
+            self.local_root = dest
+            self.store_root = strip_store_prefix(src)
+        self.manifest_path = manifest_path or os.path.join(self.local_root, DEFAULT_MANIFEST_NAME)
+        self.checksum = checksum
+        self.workers = workers
+        self.rescan = rescan
+        self.dest_files = {}
+
+    def _src_hash(self, rel_path):
+        if self.upload:
+            return calculate_sha512_local(os.path.join(self.local_root, rel_path))
+        else:
+            return self.st.calculate_sha512(psp.join(self.store_root, rel_path))
+
+    def _dest_hash(self, rel_path):
+        if self.upload:
+            return self.st.calculate_sha512(psp.join(self.store_root, rel_path))
+        else:
+            return calculate_sha512_local(os.path.join(self.local_root, rel_path))
+
+    def scan(self):
+        '''
+        Works out what needs transferring.
+
+        :return: a tuple of (source manifest files, dict of relative path to reason for transfer)
+        '''
+        # Make sure the manifest itself is never synced:
+        exclude = [ os.path.abspath(self.manifest_path), os.path.abspath("%s_temp_" % self.manifest_path)]
+        if self.upload:
+            src_files = scan_local(self.local_root, exclude=exclude)
+        else:
+            src_files = scan_store(self.st, self.store_root)
+
+        # Use the previous manifest for the destination if we can, otherwise scan it:
+        previous = None
+        if not self.rescan:
+            previous = load_manifest(self.manifest_path, self.src, self.dest)
+        if previous:
+            logger.info("Using manifest %s for the destination state." % self.manifest_path)
+            dest_files = previous['files']
+        else:
+            logger.info("Scanning %s for the destination state." % self.dest)
+            if self.upload:
+                dest_files = scan_store(self.st, self.store_root)
+            else:
+                dest_files = scan_local(self.local_root, exclude=exclude)
+
+        # Kept so entries for failed transfers can be carried forward:
+        self.dest_files = dest_files
+
+        to_transfer = {}
+        for rel_path, src_info in src_files.items():
+            dest_info = dest_files.get(rel_path, None)
+            if dest_info is None:
+                to_transfer[rel_path] = 'missing'
+                continue
+            if src_info['size'] != dest_info['size']:
+                to_transfer[rel_path] = 'size'
+                continue
+            # Manifest entries record the source state, so the modification times are comparable:
+            src_unchanged = previous is not None and src_info['mtime'] == dest_info['mtime']
+            if previous is not None and not src_unchanged:
+                to_transfer[rel_path] = 'mtime'
+                continue
+            if self.checksum:
+                # Re-use cached hashes where the source file is known not to have changed:
+                if src_unchanged and 'sha512' in dest_info:
+                    src_info['sha512'] = dest_info['sha512']
+                else:
+                    src_info['sha512'] = self._src_hash(rel_path)
+                    dest_hash = dest_info.get('sha512', None) or self._dest_hash(rel_path)
+                    if src_info['sha512'] != dest_hash:
+                        to_transfer[rel_path] = 'checksum'
+            elif 'sha512' in dest_info and src_unchanged:
+                # Carry the cached hash forward:
+                src_info['sha512'] = dest_info['sha512']
+
+        return src_files, to_transfer
+
+    def _transfer(self, rel_path, replace):
+        local_path = os.path.join(self.local_root, rel_path)
+        store_path = psp.join(self.store_root, rel_path)
+        if self.upload:
+            logger.info("Uploading %s to %s" % (local_path, store_path))
+            self.st.put(local_path, store_path, backup_and_replace=replace)
+        else:
+            logger.info("Downloading %s to %s" % (store_path, local_path))
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            tmp_path = "%s_temp_" % local_path
+            with open(tmp_path, 'wb') as f:
+                self.st.download(store_path, f)
+            os.replace(tmp_path, local_path)
+
+    def run(self, dry_run=False):
+        '''
+        Perform the sync, returning a dict of statistics.
+        '''
+        src_files, to_transfer = self.scan()
+        stats = {
+            'src_files_i': len(src_files),
+            'to_transfer_i': len(to_transfer),
+            'transferred_i': 0,
+            'transferred_bytes_l': 0,
+            'failed_i': 0,
+        }
+        if dry_run:
+            for rel_path in sorted(to_transfer):
+                logger.warning("Would transfer %s (%s)" % (rel_path, to_transfer[rel_path]))
+            return stats
+
+        # Transfer concurrently:
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {}
+            for rel_path, reason in to_transfer.items():
+                futures[executor.submit(self._transfer, rel_path, reason != 'missing')] = rel_path
+            for future in as_completed(futures):
+                rel_path = futures[future]
+                try:
+                    future.result()
+                    stats['transferred_i'] += 1
+                    stats['transferred_bytes_l'] += src_files[rel_path]['size']
+                except Exception as e:
+                    logger.exception("Transfer of %s failed: %s" % (rel_path, e))
+                    failed.append(rel_path)
+        stats['failed_i'] = len(failed)
+
+        # Record what the destination held before for failed transfers, so they get retried next time (and replace
+        # any older copy, rather than being treated as new):
+        for rel_path in failed:
+            if rel_path in self.dest_files:
+                src_files[rel_path] = self.dest_files[rel_path]
+            else:
+                del src_files[rel_path]
+        manifest = {
+            'src': self.src,
+            'dest': self.dest,
+            'synced_at': datetime.datetime.utcnow().isoformat(timespec='milliseconds')+'Z',
+            'files': src_files
+        }
+        save_manifest(self.manifest_path, manifest)
+
+        return stats
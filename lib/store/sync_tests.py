@@ -0,0 +1,128 @@
+import os
+import json
+from lib.store.local import LocalStore
+from lib.store.sync import StoreSync, save_manifest, load_manifest, DEFAULT_MANIFEST_NAME
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def setup_dirs(tmp_path):
+    local = str(tmp_path / 'local')
+    st = LocalStore(str(tmp_path / 'store'))
+    os.makedirs(os.path.join(st.root, 'out'))
+    write(os.path.join(local, 'a.warc.gz'), 'aaaa')
+    write(os.path.join(local, 'sub', 'b.warc.gz'), 'bbbbbbbb')
+    return local, st
+
+
+def test_upload_then_manifest(tmp_path):
+    local, st = setup_dirs(tmp_path)
+    stats = StoreSync(st, local, 'store:/out').run()
+    assert stats['transferred_i'] == 2
+    assert stats['transferred_bytes_l'] == 12
+    assert st.exists('/out/sub/b.warc.gz')
+
+    manifest = load_manifest(os.path.join(local, DEFAULT_MANIFEST_NAME), local, 'store:/out')
+    assert sorted(manifest['files'].keys()) == ['a.warc.gz', 'sub/b.warc.gz']
+
+    # Nothing has changed, so nothing to do, and the manifest itself is not synced:
+    src_files, to_transfer = StoreSync(st, local, 'store:/out').scan()
+    assert to_transfer == {}
+    assert DEFAULT_MANIFEST_NAME not in src_files
+
+    # Changes to the source are spotted via the manifest:
+    write(os.path.join(local, 'a.warc.gz'), 'aaaaa')
+    b_path = os.path.join(local, 'sub', 'b.warc.gz')
+    os.utime(b_path, (0, 12345))
+    write(os.path.join(local, 'c.warc.gz'), 'c')
+    src_files, to_transfer = StoreSync(st, local, 'store:/out').scan()
+    assert to_transfer == { 'a.warc.gz': 'size', 'sub/b.warc.gz': 'mtime', 'c.warc.gz': 'missing' }
+
+
+def test_first_run_compares_sizes_only(tmp_path):
+    local, st = setup_dirs(tmp_path)
+    # The destination already has files of the same size, but one has different content:
+    write(os.path.join(st.root, 'out', 'a.warc.gz'), 'xxxx')
+    write(os.path.join(st.root, 'out', 'sub', 'b.warc.gz'), 'bbbbbbbb')
+
+    src_files, to_transfer = StoreSync(st, local, 'store:/out').scan()
+    assert to_transfer == {}
+
+    src_files, to_transfer = StoreSync(st, local, 'store:/out', checksum=True).scan()
+    assert to_transfer == { 'a.warc.gz': 'checksum' }
+    assert 'sha512' in src_files['sub/b.warc.gz']
+
+
+def test_download(tmp_path):
+    local, st = setup_dirs(tmp_path)
+    write(os.path.join(st.root, 'out', 'd.warc.gz'), 'dd')
+    dest = str(tmp_path / 'download')
+    stats = StoreSync(st, 'store:/out', dest).run()
+    assert stats['transferred_i'] == 1
+    with open(os.path.join(dest, 'd.warc.gz')) as f:
+        assert f.read() == 'dd'
+    assert not os.path.exists(os.path.join(dest, 'd.warc.gz_temp_'))
+
+
+def test_dry_run_writes_nothing(tmp_path):
+    local, st = setup_dirs(tmp_path)
+    stats = StoreSync(st, local, 'store:/out').run(dry_run=True)
+    assert stats['to_transfer_i'] == 2
+    assert not st.exists('/out/a.warc.gz')
+    assert not os.path.exists(os.path.join(local, DEFAULT_MANIFEST_NAME))
+
+
+def test_failed_transfers_left_out_of_manifest(tmp_path):
+    local, st = setup_dirs(tmp_path)
+    syncer = StoreSync(st, local, 'store:/out')
+    transfer = syncer._transfer
+
+    def failing_transfer(rel_path, replace):
+        if rel_path == 'a.warc.gz':
+            raise Exception("Simulated failure")
+        transfer(rel_path, replace)
+    syncer._transfer = failing_transfer
+
+    stats = syncer.run()
+    assert stats['failed_i'] == 1
+    src_files, to_transfer = StoreSync(st, local, 'store:/out').scan()
+    assert to_transfer == { 'a.warc.gz': 'missing' }
+
+
+def test_failed_replacement_retried(tmp_path):
+    local, st = setup_dirs(tmp_path)
+    StoreSync(st, local, 'store:/out').run()
+
+    # The file changes, but the first attempt to replace it fails:
+    write(os.path.join(local, 'a.warc.gz'), 'aaaaaa')
+    syncer = StoreSync(st, local, 'store:/out')
+
+    def failing_transfer(rel_path, replace):
+        raise Exception("Simulated failure")
+    syncer._transfer = failing_transfer
+    assert syncer.run()['failed_i'] == 1
+
+    # The next run still knows there is an older copy, so replaces it:
+    src_files, to_transfer = StoreSync(st, local, 'store:/out').scan()
+    assert to_transfer == { 'a.warc.gz': 'size' }
+    stats = StoreSync(st, local, 'store:/out').run()
+    assert stats['transferred_i'] == 1
+    assert stats['failed_i'] == 0
+    with open(os.path.join(st.root, 'out', 'a.warc.gz')) as f:
+        assert f.read() == 'aaaaaa'
+
+
+def test_manifest_written_atomically(tmp_path):
+    manifest_path = str(tmp_path / 'manifest.json')
+    save_manifest(manifest_path, { 'src': 'a', 'dest': 'store:/b', 'files': { 'x': { 'size': 1, 'mtime': 2 } } })
+    save_manifest(manifest_path, { 'src': 'a', 'dest': 'store:/b', 'files': {} })
+    assert os.listdir(str(tmp_path)) == ['manifest.json']
+    with open(manifest_path) as f:
+        assert json.load(f)['files'] == {}
+    # A manifest for a different sync is ignored:
+    assert load_manifest(manifest_path, 'a', 'store:/c') is None
+    assert load_manifest(manifest_path, 'a', 'store:/b') is not None
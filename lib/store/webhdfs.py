@@ -6,79 +6,33 @@ Uses https://hdfscli.readthedocs.io
 
 import os
 import time
-import string
 import logging
-import hashlib
 import datetime
 import posixpath as psp
+from contextlib import contextmanager
 from hdfs import InsecureClient
-from lib.store.hdfs_layout import HdfsPathParser
+from lib.store.base import Store, CHUNK_SIZE, calculate_sha512_local
+from lib.store.scheduler import get_scheduler, DEFAULT_TRANSFER_CLASS
+# Also make the shared helpers available from here, as they used to live in this module:
+from lib.store.base import HDFS_ID_PREFIX, permissions_octal_to_string, check_sha512_hash, calculate_reader_hash
 
 DEFAULT_WEBHDFS = "http://hdfs.api.wa.bl.uk/"
 DEFAULT_WEBHDFS_USER = "access"
 
-HDFS_ID_PREFIX = "hdfs://hdfs:54310"
-
 logger = logging.getLogger(__name__)
 
-def permissions_octal_to_string(octal):
-    result = ''
-    for _ in range(3):
-        octal, digit = divmod(octal, 10)
-        for value, letter in reversed([(4, "r"), (2, "w"), (1, "x")]):
-            result = (letter if digit & value else "-") + result
-    return result
-
-def check_sha512_hash(path, file_hash):
-    '''
-    Utility funtion to check if a hash is well-formed.
-    '''
-    logger.debug("Checking file %s hash %s" % (path, file_hash))
-    if len(file_hash) != 128:
-        raise Exception("%s hash not 128 character length [%s]" % (path, len(file_hash)))
-    if not all(c in string.hexdigits for c in file_hash):
-        raise Exception("%s hash not all hex [%s]" % (path, file_hash))
-
-def calculate_sha512_local(path):
-    with open(path, 'rb') as reader:
-        file_hash = calculate_reader_hash(reader, path)
-
-    return file_hash
 
-def calculate_reader_hash(reader, path="unknown-path"):
-    """
-    Reads a file-like object in chunks, building up the SHA512 hash.
-
-    :param reader: A file-like object that allows the data to be read
-    :param path: The path of this file-like object, for reporting purposes
-    :return:
-    """
-    sha = hashlib.sha512()
-    while True:
-        data = reader.read(10485760)
-        if not data:
-            reader.close()
-            break
-        sha.update(data)
-    path_hash = sha.hexdigest()
-
-    # check hash is not obviously wrong:
-    check_sha512_hash(path, path_hash)
-
-    # return it:
-    return path_hash
-
-
-class WebHDFSStore(object):
+class WebHDFSStore(Store):
     '''
     A file store based on the WebHDFS protocol.
     '''
-    # Set a refresh-date to indicate when we did this lookup:
-    refresh_date = datetime.datetime.utcnow().isoformat(timespec='milliseconds')+'Z'
-    
-    def __init__(self, webhdfs_url = DEFAULT_WEBHDFS, webhdfs_user = DEFAULT_WEBHDFS_USER):
+
+    def __init__(self, webhdfs_url = DEFAULT_WEBHDFS, webhdfs_user = DEFAULT_WEBHDFS_USER, transfer_class = DEFAULT_TRANSFER_CLASS):
         self.webhdfs_url = webhdfs_url
         self.webhdfs_user = webhdfs_user
+        # All transfers through the gateway share the process-wide bandwidth budget:
+        self.transfer_class = transfer_class
+        self.scheduler = get_scheduler()
         self.client = InsecureClient(self.webhdfs_url, self.webhdfs_user)
 
     def put(self, local_path, hdfs_path, backup_and_replace=False):
@@ -88,7 +42,7 @@ class WebHDFSStore(object):
         # Handle files or directories:
         if os.path.isfile(local_path):
             hdfs_path = self._combine_paths(dest_status, local_path, hdfs_path)
-            self._upload_file(local_path, hdfs_path, backup_and_replace)
+            return self._upload_file(local_path, hdfs_path, backup_and_replace)
         elif os.path.isdir(local_path):
             # TODO, if it's a directory
             raise Exception("Cannot upload anything other than single files at this time!")
@@ -139,9 +93,10 @@ class WebHDFSStore(object):
             logger.info("Uploading as %s" % tmp_path)
             with open(local_path, 'rb') as reader, self.client.write(tmp_path, overwrite=True) as writer:
                 while True:
-                    data = reader.read(10485760)
+                    data = reader.read(CHUNK_SIZE)
                     if not data:
                         break
+                    self.scheduler.acquire(len(data), self.transfer_class)
                     writer.write(data)
             
             # If set, backup-and-replace as needed:
@@ -175,59 +130,6 @@ class WebHDFSStore(object):
         # And return success flag so caller knows it worked:
         return success
 
-    def move(self, local_path, hdfs_path):
-        # Perform the PUT first:
-        success = self.put(local_path,hdfs_path)
-        # And delete the local file if that worked:
-        if success == True:
-            os.remove(local_path)
-
-    def calculate_sha512(self, path):
-        '''
-        Calculate the SHA512 hash of a single file on HDFS
-        '''
-        with self.client.read(path) as reader:
-            file_hash = calculate_reader_hash(reader, path)
-        
-        return file_hash
-
-    def _to_info(self, path, status):
-        # Add the file path:
-        status['file_path'] = path
-        # Classify based on HDFS storage conventions:
-        item = HdfsPathParser(status).to_dict()
-        # Work out the permissions string:
-        if status['permission'].isnumeric():
-            permissions = permissions_octal_to_string(int(status['permission']))
-            if status['type'] == 'DIRECTORY':
-                permissions = "d" + permissions
-            else:
-                permissions = "-" + permissions
-        else:
-            permissions = status['permission']
-        # And return as a 'standard' dict:
-        return {
-                'id': '%s%s' % (HDFS_ID_PREFIX, item['file_path']),
-                'refresh_date_dt': self.refresh_date,
-                'file_path_s': item['file_path'],
-                'file_size_l': item['file_size'],
-                'file_ext_s': item['file_ext'],
-                'file_name_s': item['file_name'],
-                'permissions_s': permissions,
-                'hdfs_replicas_i': item['number_of_replicas'],
-                'hdfs_user_s': item['user_id'],
-                'hdfs_group_s': item['group_id'],
-                'modified_at_dt': "%sZ" % item['modified_at'],
-                'timestamp_dt': "%sZ" % item['timestamp'],
-                'year_i': item['timestamp'][0:4],
-                'recognised_b': item['recognised'],
-                'kind_s': item['kind'],
-                'collection_s': item['collection'],
-                'stream_s': item['stream'],
-                'job_s': item['job'],
-                'layout_s': item['layout']
-            }
-    
     def list(self, path, recursive=False):
         # Handle non-existant entry, or a file:
         path_status = self.client.status(path, strict=False)
@@ -261,45 +163,9 @@ class WebHDFSStore(object):
         # Hard-coded to never act recursively - if you want that, do it manually via the back-end.
         self.client.delete(path, recursive=False)
 
+    @contextmanager
     def stream(self, path, offset=0, length=None):
         # NOTE our WebHDFS service is very old and uses 'len' not 'length' for controlling the response length:
         # The API proxy we use attempts to remedy this by mapping any 'length' parameter to 'len'.
-        return self.client.read(path, offset=offset, length=length)
-
-    def read(self, path, offset=0, length=None):
-        with self.stream(path,offset, length) as reader:
-            while True:
-                data = reader.read(10485760)
-                if not data:
-                    break
-                yield data
-
-    def lsr_to_items(self, reader):
-        """
-        This task processes a raw list of files generated by the hadoop fs -lsr command.
-
-        As this can be a very large list, it avoids reading it all into memory. It
-        parses each line, and yields a suitable stream of parsed objects matching the WebHDFS API.
-        """
-        for line in reader:
-            if "lsr: DEPRECATED: Please use 'ls -R' instead." in line:
-                logger.warning(line)
-            else:
-                permissions, number_of_replicas, userid, groupid, filesize, modification_date, modification_time, filename = line.split(None, 7)
-                filename = filename.strip()
-                timestamp = datetime.datetime.strptime('%s %s' % (modification_date, modification_time), '%Y-%m-%d %H:%M')
-                info = {
-                    'permission' : permissions,
-                    'replication': number_of_replicas,
-                    'owner': userid,
-                    'group': groupid,
-                    'length': filesize,
-                    'modificationTime': timestamp.timestamp() * 1000,
-                    'pathSuffix': filename
-                }
-                # Skip directories:
-                if permissions[0] != 'd':
-                    yield self._to_info(filename,info)
-                    info['type'] = 'DIRECTORY'
-                else:
-                    info['type'] = 'FILE'
\ No newline at end of file
+        with self.client.read(path, offset=offset, length=length) as reader:
+            yield self.scheduler.reader(reader, self.transfer_class)
@@ -6,7 +6,6 @@ import sys
 import json
 import logging
 import argparse
-from lib.trackdb.solr import SolrTrackDB
 
 logging.basicConfig(level=logging.WARNING, format='%(asctime)s: %(levelname)s - %(name)s - %(message)s')
 
@@ -77,7 +76,8 @@ def main():
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
 
-    # Set up Solr client:
+    # Set up Solr client (imported here, so the CLI starts up quickly):
+    from lib.trackdb.solr import SolrTrackDB
     tdb = SolrTrackDB(args.trackdb_url, kind=args.kind)
 
     # Ops:
@@ -76,12 +76,13 @@ class SolrTrackDB():
         if len(batch) > 0:
             self._send_as_updates(batch)
 
-    def list(self, stream=None, year=None, field_value=None, sort='timestamp_dt desc', limit=100):
+    def list(self, stream=None, year=None, field_value=None, sort='timestamp_dt desc', limit=100, start=0):
         # set solr search terms
         solr_query_url = self.trackdb_url + '/query'
         query_string = {
             'q':'kind_s:{}'.format(self.kind),
             'rows':limit,
+            'start':start,
             'sort':sort
         }
         # Add optional fields:
@@ -0,0 +1,225 @@
+'''
+The steps involved in indexing a batch of WARCs, shared by the one-off indexing commands and the daemon.
+
+Each step is separate, so they can be run one after another, or overlapped with other batches.
+
+Batches can be limited by the number of WARCs, or by their total size. As WARC sizes vary so much,
+sizing batches by bytes gives much more consistent job run times. If a target job duration is set,
+the batch size in bytes is worked out from how long recent jobs took, as recorded in their task events.
+'''
+import time
+import logging
+import datetime
+import itertools
+from lib.trackdb.solr import SolrTrackDB
+from lib.store.scheduler import parse_bytes
+from lib.windex.cdx_cache import CdxCache, push_cache_metrics
+from lib.windex.job_stats import throughput_stats, push_job_metrics
+
+logger = logging.getLogger(__name__)
+
+# How many recent jobs to use when estimating throughput:
+DEFAULT_HISTORY = 10
+
+# The most the batch size in bytes can change by from one batch to the next:
+MAX_ADJUSTMENT = 4.0
+
+# The most pages of candidate WARCs to look through when filling a batch up to a size in bytes:
+MAX_CANDIDATE_PAGES = 10
+
+
+class BatchIndexer():
+    '''
+    Indexes batches of WARCs listed in the TrackDB, and records the outcome there.
+
+    :param op: either 'cdx-index' or 'solr-index'
+    :param args: the parsed command-line arguments for that operation, including batch_size, and
+        optionally batch_bytes and target_duration
+    '''
+
+    def __init__(self, tdb, op, args, cdx_url=None):
+        self.tdb = tdb
+        self.op = op
+        self.args = args
+        self.cdx_url = cdx_url
+        if op == 'cdx-index':
+            self.field = "cdx_index_ss"
+            self.value = args.cdx_collection
+        elif op == 'solr-index':
+            self.field = "solr_index_ss"
+            self.value = args.solr_collection
+        else:
+            raise Exception("Unknown indexing operation %s!" % op)
+        # The CDX lookup cache to keep up to date as WARCs are indexed, if there is one:
+        self.cdx_cache = None
+        if op == 'cdx-index' and getattr(args, 'cdx_cache', None):
+            self.cdx_cache = CdxCache(args.cdx_cache)
+        self.batch_bytes = parse_bytes(getattr(args, 'batch_bytes', None))
+        self.target_duration = getattr(args, 'target_duration', None)
+
+    def recent_jobs(self, limit=DEFAULT_HISTORY):
+        '''
+        Get the task events for the most recent successful jobs of this kind.
+        '''
+        events = SolrTrackDB(self.tdb.trackdb_url, kind='task')
+        items = events.list(field_value=['task_s', self.op], sort='finished_at_dt desc', limit=limit)
+        return [item for item in items if item.get('task_status_s') == 'success' 
+            and item.get('batch_bytes_l', 0) > 0 and item.get('runtime_secs_i', 0) > 0]
+
+    def target_batch_bytes(self):
+        '''
+        Work out how many bytes of WARCs should go in the next batch.
+
+        If there is a target duration, recent jobs are used to estimate the fixed start-up time of a job,
+        and how many bytes per second it then indexes, and the batch is sized to match. If not, or if
+        there are no recent jobs to go on, the configured batch_bytes is used.
+        '''
+        if not self.target_duration:
+            return self.batch_bytes
+        jobs = self.recent_jobs()
+        if len(jobs) == 0:
+            logger.info("No recent %s jobs to estimate throughput from." % self.op)
+            return self.batch_bytes
+        sizes = [float(job['batch_bytes_l']) for job in jobs]
+        secs = [float(job['runtime_secs_i']) for job in jobs]
+        # Fit secs = overhead + bytes/rate by least squares, if the batch sizes vary enough to do so:
+        overhead = 0.0
+        rate = sum(sizes) / sum(secs)
+        if len(jobs) >= 3:
+            mean_size = sum(sizes) / len(sizes)
+            mean_secs = sum(secs) / len(secs)
+            var = sum((x - mean_size)**2 for x in sizes)
+            if var > 0:
+                slope = sum((x - mean_size) * (y - mean_secs) for x, y in zip(sizes, secs)) / var
+                if slope > 0:
+                    rate = 1.0 / slope
+                    overhead = min(max(mean_secs - slope * mean_size, 0.0), self.target_duration / 2.0)
+        target = (self.target_duration - overhead) * rate
+        # Avoid big jumps, based on the most recent job:
+        last = sizes[0]
+        target = min(max(target, last / MAX_ADJUSTMENT), last * MAX_ADJUSTMENT)
+        logger.info("Estimated %.1f MB/s with %.0fs overhead from %i recent jobs, so aiming for %.1f GB batches." 
+            % (rate / 1024**2, overhead, len(jobs), target / 1024**3))
+        return int(target)
+
+    def candidates(self, exclude=(), max_pages=1):
+        '''
+        Yields the WARCs that need indexing, a page at a time, skipping any listed in exclude.
+        '''
+        field_value = ["-%s" % self.field, "%s*" % self.value]
+        page_size = self.args.batch_size + len(exclude)
+        for page in range(max_pages):
+            items = self.tdb.list(self.args.stream, self.args.year, field_value, limit=page_size, start=page * page_size)
+            for item in items:
+                if item['id'] not in exclude:
+                    yield item
+            if len(items) < page_size:
+                return
+
+    def next_batch(self, exclude=()):
+        '''
+        Get the next batch of WARCs that need indexing, skipping any listed in exclude (e.g. those already in progress).
+
+        When sizing by bytes, WARCs are added until the target is reached, skipping any that would take the batch
+        over it, and paging through further candidates (up to MAX_CANDIDATE_PAGES) until the target is reached
+        or the batch has batch_size WARCs. A single WARC that is bigger than the target is still returned as a
+        batch of one.
+        '''
+        target_bytes = self.target_batch_bytes()
+        if not target_bytes:
+            return list(itertools.islice(self.candidates(exclude), self.args.batch_size))
+        batch = []
+        total = 0
+        for item in self.candidates(exclude, max_pages=MAX_CANDIDATE_PAGES):
+            size = item.get('file_size_l', 0)
+            if len(batch) > 0 and total + size > target_bytes:
+                continue
+            batch.append(item)
+            total += size
+            if total >= target_bytes or len(batch) >= self.args.batch_size:
+                break
+        logger.info("Got %i WARCs totalling %i bytes, for a target of %i bytes." % (len(batch), total, target_bytes))
+        return batch
+
+    def run_job(self, items):
+        '''
+        Run the indexing job for a batch, returning the job stats, including throughput.
+        '''
+        start = time.time()
+        # Imported here so only the job type that is actually used needs to be available:
+        if self.op == 'cdx-index':
+            if self.args.local:
+                from lib.windex.local_cdx import run_local_cdx_index_job
+                stats = run_local_cdx_index_job(items, self.cdx_url, store_uri=self.args.store_uri, processes=self.args.processes,
+                    cdx_cache=self.cdx_cache)
+            else:
+                from lib.windex.mr_cdx_job import run_cdx_index_job
+                stats = run_cdx_index_job(items, self.cdx_url)
+            stats['cdx_endpoint_s'] = self.cdx_url
+            records = stats.get('total_sent_records_i', 0)
+        else:
+            from lib.windex.mr_solr_job import run_solr_index_job
+            args = self.args
+            stats = run_solr_index_job(items, args.zks, args.solr_collection, args.config, args.annotations, args.oasurts)
+            stats['solr_collection_s'] = args.solr_collection
+            records = stats.get('num_records_i', 0)
+        # Use the job's own timing if it has one, as that excludes setting up the job:
+        secs = stats.get('job_secs_f', time.time() - start)
+        stats.update(throughput_stats(records, sum(item.get('file_size_l', 0) for item in items), secs))
+        return stats
+
+    def mark_done(self, items):
+        '''
+        Mark a batch as indexed, but also as unverified.
+        '''
+        ids = [item['id'] for item in items]
+        self.tdb.update(ids, self.field, "%s" % self.value)
+        self.tdb.update(ids, self.field, "%s|unverified" % self.value)
+        # When indexing locally, cached lookups of the URLs indexed were dropped as they went in. The Hadoop job does
+        # not tell us which URLs it indexed, so only cached misses are dropped, and cached results for URLs that
+        # just gained captures last until they expire. Either way, cached misses of other forms of query (e.g.
+        # prefix queries) may now be out of date:
+        if self.cdx_cache:
+            logger.info("Invalidated %i cached CDX misses." % self.cdx_cache.invalidate_all(negative_only=True))
+            push_cache_metrics(self.cdx_cache)
+
+    def record_event(self, items, stats, start_time, finish_time, status='success'):
+        '''
+        Record a task event in the TrackDB, with the job stats, and push the job telemetry to Prometheus.
+        '''
+        ids = [item['id'] for item in items]
+        event = {
+            'id': 'task:%s:%s:%s:%s'% (self.op, self.args.stream, self.args.year, finish_time.isoformat()),
+            'kind_s': 'task',
+            'task_s': self.op,
+            'batch_size_i': len(ids),
+            'batch_bytes_l': sum(item.get('file_size_l', 0) for item in items),
+            'ids_ss' : ids,
+            'stream_s': self.args.stream,
+            'year_i': self.args.year,
+            "task_status_s": status,
+            'started_at_dt': start_time.isoformat(),
+            'finished_at_dt': finish_time.isoformat(),
+            'runtime_secs_i': (finish_time-start_time).total_seconds()
+        }
+        for stat in stats:
+            event[stat] = stats[stat]
+        self.tdb.import_items([event])
+        push_job_metrics(self.op, self.args.stream, event)
+
+    def run_once(self):
+        '''
+        Index one batch, start to finish.
+        '''
+        start_time = datetime.datetime.now()
+        items = self.next_batch()
+        if len(items) == 0:
+            logger.warn("No WARCs found to process!")
+            return None
+        # Run a job to index those items:
+        stats = self.run_job(items)
+        # If that worked (no exception thrown), update the tracking database accordingly:
+        self.mark_done(items)
+        # Update event stats item in TrackDB
+        self.record_event(items, stats, start_time, datetime.datetime.now())
+        return stats
@@ -0,0 +1,112 @@
+import argparse
+import lib.windex.local_cdx as local_cdx
+from lib.windex.batch import BatchIndexer, MAX_ADJUSTMENT
+
+GB = 1024**3
+
+
+class FakeTrackDB(object):
+    '''
+    Lists the given items, a page at a time, as the TrackDB does.
+    '''
+
+    def __init__(self, items):
+        self.items = items
+        self.pages = 0
+        self.trackdb_url = 'http://trackdb/test'
+
+    def list(self, stream=None, year=None, field_value=None, sort='timestamp_dt desc', limit=100, start=0):
+        self.pages += 1
+        return self.items[start:start + limit]
+
+    def update(self, ids, field, value):
+        pass
+
+
+def indexer(items=(), batch_size=5, batch_bytes=None, target_duration=None):
+    args = argparse.Namespace(cdx_collection='test', stream='frequent', year=2020, batch_size=batch_size,
+        batch_bytes=batch_bytes, target_duration=target_duration)
+    return BatchIndexer(FakeTrackDB(list(items)), 'cdx-index', args)
+
+
+def warcs(*sizes):
+    return [{ 'id': 'warc-%i' % i, 'file_size_l': size } for i, size in enumerate(sizes)]
+
+
+def with_jobs(bi, jobs):
+    # Most recent first, as (bytes, secs):
+    bi.recent_jobs = lambda: [{ 'batch_bytes_l': b, 'runtime_secs_i': s } for b, s in jobs]
+    return bi
+
+
+def test_batch_by_count():
+    bi = indexer(warcs(1, 2, 3, 4, 5, 6, 7), batch_size=3)
+    assert [item['id'] for item in bi.next_batch(exclude={'warc-1'})] == ['warc-0', 'warc-2', 'warc-3']
+
+
+def test_batch_by_bytes_pages_through_candidates():
+    # The first page is full of WARCs that are too big to fit alongside the first one:
+    bi = indexer(warcs(*([6*GB] * 5 + [1*GB] * 10)), batch_size=5, batch_bytes='8G')
+    batch = bi.next_batch()
+    assert [item['file_size_l'] for item in batch] == [6*GB, 1*GB, 1*GB]
+    assert bi.tdb.pages == 2
+
+
+def test_batch_bytes_stops_at_the_end():
+    bi = indexer(warcs(6*GB, 6*GB, 1*GB), batch_size=2, batch_bytes='100G')
+    assert len(bi.next_batch()) == 2
+    bi = indexer(warcs(20*GB), batch_size=2, batch_bytes='8G')
+    assert [item['file_size_l'] for item in bi.next_batch()] == [20*GB]
+
+
+def test_target_bytes_without_a_target_duration():
+    assert indexer(batch_bytes='2T').target_batch_bytes() == 2 * 1024**4
+    assert indexer().target_batch_bytes() is None
+
+
+def test_target_bytes_with_no_recent_jobs():
+    bi = with_jobs(indexer(batch_bytes='2G', target_duration=3600), [])
+    assert bi.target_batch_bytes() == 2*GB
+
+
+def test_target_bytes_with_too_few_jobs_to_fit():
+    # With fewer than three jobs, the overall average rate is used, with no overhead:
+    bi = with_jobs(indexer(target_duration=3600), [(10*GB, 1000), (20*GB, 2000)])
+    assert bi.target_batch_bytes() == int(3600 * 10*GB / 1000)
+
+
+def test_target_bytes_least_squares_fit():
+    # Jobs take 600s to start, then run at 10 MB/s:
+    rate = 10 * 1024**2
+    jobs = [(size, 600 + size / rate) for size in [30*GB, 20*GB, 25*GB, 35*GB]]
+    bi = with_jobs(indexer(target_duration=3600), jobs)
+    assert abs(bi.target_batch_bytes() - (3600 - 600) * rate) < 1024
+
+
+def test_target_bytes_clamped():
+    # Even though the jobs are very quick, the batch size can only grow by MAX_ADJUSTMENT at a time:
+    bi = with_jobs(indexer(target_duration=3600), [(1*GB, 10), (1*GB, 10)])
+    assert bi.target_batch_bytes() == int(MAX_ADJUSTMENT * GB)
+    # And the same going down:
+    bi = with_jobs(indexer(target_duration=3600), [(100*GB, 100000), (100*GB, 100000)])
+    assert bi.target_batch_bytes() == int(100*GB / MAX_ADJUSTMENT)
+
+
+def test_local_cdx_index_keeps_the_cache_up_to_date(tmp_path, monkeypatch):
+    args = argparse.Namespace(cdx_collection='test', stream='frequent', year=2020, batch_size=5, local=True,
+        store_uri='file:///', processes=1, cdx_cache=str(tmp_path / 'cache.db'))
+    bi = BatchIndexer(FakeTrackDB([]), 'cdx-index', args, cdx_url='http://cdx/test')
+    bi.cdx_cache.put('http://example.com/', { 'limit': 25 }, ['com,example)/ 20200101000000 http://example.com/'])
+    bi.cdx_cache.put('http://example.com/new', { 'limit': 25 }, [])
+
+    def fake_job(items, cdx_endpoint, store_uri=None, processes=1, cdx_cache=None):
+        # The loader drops the cached lookups of the URLs it indexes:
+        cdx_cache.invalidate_keys(['com,example)/'])
+        return { 'total_sent_records_i': 1 }
+    monkeypatch.setattr(local_cdx, 'run_local_cdx_index_job', fake_job)
+
+    items = warcs(100)
+    bi.run_job(items)
+    bi.mark_done(items)
+    # Both the cached result for the URL indexed and the cached misses have gone:
+    assert bi.cdx_cache.stats()['entries'] == 0
@@ -1,20 +1,74 @@
 import logging
-import requests
+import datetime
+import collections
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 logger = logging.getLogger(__name__)
 
-class CDX11():    
+# Defaults for bulk lookups:
+DEFAULT_CONCURRENCY = 16
+DEFAULT_PER_HOST = 4
+DEFAULT_TIMEOUT = 60
+
+CDX11_FIELDS = ['urlkey', 'timestamp', 'original', 'mimetype', 'statuscode',
+    'digest', 'redirecturl', 'robotflags', 'length', 'offset', 'filename']
+
+# Layout of the arrays generated by cdx_to_numpy:
+CDX11_DTYPE = [
+    ('urlkey', 'O'),
+    ('timestamp', 'i8'),
+    ('original', 'O'),
+    ('mimetype', 'O'),
+    ('statuscode', 'i2'),
+    ('digest', 'O'),
+    ('length', 'i8'),
+    ('offset', 'i8'),
+    ('filename', 'O')
+]
+
+
+def _field_property(index):
+    def get_field(self):
+        if self._fields is None:
+            self._fields = self.line.split(' ')
+        return self._fields[index]
+    return property(get_field)
+
+
+class CDX11():
+    '''
+    A CDX11 line. Only the raw line is kept until a field is needed, at which point it is split up.
+
+    The number of fields is checked up front (without splitting the line), so malformed lines are rejected here
+    rather than when a field is first used.
+    '''
+    __slots__ = ['line', '_fields']
+
+    urlkey = _field_property(0)
+    timestamp = _field_property(1)
+    original = _field_property(2)
+    mimetype = _field_property(3)
+    statuscode = _field_property(4)
+    digest = _field_property(5)
+    redirecturl = _field_property(6)
+    robotflags = _field_property(7)
+    length = _field_property(8)
+    offset = _field_property(9)
+    filename = _field_property(10)
+
     def __init__(self, line):
-        self.urlkey, self.timestamp, self.original, self.mimetype, self.statuscode, \
-        self.digest, self.redirecturl, self.robotflags, self.length, self.offset, self.filename = line.split(' ')
+        if line.count(' ') != len(CDX11_FIELDS) - 1:
+            raise Exception("Malformed CDX11 line, with %i fields rather than %i: %s" % (line.count(' ') + 1, len(CDX11_FIELDS), line))
+        self.line = line
+        self._fields = None
 
     def __str__(self):
-        return ' '.join([self.urlkey, self.timestamp, self.original, self.mimetype, self.statuscode, \
-        self.digest, self.redirecturl, self.robotflags, self.length, self.offset, self.filename])
+        return self.line
     
     @property
     def crawl_date(self):
-        return datetime.strptime(self.timestamp, '%Y%m%d%H%M%S')
+        return datetime.datetime.strptime(self.timestamp, '%Y%m%d%H%M%S')
     
     def to_dict(self):
         return {
@@ -32,28 +86,149 @@ class CDX11():
             'filename': self.filename
         }
 
+
+def cdx_to_numpy(lines, chunk_size=100000):
+    '''
+    Parse a stream of CDX11 lines (or CDX11 objects) into a NumPy structured array (see CDX11_DTYPE), 
+    for fast filtering and aggregation. Missing status codes are recorded as -1.
+    '''
+    import numpy as np
+    chunks = []
+    rows = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        else:
+            line = str(line)
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+        f = line.split(' ')
+        if len(f) != 11:
+            logger.warning("Skipping malformed CDX line: %s" % line)
+            continue
+        rows.append((f[0], int(f[1]), f[2], f[3], int(f[4]) if f[4].isdigit() else -1, f[5],
+            int(f[8]) if f[8].isdigit() else -1, int(f[9]) if f[9].isdigit() else -1, f[10]))
+        if len(rows) >= chunk_size:
+            chunks.append(np.array(rows, dtype=CDX11_DTYPE))
+            rows = []
+    chunks.append(np.array(rows, dtype=CDX11_DTYPE))
+    return np.concatenate(chunks)
+
 class CdxIndex():
     '''
     This class is used to query our CDX server.
     It knows what we've got, and when, but not what is open access or not.
     '''
 
-    def __init__(self, cdx_server='http://cdx.api.wa.bl.uk/data-heritrix'):
+    def __init__(self, cdx_server='http://cdx.api.wa.bl.uk/data-heritrix', pool_size=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
         self.cdx_server = cdx_server
+        self.timeout = timeout
+        # Imported here, so command-line tools that only need the defaults above start up quickly:
+        import requests
+        # Use a session so connections to the CDX server are kept alive and re-used:
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
+    def _get(self, url, limit, sort, stream=False, **kwargs):
+        params = { 'url' : url, 'limit': limit, 'sort': sort }
+        params.update(kwargs)
+        return self.session.get(self.cdx_server, params=params, timeout=self.timeout, stream=stream)
 
-    def query(self, url, limit=25, sort='reverse'):
+    def query(self, url, limit=25, sort='reverse', **kwargs):
         '''
         See https://nla.github.io/outbackcdx/api.html#operation/query 
+
+        Any additional keyword arguments (e.g. closest, matchType) are passed as query parameters.
+        A limit of None means no limit. Results are streamed, so large result sets are not held in memory.
+        Raises an exception if the query fails.
+        '''
+        with self._get(url, limit, sort, stream=True, **kwargs) as r:
+            if r.status_code == 200:
+                r.encoding = r.encoding or 'utf-8'
+                for line in r.iter_lines(decode_unicode=True):
+                    if line:
+                        yield CDX11(line)
+            elif r.status_code != 404:
+                raise Exception("CDX query for %s failed: %s" % (url, r))
+
+    def lookup(self, url, limit=25, sort='reverse', **kwargs):
         '''
-        r = requests.get(self.cdx_server, 
-            params = { 'url' : url, 'limit': limit, 'sort': sort } )
+        Like query, but returns a list, and raises an exception if the lookup fails.
+        '''
+        r = self._get(url, limit, sort, **kwargs)
         if r.status_code == 200:
-            for line in r.iter_lines(decode_unicode=True):
-                cdx = CDX11(line)
-                yield cdx
-        elif r.status_code != 404:
-            print("ERROR! %s" % r)
+            r.encoding = r.encoding or 'utf-8'
+            return [CDX11(line) for line in r.iter_lines(decode_unicode=True) if line]
+        elif r.status_code == 404:
+            return []
+        else:
+            raise Exception("CDX query for %s failed: %s" % (url, r))
+
+    @staticmethod
+    def _host_of(url):
+        if '://' not in url:
+            url = 'http://%s' % url
+        return urllib.parse.urlparse(url).hostname or ''
+
+    def bulk_query(self, urls, limit=25, sort='reverse', concurrency=DEFAULT_CONCURRENCY, per_host=DEFAULT_PER_HOST, **kwargs):
+        '''
+        Look up lots of URLs concurrently, yielding (url, results, error) tuples as each lookup completes.
+
+        At most `concurrency` lookups run at once, and at most `per_host` of those are for URLs on the
+        same host, with hosts taking turns so one big site does not hold up all the others.
+        Only a bounded number of URLs are read ahead from the input, so it can be a stream.
+        '''
+        lookahead = concurrency * 16
+        urls = iter(urls)
+        exhausted = False
+        # Queued URLs per host, in round-robin order:
+        queued = collections.OrderedDict()
+        queued_count = 0
+        in_flight = collections.Counter()
+        futures = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                # Read ahead:
+                while not exhausted and queued_count < lookahead:
+                    url = next(urls, None)
+                    if url is None:
+                        exhausted = True
+                        break
+                    queued.setdefault(self._host_of(url), collections.deque()).append(url)
+                    queued_count += 1
+                # Submit lookups, taking one URL from each eligible host in turn:
+                submitted = True
+                while submitted and len(futures) < concurrency:
+                    submitted = False
+                    for host in list(queued.keys()):
+                        if len(futures) >= concurrency:
+                            break
+                        if in_flight[host] >= per_host:
+                            continue
+                        url = queued[host].popleft()
+                        queued_count -= 1
+                        # Move this host to the back of the queue:
+                        pending = queued.pop(host)
+                        if pending:
+                            queued[host] = pending
+                        in_flight[host] += 1
+                        futures[executor.submit(self.lookup, url, limit, sort, **kwargs)] = (url, host)
+                        submitted = True
+                if not futures:
+                    break
+                # Wait for something to finish, and pass on the results:
+                done, not_done = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, host = futures.pop(future)
+                    in_flight[host] -= 1
+                    try:
+                        yield (url, future.result(), None)
+                    except Exception as e:
+                        logger.warning("Lookup of %s failed: %s" % (url, e))
+                        yield (url, [], e)
 
 
     def _capture_dates_generator(self, url, sort="reverse"):
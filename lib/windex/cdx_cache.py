@@ -0,0 +1,235 @@
+'''
+A local, persistent cache of CDX lookups, to save hitting the CDX server for the same URLs over and over.
+
+Lookups are cached in a SQLite database, keyed by the SURT form of the URL plus the query parameters,
+so trivially different forms of the same URL (e.g. 'http://www.example.com' and 'http://example.com/')
+share the same entry. Misses are cached too, but for a shorter time, as these are the lookups most
+likely to change once more content has been indexed.
+
+Counts of hits, misses etc. are kept in the database, so they accumulate across runs.
+'''
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from lib.windex.cdx import CdxIndex, CDX11
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CDX_CACHE = os.environ.get("CDX_CACHE", None)
+
+# How long to keep results for, in seconds:
+DEFAULT_TTL = 7*24*60*60
+DEFAULT_NEGATIVE_TTL = 24*60*60
+
+# Don't cache very large result sets:
+DEFAULT_MAX_CACHED_RESULTS = 10000
+
+STATS_FIELDS = ['hits', 'negative_hits', 'misses', 'expired', 'stores', 'invalidations']
+
+
+def url_to_cache_key(url):
+    '''
+    The SURT form of the URL, used as the cache key.
+    '''
+    # Imported here, so command-line tools that only need the defaults above start up quickly:
+    import surt
+    try:
+        return surt.surt(url)
+    except Exception as e:
+        logger.warning("Could not SURT %s, using the URL as-is: %s" % (url, e))
+        return url
+
+
+class CdxCache():
+    '''
+    Stores CDX lookup results in a SQLite database.
+    '''
+
+    def __init__(self, path, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        with self.conn:
+            # Allow other processes to read while we write:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS cdx_cache "
+                "(surt TEXT NOT NULL, params TEXT NOT NULL, lines TEXT NOT NULL, found INTEGER NOT NULL, cached_at REAL NOT NULL, "
+                "PRIMARY KEY (surt, params))")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS cdx_cache_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _count(self, name, n=1):
+        self.conn.execute("INSERT OR IGNORE INTO cdx_cache_stats (name, value) VALUES (?, 0)", (name,))
+        self.conn.execute("UPDATE cdx_cache_stats SET value = value + ? WHERE name = ?", (n, name))
+
+    @staticmethod
+    def _params_key(params):
+        return json.dumps(params, sort_keys=True)
+
+    def get(self, url, params):
+        '''
+        Returns the list of cached CDX lines, or None if there is no current entry.
+        '''
+        key = url_to_cache_key(url)
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT lines, found, cached_at FROM cdx_cache WHERE surt = ? AND params = ?",
+                (key, self._params_key(params))).fetchone()
+            if row is None:
+                self._count('misses')
+                return None
+            lines, found, cached_at = row
+            ttl = self.ttl if found else self.negative_ttl
+            if time.time() - cached_at > ttl:
+                self._count('expired')
+                self._count('misses')
+                return None
+            if found:
+                self._count('hits')
+                return json.loads(lines)
+            else:
+                self._count('negative_hits')
+                return []
+
+    def put(self, url, params, lines):
+        key = url_to_cache_key(url)
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO cdx_cache (surt, params, lines, found, cached_at) VALUES (?, ?, ?, ?, ?)",
+                (key, self._params_key(params), json.dumps(lines), 1 if lines else 0, time.time()))
+            self._count('stores')
+
+    def invalidate(self, urls):
+        '''
+        Drop any cached results for the given URLs.
+        '''
+        removed = 0
+        with self.lock, self.conn:
+            for url in urls:
+                removed += self.conn.execute("DELETE FROM cdx_cache WHERE surt = ?", (url_to_cache_key(url),)).rowcount
+            self._count('invalidations', removed)
+        return removed
+
+    def invalidate_keys(self, keys):
+        '''
+        Drop any cached results for the given SURTs, e.g. the urlkeys of CDX lines that have just been loaded.
+        '''
+        removed = 0
+        with self.lock, self.conn:
+            for key in keys:
+                removed += self.conn.execute("DELETE FROM cdx_cache WHERE surt = ?", (key,)).rowcount
+            self._count('invalidations', removed)
+        return removed
+
+    def invalidate_all(self, negative_only=False):
+        '''
+        Drop all cached results, or just the cached misses.
+        '''
+        with self.lock, self.conn:
+            if negative_only:
+                removed = self.conn.execute("DELETE FROM cdx_cache WHERE found = 0").rowcount
+            else:
+                removed = self.conn.execute("DELETE FROM cdx_cache").rowcount
+            self._count('invalidations', removed)
+        return removed
+
+    def expire(self):
+        '''
+        Drop all the entries that have outlived their TTL.
+        '''
+        now = time.time()
+        with self.lock, self.conn:
+            removed = self.conn.execute("DELETE FROM cdx_cache WHERE (found = 1 AND cached_at < ?) OR (found = 0 AND cached_at < ?)",
+                (now - self.ttl, now - self.negative_ttl)).rowcount
+        return removed
+
+    def stats(self):
+        with self.lock:
+            stats = dict((name, 0) for name in STATS_FIELDS)
+            for name, value in self.conn.execute("SELECT name, value FROM cdx_cache_stats"):
+                stats[name] = value
+            stats['entries'], stats['negative_entries'] = self.conn.execute(
+                "SELECT COUNT(*), COUNT(*) - COALESCE(SUM(found), 0) FROM cdx_cache").fetchone()
+        lookups = stats['hits'] + stats['negative_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['hits'] + stats['negative_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        self.conn.close()
+
+
+class CachedCdxIndex(CdxIndex):
+    '''
+    A CdxIndex that checks a CdxCache before going to the CDX server.
+    '''
+
+    def __init__(self, cache, cdx_server='http://cdx.api.wa.bl.uk/data-heritrix', max_cached_results=DEFAULT_MAX_CACHED_RESULTS, **kwargs):
+        super().__init__(cdx_server, **kwargs)
+        self.cache = cache
+        self.max_cached_results = max_cached_results
+
+    def lookup(self, url, limit=25, sort='reverse', **kwargs):
+        params = { 'cdx_server': self.cdx_server, 'limit': limit, 'sort': sort }
+        params.update(kwargs)
+        lines = self.cache.get(url, params)
+        if lines is None:
+            results = super().lookup(url, limit, sort, **kwargs)
+            if len(results) <= self.max_cached_results:
+                self.cache.put(url, params, [str(cdx) for cdx in results])
+            return results
+        return [CDX11(line) for line in lines]
+
+    def query(self, url, limit=25, sort='reverse', **kwargs):
+        for cdx in self.lookup(url, limit, sort, **kwargs):
+            yield cdx
+
+
+class CdxCacheCollector():
+    '''
+    Prometheus collector exposing the cache statistics.
+    '''
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def collect(self):
+        from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+        stats = self.cache.stats()
+
+        m_lookups = CounterMetricFamily('ukwa_cdx_cache_lookups',
+            'Total CDX cache lookups, labeled by result.',
+            labels=['result'])
+        for result in ['hits', 'negative_hits', 'misses', 'expired']:
+            m_lookups.add_metric([result], float(stats[result]))
+
+        m_entries = GaugeMetricFamily('ukwa_cdx_cache_entries',
+            'Number of entries in the CDX cache, labeled by whether they record a miss.',
+            labels=['negative'])
+        m_entries.add_metric(['false'], float(stats['entries'] - stats['negative_entries']))
+        m_entries.add_metric(['true'], float(stats['negative_entries']))
+
+        m_ratio = GaugeMetricFamily('ukwa_cdx_cache_hit_ratio',
+            'Fraction of CDX lookups served from the cache.')
+        m_ratio.add_metric([], float(stats['hit_ratio']))
+
+        yield m_lookups
+        yield m_entries
+        yield m_ratio
+
+
+def push_cache_metrics(cache, job='cdx-cache'):
+    '''
+    Push the cache statistics to Prometheus, if a push gateway is configured.
+    '''
+    if not os.environ.get("PUSH_GATEWAY"):
+        return
+    from prometheus_client import CollectorRegistry, push_to_gateway
+    registry = CollectorRegistry()
+    registry.register(CdxCacheCollector(cache))
+    try:
+        push_to_gateway(os.environ.get("PUSH_GATEWAY"), job=job, registry=registry)
+    except Exception as e:
+        # Don't let monitoring problems get in the way:
+        logger.warning("Could not push CDX cache metrics: %s" % e)
@@ -0,0 +1,58 @@
+import pytest
+from lib.windex.cdx_cache import CdxCache, CachedCdxIndex, CdxCacheCollector
+from lib.windex.cdx_load import CdxLoader
+from lib.windex.cdx_tests import FakeResponse, FakeSession
+
+PARAMS = { 'limit': 25 }
+
+
+def test_get_and_put(tmp_path):
+    cache = CdxCache(str(tmp_path / 'cache.db'))
+    assert cache.get('http://www.example.com/', PARAMS) is None
+    cache.put('http://www.example.com/', PARAMS, ['a'])
+    cache.put('http://example.com/missing', PARAMS, [])
+    # Trivially different forms of the URL share the entry:
+    assert cache.get('http://example.com', PARAMS) == ['a']
+    assert cache.get('http://example.com/missing', PARAMS) == []
+    stats = cache.stats()
+    assert (stats['hits'], stats['negative_hits'], stats['misses']) == (1, 1, 1)
+
+
+def test_invalidate_loaded_keys(tmp_path):
+    cache = CdxCache(str(tmp_path / 'cache.db'))
+    cache.put('http://www.example.com/', PARAMS, ['a'])
+    cache.put('http://example.com/new', PARAMS, [])
+    cache.put('http://example.org/', PARAMS, ['b'])
+
+    class Session(object):
+        def post(self, url, params=None, data=None):
+            return FakeResponse(200)
+    loader = CdxLoader('http://cdx/test', cdx_cache=cache)
+    loader.session = Session()
+    loader.load([
+        'com,example)/ 20200101120000 http://example.com/ text/html 200 AAAA - - 1 2 a.warc.gz',
+        'com,example)/new 20200101120000 http://example.com/new text/html 200 BBBB - - 1 2 a.warc.gz',
+    ])
+    assert cache.get('http://example.com/', PARAMS) is None
+    assert cache.get('http://example.com/new', PARAMS) is None
+    assert cache.get('http://example.org/', PARAMS) == ['b']
+
+
+def test_cached_query_failure_raises(tmp_path):
+    cdxs = CachedCdxIndex(CdxCache(str(tmp_path / 'cache.db')), 'http://cdx/test')
+    cdxs.session = FakeSession(FakeResponse(500))
+    with pytest.raises(Exception):
+        list(cdxs.query('http://example.com/'))
+
+
+def test_collector(tmp_path):
+    from prometheus_client import CollectorRegistry
+    cache = CdxCache(str(tmp_path / 'cache.db'))
+    cache.put('http://example.com/', PARAMS, ['a'])
+    cache.put('http://example.com/missing', PARAMS, [])
+    cache.get('http://example.com/', PARAMS)
+    registry = CollectorRegistry()
+    registry.register(CdxCacheCollector(cache))
+    assert registry.get_sample_value('ukwa_cdx_cache_lookups_total', { 'result': 'hits' }) == 1
+    assert registry.get_sample_value('ukwa_cdx_cache_entries', { 'negative': 'true' }) == 1
+    assert registry.get_sample_value('ukwa_cdx_cache_hit_ratio') == 1.0
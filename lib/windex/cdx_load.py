@@ -0,0 +1,209 @@
+'''
+Loads CDX files into an OutbackCDX collection in bulk, e.g. the sorted part files output by the Hadoop CDX
+generator, when rebuilding or backfilling an index.
+
+- The input files must each be sorted already. They are merged as they are read, so only one line from each
+  file is held in memory, and the merged lines are sent in large, sorted chunks. If a line is found out of
+  order, the load stops, as the checkpoint can no longer be relied upon. Once the input is fixed, remove the
+  checkpoint file and load it all again (sending the same lines again does no harm).
+- Chunks are POSTed over several connections at once, so the CDX server's ingest rate is the limit. Failed
+  POSTs are retried with an increasing delay.
+- The last line of the longest run of chunks that have all been accepted is recorded in a checkpoint file. If
+  the load is interrupted, running it again with the same checkpoint file skips everything up to that line.
+- If a CdxCache is given, cached lookups of the URLs in each chunk are dropped once it has been accepted.
+  Cached results of prefix or domain queries covering those URLs are not, so they can be out of date until
+  they expire.
+'''
+import io
+import os
+import gzip
+import json
+import time
+import heapq
+import logging
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Number of CDX lines to send in each POST:
+DEFAULT_CHUNK_SIZE = 100000
+
+# Number of POSTs to run at once:
+DEFAULT_LOAD_WORKERS = 4
+
+# How many times to try each POST:
+DEFAULT_RETRIES = 5
+
+
+def _read_lines(stream, path):
+    # Decompress if needed, and yield the lines, skipping any CDX header lines:
+    if path.endswith('.gz'):
+        stream = gzip.GzipFile(fileobj=stream)
+    else:
+        stream = io.BufferedReader(stream)
+    for line in stream:
+        line = line.decode('utf-8').rstrip('\r\n')
+        if line and not line.startswith(' CDX') and not line.startswith('CDX '):
+            yield line
+
+
+def list_inputs(store, paths, prefix='part-'):
+    '''
+    Expand the given paths into the list of files to load. Directories are expanded to the files in them whose
+    names start with the given prefix (like Hadoop job output directories).
+    '''
+    inputs = []
+    for path in paths:
+        for item in store.list(path):
+            if item['file_path_s'] == path or item['file_name_s'].startswith(prefix):
+                inputs.append(item['file_path_s'])
+    return sorted(inputs)
+
+
+@contextlib.contextmanager
+def merged_lines(store, paths):
+    '''
+    A context manager giving an iterator over the lines of all the given (already sorted) CDX files, in
+    sorted order.
+    '''
+    with contextlib.ExitStack() as stack:
+        iterators = []
+        for path in paths:
+            stream = stack.enter_context(store.stream(path))
+            iterators.append(_read_lines(stream, path))
+        yield heapq.merge(*iterators)
+
+
+class CdxLoader():
+    '''
+    Sends sorted CDX lines to an OutbackCDX collection, in parallel chunks, with retries and a checkpoint.
+    '''
+
+    def __init__(self, cdx_endpoint, checkpoint_file=None, chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_LOAD_WORKERS,
+                 retries=DEFAULT_RETRIES, skip_bad_lines=False, cdx_cache=None):
+        self.cdx_endpoint = cdx_endpoint
+        self.cdx_cache = cdx_cache
+        self.checkpoint_file = checkpoint_file
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.retries = retries
+        self.params = { 'badLines': 'skip' } if skip_bad_lines else {}
+        # Imported here, so command-line tools that only need the defaults above start up quickly:
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=workers))
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=workers))
+        self.lock = threading.Lock()
+        self.stats = {
+            'total_lines_i': 0,
+            'total_skipped_lines_i': 0,
+            'total_sent_lines_i': 0,
+            'total_post_requests_i': 0,
+            'total_retries_i': 0,
+        }
+        # Chunks that have been accepted, but follow one that has not yet:
+        self.acknowledged = {}
+        self.next_to_checkpoint = 0
+
+    def load_checkpoint(self):
+        '''
+        Returns the last line that was known to have been loaded, if there is a checkpoint.
+        '''
+        if self.checkpoint_file and os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file) as f:
+                checkpoint = json.load(f)
+            logger.info("Resuming after %i lines, at: %s" % (checkpoint['lines_i'], checkpoint['last_line']))
+            return checkpoint
+        return None
+
+    def _save_checkpoint(self, last_line, lines):
+        if not self.checkpoint_file:
+            return
+        tmp_path = "%s_temp_" % self.checkpoint_file
+        with open(tmp_path, 'w') as f:
+            json.dump({ 'last_line': last_line, 'lines_i': lines }, f)
+        os.replace(tmp_path, self.checkpoint_file)
+
+    def _post(self, chunk):
+        import requests
+        data = "\n".join(chunk).encode('utf-8')
+        for attempt in range(self.retries):
+            try:
+                r = self.session.post(self.cdx_endpoint, params=self.params, data=data)
+                if r.status_code == 200:
+                    return
+                # Errors in the data will not go away when we try again:
+                if 400 <= r.status_code < 500:
+                    raise Exception("Posting CDX to %s failed: %s %s" % (self.cdx_endpoint, r, r.text))
+                logger.warning("Posting CDX to %s failed: %s %s" % (self.cdx_endpoint, r, r.text))
+            except requests.exceptions.RequestException as e:
+                logger.warning("Posting CDX to %s failed: %s" % (self.cdx_endpoint, e))
+            if attempt + 1 < self.retries:
+                with self.lock:
+                    self.stats['total_retries_i'] += 1
+                time.sleep(2 ** attempt)
+        raise Exception("Posting CDX to %s failed after %i attempts!" % (self.cdx_endpoint, self.retries))
+
+    def _send(self, seq, chunk, lines_so_far):
+        self._post(chunk)
+        if self.cdx_cache:
+            # Cached lookups of these URLs may now be out of date (the urlkey is the SURT the cache uses):
+            self.cdx_cache.invalidate_keys(set(line.split(' ', 1)[0] for line in chunk))
+        with self.lock:
+            self.stats['total_post_requests_i'] += 1
+            self.stats['total_sent_lines_i'] += len(chunk)
+            # Move the checkpoint forward past any chunks that are now all done:
+            self.acknowledged[seq] = (chunk[-1], lines_so_far)
+            checkpoint = None
+            while self.next_to_checkpoint in self.acknowledged:
+                checkpoint = self.acknowledged.pop(self.next_to_checkpoint)
+                self.next_to_checkpoint += 1
+            if checkpoint:
+                self._save_checkpoint(*checkpoint)
+
+    def load(self, lines):
+        '''
+        Load the given sorted CDX lines, returning the stats.
+        '''
+        start = time.time()
+        checkpoint = self.load_checkpoint()
+        resume_after = checkpoint['last_line'] if checkpoint else None
+        lines_so_far = checkpoint['lines_i'] if checkpoint else 0
+        previous = None
+        futures = []
+        chunk = []
+        seq = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for line in lines:
+                self.stats['total_lines_i'] += 1
+                # Resuming skips everything up to the checkpoint, so this would get lost:
+                if previous is not None and line < previous:
+                    raise Exception("Line %i is out of order, so the input files are not sorted! Found: %s After: %s "
+                        "Once the input is fixed, remove the checkpoint file and load it all again."
+                        % (self.stats['total_lines_i'], line, previous))
+                previous = line
+                if resume_after is not None and line <= resume_after:
+                    self.stats['total_skipped_lines_i'] += 1
+                    continue
+                chunk.append(line)
+                if len(chunk) >= self.chunk_size:
+                    lines_so_far += len(chunk)
+                    futures.append(executor.submit(self._send, seq, chunk, lines_so_far))
+                    seq += 1
+                    chunk = []
+                    # Keep a bounded number of chunks in memory, and stop at the first failure:
+                    while len(futures) >= 2 * self.workers:
+                        futures.pop(0).result()
+            if chunk:
+                lines_so_far += len(chunk)
+                futures.append(executor.submit(self._send, seq, chunk, lines_so_far))
+            for future in futures:
+                future.result()
+        secs = time.time() - start
+        self.stats['total_secs_f'] = secs
+        if secs > 0:
+            self.stats['lines_per_sec_f'] = self.stats['total_sent_lines_i'] / secs
+        return self.stats
@@ -0,0 +1,135 @@
+import os
+import gzip
+import json
+import pytest
+import requests
+import lib.windex.cdx_load as cdx_load
+from lib.store.local import LocalStore
+from lib.windex.cdx_load import CdxLoader, list_inputs, merged_lines
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = 'status %i' % status_code
+
+
+class FakeSession(object):
+    '''
+    Records the chunks POSTed, and responds with the given status codes in turn (then 200).
+    '''
+
+    def __init__(self, statuses=None, fail_after=None):
+        self.statuses = list(statuses or [])
+        self.fail_after = fail_after
+        self.chunks = []
+        self.attempts = 0
+
+    def post(self, url, params=None, data=None):
+        self.attempts += 1
+        if self.statuses:
+            status = self.statuses.pop(0)
+            if status is None:
+                raise requests.exceptions.ConnectionError("Simulated connection failure")
+            if status != 200:
+                return FakeResponse(status)
+        if self.fail_after is not None and len(self.chunks) >= self.fail_after:
+            return FakeResponse(400)
+        self.chunks.append(data.decode('utf-8').split('\n'))
+        return FakeResponse(200)
+
+
+def loader(session, **kwargs):
+    l = CdxLoader('http://cdx/test', **kwargs)
+    l.session = session
+    return l
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(cdx_load.time, 'sleep', lambda secs: None)
+
+
+def write_cdx(path, lines, gzipped=False):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = (" CDX N b a m s k r M S V g\n" + "".join("%s\n" % line for line in lines)).encode('utf-8')
+    if gzipped:
+        data = gzip.compress(data)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def test_merge_part_files(tmp_path):
+    store = LocalStore(str(tmp_path))
+    write_cdx(str(tmp_path / 'out' / 'part-00000'), ['a 1', 'c 1', 'e 1'])
+    write_cdx(str(tmp_path / 'out' / 'part-00001.gz'), ['b 1', 'd 1', 'f 1'], gzipped=True)
+    write_cdx(str(tmp_path / 'out' / '_SUCCESS'), [])
+    paths = list_inputs(store, ['/out'])
+    assert paths == ['/out/part-00000', '/out/part-00001.gz']
+    with merged_lines(store, paths) as lines:
+        assert list(lines) == ['a 1', 'b 1', 'c 1', 'd 1', 'e 1', 'f 1']
+
+
+def test_chunks_and_retries():
+    session = FakeSession(statuses=[503, None, 200])
+    l = loader(session, chunk_size=2, workers=1)
+    stats = l.load(['a', 'b', 'c', 'd', 'e'])
+    assert session.chunks == [['a', 'b'], ['c', 'd'], ['e']]
+    assert stats['total_sent_lines_i'] == 5
+    assert stats['total_post_requests_i'] == 3
+    assert stats['total_retries_i'] == 2
+
+
+def test_gives_up_after_retries():
+    session = FakeSession(statuses=[500] * 10)
+    with pytest.raises(Exception):
+        loader(session, retries=3).load(['a'])
+    assert session.attempts == 3
+
+
+def test_bad_data_not_retried():
+    session = FakeSession(statuses=[400])
+    with pytest.raises(Exception):
+        loader(session).load(['a'])
+    assert session.attempts == 1
+
+
+def test_checkpoint_and_resume(tmp_path):
+    checkpoint = str(tmp_path / 'checkpoint.json')
+    lines = ['%03d' % i for i in range(10)]
+
+    # Fail part of the way through:
+    session = FakeSession(fail_after=2)
+    with pytest.raises(Exception):
+        loader(session, checkpoint_file=checkpoint, chunk_size=3, workers=1).load(lines)
+    with open(checkpoint) as f:
+        assert json.load(f) == { 'last_line': '005', 'lines_i': 6 }
+
+    # Running again carries on after the last chunk that was accepted:
+    session = FakeSession()
+    stats = loader(session, checkpoint_file=checkpoint, chunk_size=3, workers=1).load(lines)
+    assert session.chunks == [['006', '007', '008'], ['009']]
+    assert stats['total_skipped_lines_i'] == 6
+    with open(checkpoint) as f:
+        assert json.load(f) == { 'last_line': '009', 'lines_i': 10 }
+
+
+def test_checkpoint_waits_for_earlier_chunks(tmp_path):
+    checkpoint = str(tmp_path / 'checkpoint.json')
+    l = loader(FakeSession(), checkpoint_file=checkpoint)
+    # Chunks can finish out of order, but the checkpoint only moves past chunks once all before them are done:
+    l._send(1, ['c', 'd'], 4)
+    assert not os.path.exists(checkpoint)
+    l._send(0, ['a', 'b'], 2)
+    with open(checkpoint) as f:
+        assert json.load(f) == { 'last_line': 'd', 'lines_i': 4 }
+
+
+def test_out_of_order_lines_stop_the_load(tmp_path):
+    checkpoint = str(tmp_path / 'checkpoint.json')
+    session = FakeSession()
+    with pytest.raises(Exception, match='out of order'):
+        loader(session, checkpoint_file=checkpoint, chunk_size=2, workers=1).load(['a', 'b', 'c', 'x', 'd', 'e', 'f'])
+    # Nothing from the line that is out of order onwards gets sent:
+    assert session.chunks == [['a', 'b'], ['c', 'x']]
@@ -0,0 +1,111 @@
+'''
+Summarises the captures of a whole host, domain or URL prefix, aggregating the CDX results as they are
+streamed from the CDX server, so memory use depends only on the number of distinct years, status codes,
+MIME types and hosts, not on the number of captures.
+'''
+import io
+import csv
+import logging
+import collections
+
+logger = logging.getLogger(__name__)
+
+# How many of the most common MIME types and hosts to report:
+DEFAULT_TOP = 50
+
+# Log progress every this many captures:
+PROGRESS_INTERVAL = 1000000
+
+
+def _host_of_urlkey(urlkey):
+    # e.g. 'uk,co,example,www)/path' -> 'uk,co,example,www'
+    return urlkey.split(')', 1)[0]
+
+
+class CdxSummary():
+    '''
+    Compact counters for a stream of CDX records.
+    '''
+
+    def __init__(self):
+        self.captures = 0
+        self.urls = 0
+        self.bytes = 0
+        self.first = None
+        self.last = None
+        self.years = collections.Counter()
+        self.statuses = collections.Counter()
+        self.mimetypes = collections.Counter()
+        self.hosts = collections.Counter()
+        self._last_urlkey = None
+
+    def add(self, cdx):
+        self.captures += 1
+        urlkey = cdx.urlkey
+        # Results come grouped by URL key, so distinct URLs can be counted without remembering them all:
+        if urlkey != self._last_urlkey:
+            self.urls += 1
+            self._last_urlkey = urlkey
+        timestamp = cdx.timestamp
+        if self.first is None or timestamp < self.first:
+            self.first = timestamp
+        if self.last is None or timestamp > self.last:
+            self.last = timestamp
+        if cdx.length.isdigit():
+            self.bytes += int(cdx.length)
+        self.years[timestamp[:4]] += 1
+        self.statuses[cdx.statuscode] += 1
+        self.mimetypes[cdx.mimetype] += 1
+        self.hosts[_host_of_urlkey(urlkey)] += 1
+
+    def add_all(self, results):
+        for cdx in results:
+            self.add(cdx)
+            if self.captures % PROGRESS_INTERVAL == 0:
+                logger.info("Summarised %i captures..." % self.captures)
+        return self
+
+    def to_dict(self, top=DEFAULT_TOP):
+        '''
+        The summary as a dict. Only the most common MIME types and hosts are listed, with the rest added up
+        under 'other'.
+        '''
+        def top_n(counter):
+            result = collections.OrderedDict(counter.most_common(top))
+            other = sum(counter.values()) - sum(result.values())
+            if other > 0:
+                result['other'] = other
+            return result
+        return {
+            'captures': self.captures,
+            'urls': self.urls,
+            'bytes': self.bytes,
+            'first_capture': self.first,
+            'last_capture': self.last,
+            'years': collections.OrderedDict(sorted(self.years.items())),
+            'statuses': collections.OrderedDict(sorted(self.statuses.items())),
+            'mimetypes': top_n(self.mimetypes),
+            'hosts': top_n(self.hosts),
+        }
+
+    def to_csv(self, top=DEFAULT_TOP):
+        '''
+        The summary as CSV, with one 'counter,key,count' row per value.
+        '''
+        summary = self.to_dict(top)
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(['counter', 'key', 'count'])
+        for name in ['captures', 'urls', 'bytes', 'first_capture', 'last_capture']:
+            writer.writerow(['total', name, summary[name]])
+        for name in ['years', 'statuses', 'mimetypes', 'hosts']:
+            for key, count in summary[name].items():
+                writer.writerow([name, key, count])
+        return out.getvalue()
+
+
+def summarise(cdxs, url, match_type='domain', limit=None):
+    '''
+    Stream all the captures matching the URL from the CDX service, and summarise them.
+    '''
+    return CdxSummary().add_all(cdxs.query(url, limit=limit, sort=None, matchType=match_type))
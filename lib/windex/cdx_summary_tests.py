@@ -0,0 +1,61 @@
+import csv
+import io
+from lib.windex.cdx import CDX11
+from lib.windex.cdx_summary import CdxSummary, summarise
+from lib.windex.cdx_tests import FakeResponse, FakeSession, cdx_index
+
+LINES = [
+    'uk,co,example)/ 20190101120000 http://example.co.uk/ text/html 200 AAAA - - 100 0 a.warc.gz',
+    'uk,co,example)/ 20200101120000 http://example.co.uk/ text/html 200 BBBB - - 200 0 a.warc.gz',
+    'uk,co,example)/a 20180601000000 http://example.co.uk/a text/html 301 CCCC - - 50 0 a.warc.gz',
+    'uk,co,example,www)/b.pdf 20200601000000 http://www.example.co.uk/b.pdf application/pdf 200 DDDD - - 1000 0 b.warc.gz',
+    # A revisit record, with no length:
+    'uk,co,example,www)/b.pdf 20210101000000 http://www.example.co.uk/b.pdf warc/revisit - DDDD - - - 0 c.warc.gz',
+]
+
+
+class RecordingSession(FakeSession):
+
+    def get(self, url, params=None, timeout=None, stream=False):
+        self.params = params
+        self.stream = stream
+        return self.response
+
+
+def test_counters():
+    summary = CdxSummary().add_all(CDX11(line) for line in LINES)
+    d = summary.to_dict()
+    assert (d['captures'], d['urls'], d['bytes']) == (5, 3, 1350)
+    assert (d['first_capture'], d['last_capture']) == ('20180601000000', '20210101000000')
+    assert list(d['years'].items()) == [('2018', 1), ('2019', 1), ('2020', 2), ('2021', 1)]
+    assert d['statuses'] == { '-': 1, '200': 3, '301': 1 }
+    assert d['hosts'] == { 'uk,co,example': 3, 'uk,co,example,www': 2 }
+
+
+def test_top_and_other():
+    d = CdxSummary().add_all(CDX11(line) for line in LINES).to_dict(top=1)
+    assert list(d['mimetypes'].items()) == [('text/html', 3), ('other', 2)]
+    assert list(d['hosts'].items()) == [('uk,co,example', 3), ('other', 2)]
+
+
+def test_empty():
+    d = CdxSummary().to_dict()
+    assert (d['captures'], d['urls'], d['first_capture']) == (0, 0, None)
+    assert d['mimetypes'] == {}
+
+
+def test_csv():
+    rows = list(csv.reader(io.StringIO(CdxSummary().add_all(CDX11(line) for line in LINES).to_csv())))
+    assert rows[0] == ['counter', 'key', 'count']
+    assert ['total', 'captures', '5'] in rows
+    assert ['years', '2020', '2'] in rows
+    assert ['statuses', '301', '1'] in rows
+
+
+def test_summarise_streams_the_whole_domain():
+    cdxs = cdx_index(FakeResponse(200, LINES))
+    cdxs.session = RecordingSession(cdxs.session.response)
+    summary = summarise(cdxs, 'example.co.uk')
+    assert summary.captures == 5
+    assert cdxs.session.stream
+    assert cdxs.session.params == { 'url': 'example.co.uk', 'limit': None, 'sort': None, 'matchType': 'domain' }
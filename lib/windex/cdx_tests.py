@@ -0,0 +1,91 @@
+import datetime
+import pytest
+from lib.windex.cdx import CdxIndex, CDX11, cdx_to_numpy
+
+LINES = [
+    'uk,bl)/ 20200101120000 http://www.bl.uk/ text/html 200 AAAA - - 1234 5678 BL-20200101.warc.gz',
+    'uk,bl)/ 20190101120000 https://www.bl.uk/ text/html 301 BBBB - - 432 100 BL-20190101.warc.gz',
+]
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, lines=None):
+        self.status_code = status_code
+        self.encoding = None
+        self.lines = lines or []
+
+    def iter_lines(self, decode_unicode=False):
+        return iter(self.lines + [''])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class FakeSession(object):
+
+    def __init__(self, response):
+        self.response = response
+
+    def get(self, url, params=None, timeout=None, stream=False):
+        return self.response
+
+
+def cdx_index(response):
+    cdxs = CdxIndex('http://cdx/test')
+    cdxs.session = FakeSession(response)
+    return cdxs
+
+
+def test_query():
+    results = list(cdx_index(FakeResponse(200, LINES)).query('http://www.bl.uk/'))
+    assert [str(r) for r in results] == LINES
+    assert list(cdx_index(FakeResponse(404)).query('http://www.bl.uk/')) == []
+
+
+def test_query_failure_raises():
+    with pytest.raises(Exception):
+        list(cdx_index(FakeResponse(500)).query('http://www.bl.uk/'))
+    with pytest.raises(Exception):
+        cdx_index(FakeResponse(502)).lookup('http://www.bl.uk/')
+
+
+def test_fields_are_lazy():
+    cdx = CDX11(LINES[0])
+    assert cdx._fields is None
+    assert str(cdx) == LINES[0]
+    assert cdx.urlkey == 'uk,bl)/'
+    assert cdx._fields is not None
+    assert cdx.filename == 'BL-20200101.warc.gz'
+    assert cdx.crawl_date == datetime.datetime(2020, 1, 1, 12, 0, 0)
+    d = cdx.to_dict()
+    assert (d['statuscode'], d['length'], d['offset']) == ('200', 1234, 5678)
+
+
+def test_malformed_lines_rejected():
+    with pytest.raises(Exception):
+        CDX11('uk,bl)/ 20200101120000 http://www.bl.uk/')
+    with pytest.raises(Exception):
+        CDX11(LINES[0] + ' extra')
+
+
+def test_cdx_to_numpy():
+    lines = [
+        LINES[0].encode('utf-8') + b'\r\n',
+        '',
+        CDX11(LINES[1]),
+        'not a cdx line',
+        'uk,bl)/about 20200101120001 http://www.bl.uk/about warc/revisit - CCCC - - - - BL-20200101.warc.gz\n',
+    ]
+    # Use a tiny chunk size, so the chunks have to be joined up:
+    a = cdx_to_numpy(lines, chunk_size=1)
+    assert len(a) == 3
+    assert list(a['timestamp']) == [20200101120000, 20190101120000, 20200101120001]
+    assert list(a['statuscode']) == [200, 301, -1]
+    assert list(a['length']) == [1234, 432, -1]
+    assert list(a['offset']) == [5678, 100, -1]
+    assert list(a['filename'][a['statuscode'] == 301]) == ['BL-20190101.warc.gz']
+    assert len(cdx_to_numpy([])) == 0
@@ -0,0 +1,122 @@
+'''
+Verifies that WARCs have been indexed into a CDX service, by checking a sample of their records.
+
+Records are sampled from each WARC (either the first N, which only means reading the start of
+each WARC, or a uniform reservoir sample over the whole file), and the samples from the whole
+batch are then looked up concurrently.
+'''
+import re
+import random
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_SIZE = 10
+DEFAULT_VERIFY_WORKERS = 16
+
+# Skip ridiculously long URIs:
+MAX_URL_LENGTH = 2000
+
+
+def _indexable_records(stream):
+    '''
+    Yields (url, timestamp) for each indexable response record in a WARC stream, plus a count of all records seen.
+    '''
+    # Imported here, so command-line tools that only need the defaults above start up quickly:
+    from warcio.archiveiterator import ArchiveIterator
+    for record in ArchiveIterator(stream):
+        if record.rec_type == 'response' and 'application/http' in record.content_type:
+            url = record.rec_headers.get_header('WARC-Target-URI')
+            if len(url) > MAX_URL_LENGTH:
+                logger.warning("Skipping very long URL: %s" % url)
+                continue
+            # Timestamp, stripped down to Wayback form:
+            timestamp = re.sub('[^0-9]', '', record.rec_headers.get_header('WARC-Date'))[:14]
+            yield url, timestamp
+
+
+def sample_warc(store, path, sample_size=DEFAULT_SAMPLE_SIZE, reservoir=False, rng=random):
+    '''
+    Sample indexable records from a WARC on the store.
+
+    By default, the first sample_size records are used. With reservoir=True, the whole WARC is read and
+    a uniform random sample is taken.
+
+    :return: a list of (url, timestamp) tuples
+    '''
+    sample = []
+    with store.stream(path) as stream:
+        for i, item in enumerate(_indexable_records(stream)):
+            if len(sample) < sample_size:
+                sample.append(item)
+                if not reservoir and len(sample) >= sample_size:
+                    break
+            else:
+                # Replace elements with gradually decreasing probability:
+                j = rng.randint(0, i)
+                if j < sample_size:
+                    sample[j] = item
+    return sample
+
+
+class CdxVerifier():
+    '''
+    Checks sampled records from a batch of WARCs against a CDX service.
+    '''
+
+    def __init__(self, cdxs, store, sample_size=DEFAULT_SAMPLE_SIZE, reservoir=False, workers=DEFAULT_VERIFY_WORKERS):
+        self.cdxs = cdxs
+        self.store = store
+        self.sample_size = sample_size
+        self.reservoir = reservoir
+        self.workers = workers
+
+    def _sample(self, path):
+        try:
+            return sample_warc(self.store, path, self.sample_size, self.reservoir)
+        except Exception as e:
+            logger.exception("Could not sample records from %s" % path)
+            return None
+
+    def _check(self, url, timestamp):
+        try:
+            for cdx in self.cdxs.lookup(url, limit=10, sort='closest', closest=timestamp):
+                if cdx.timestamp == timestamp:
+                    return True
+        except Exception as e:
+            logger.warning("Lookup of %s @ %s failed: %s" % (url, timestamp, e))
+        logger.warning("Record not found in index: %s @ %s" % (url, timestamp))
+        return False
+
+    def verify(self, paths):
+        '''
+        Verify a batch of WARCs.
+
+        :return: a tuple of (list of verified paths, dict of stats)
+        '''
+        stats = { 'total_warcs_i': len(paths), 'total_sampled_records_i': 0, 'total_found_records_i': 0, 'total_failed_warcs_i': 0 }
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # Sample all the WARCs:
+            samples = dict(zip(paths, executor.map(self._sample, paths)))
+            # Look up all the samples:
+            checks = {}
+            for path, sample in samples.items():
+                if sample is not None:
+                    checks[path] = [executor.submit(self._check, url, timestamp) for url, timestamp in sample]
+            verified = []
+            for path in paths:
+                if samples[path] is None:
+                    stats['total_failed_warcs_i'] += 1
+                    continue
+                found = sum(1 for check in checks[path] if check.result())
+                stats['total_sampled_records_i'] += len(checks[path])
+                stats['total_found_records_i'] += found
+                # n.b. WARCs with no indexable records count as verified, as there is nothing to find:
+                if found == len(checks[path]):
+                    verified.append(path)
+                else:
+                    logger.warning("For %s, only %i of %i records checked are in the CDX index!" % (path, found, len(checks[path])))
+                    stats['total_failed_warcs_i'] += 1
+        stats['total_verified_warcs_i'] = len(verified)
+        return verified, stats
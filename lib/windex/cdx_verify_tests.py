@@ -0,0 +1,87 @@
+import io
+import random
+import collections
+from lib.store.local import LocalStore
+from lib.windex.cdx import CDX11
+from lib.windex.cdx_verify import CdxVerifier, sample_warc
+from warcio.warcwriter import WARCWriter
+from warcio.statusandheaders import StatusAndHeaders
+
+
+def write_warc(path, n, prefix='http://example.com/'):
+    with open(path, 'wb') as f:
+        writer = WARCWriter(f, gzip=True)
+        for i in range(n):
+            http_headers = StatusAndHeaders('200 OK', [('Content-Type', 'text/html')], protocol='HTTP/1.1')
+            record = writer.create_warc_record('%s%i' % (prefix, i), 'response', payload=io.BytesIO(b'<html></html>'),
+                http_headers=http_headers, warc_headers_dict={ 'WARC-Date': '2020-01-01T12:00:%02dZ' % (i % 60) })
+            writer.write_record(record)
+            # Other records are skipped:
+            writer.write_record(writer.create_warc_record('%s%i' % (prefix, i), 'metadata', payload=io.BytesIO(b'x')))
+
+
+class FakeCdxIndex(object):
+    '''
+    Knows about the given (url, timestamp) captures, apart from any URLs listed in missing.
+    '''
+
+    def __init__(self, missing=(), failing=()):
+        self.missing = missing
+        self.failing = failing
+
+    def lookup(self, url, limit=10, sort='closest', closest=None):
+        if url in self.failing:
+            raise Exception("Simulated CDX failure")
+        if url in self.missing:
+            return [CDX11('key 20190101000000 %s text/html 200 D - - 10 0 old.warc.gz' % url)]
+        return [CDX11('key %s %s text/html 200 D - - 10 0 test.warc.gz' % (closest, url))]
+
+
+def test_first_records(tmp_path):
+    write_warc(str(tmp_path / 'a.warc.gz'), 20)
+    sample = sample_warc(LocalStore(str(tmp_path)), '/a.warc.gz', sample_size=5)
+    assert sample == [('http://example.com/%i' % i, '202001011200%02d' % i) for i in range(5)]
+
+
+def test_reservoir_sample(tmp_path):
+    write_warc(str(tmp_path / 'a.warc.gz'), 50)
+    store = LocalStore(str(tmp_path))
+    sample = sample_warc(store, '/a.warc.gz', sample_size=5, reservoir=True, rng=random.Random(1))
+    assert len(sample) == 5
+    assert len(set(sample)) == 5
+    # Records from all over the WARC can be picked, with roughly equal chances:
+    picked = collections.Counter()
+    rng = random.Random(2)
+    for i in range(200):
+        picked.update(int(url.rsplit('/', 1)[1]) // 10 for url, timestamp in
+            sample_warc(store, '/a.warc.gz', sample_size=5, reservoir=True, rng=rng))
+    assert sorted(picked.keys()) == [0, 1, 2, 3, 4]
+    assert min(picked.values()) > 100
+
+
+def test_small_warc_sampled_whole(tmp_path):
+    write_warc(str(tmp_path / 'a.warc.gz'), 3)
+    store = LocalStore(str(tmp_path))
+    for reservoir in [False, True]:
+        sample = sample_warc(store, '/a.warc.gz', sample_size=10, reservoir=reservoir)
+        assert [url for url, timestamp in sample] == ['http://example.com/0', 'http://example.com/1', 'http://example.com/2']
+
+
+def test_verify(tmp_path):
+    write_warc(str(tmp_path / 'good.warc.gz'), 5, prefix='http://good/')
+    write_warc(str(tmp_path / 'missing.warc.gz'), 5, prefix='http://missing/')
+    write_warc(str(tmp_path / 'failing.warc.gz'), 5, prefix='http://failing/')
+    write_warc(str(tmp_path / 'empty.warc.gz'), 0)
+    cdxs = FakeCdxIndex(missing=['http://missing/3'], failing=['http://failing/0'])
+    verifier = CdxVerifier(cdxs, LocalStore(str(tmp_path)), sample_size=4, workers=4)
+    paths = ['/good.warc.gz', '/missing.warc.gz', '/failing.warc.gz', '/empty.warc.gz', '/not-there.warc.gz']
+    verified, stats = verifier.verify(paths)
+    # A WARC with no indexable records has nothing to find, so counts as verified:
+    assert verified == ['/good.warc.gz', '/empty.warc.gz']
+    assert stats == {
+        'total_warcs_i': 5,
+        'total_sampled_records_i': 12,
+        'total_found_records_i': 10,
+        'total_failed_warcs_i': 3,
+        'total_verified_warcs_i': 2,
+    }
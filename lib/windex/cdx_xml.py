@@ -1,11 +1,31 @@
 import logging
-import xml.dom.minidom
-from xml.parsers.expat import ExpatError
+import xml.etree.ElementTree as ET
 import urllib.request
 from urllib.parse import quote_plus
 
 logger = logging.getLogger(__name__)
 
+
+def iter_capture_dates(stream):
+    '''
+    Incrementally parses a Wayback XML query response from a file-like object, yielding each capturedate as
+    it is read, so callers can stop as soon as they have what they need.
+
+    Each result is discarded once it has been parsed, so memory use does not grow with the number of results.
+    '''
+    parents = []
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        tag = elem.tag.rsplit('}', 1)[-1]
+        if tag == 'capturedate':
+            yield elem.text
+        elif tag == 'result' and parents:
+            parents[-1].remove(elem)
+
+
 class CdxIndex():
     '''
     This class is used to query our CDX server.
@@ -32,24 +52,21 @@ class CdxIndex():
                 q = "type:urlquery url:" + quote_plus(url) + (" limit:%i offset:%i" % (batch, offset))
                 cdx_query_url = "%s?q=%s" % (self.cdx_server, quote_plus(q))
                 logger.info("Getting %s" % cdx_query_url)
-                f = urllib.request.urlopen(cdx_query_url)
-                content = f.read()
-                f.close()
-                # Grab the capture dates:
-                dom = xml.dom.minidom.parseString(content)
                 new_records = 0
-                for de in dom.getElementsByTagName('capturedate'):
-                    yield de.firstChild.nodeValue
-                    new_records += 1
+                # Grab the capture dates as they arrive (closing the connection if the caller stops early):
+                with urllib.request.urlopen(cdx_query_url) as f:
+                    for capture_date in iter_capture_dates(f):
+                        yield capture_date
+                        new_records += 1
                 # Done?
                 if new_records == 0:
                     next_batch = False
                 else:
                     # Next batch:
                     offset += batch
-            except ExpatError as e:
-                logger.warning("ExpatError on lookup: %s" % str(e))
-                logger.warning("ExpatError: URL was %s" % url)
+            except ET.ParseError as e:
+                logger.warning("ParseError on lookup: %s" % str(e))
+                logger.warning("ParseError: URL was %s" % url)
                 next_batch = False
             except Exception as e:
                 logger.warning("Exception on lookup: %s" % str(e))
@@ -0,0 +1,64 @@
+import io
+from lib.windex.cdx_xml import iter_capture_dates
+
+RESULT = '''
+        <result>
+            <compressedoffset>2563</compressedoffset>
+            <mimetype>application/pdf</mimetype>
+            <file>BL-20160204113809800-00000-33~d39c9051c787~8443.warc.gz</file>
+            <url>https://www.gov.uk/example.pdf</url>
+            <capturedate>%s</capturedate>
+        </result>'''
+
+
+def wayback_xml(dates, namespace=None):
+    xmlns = ' xmlns="%s"' % namespace if namespace else ''
+    return ('''<?xml version="1.0" encoding="UTF-8"?>
+<wayback%s>
+    <request>
+        <startdate>19960101000000</startdate>
+        <type>urlquery</type>
+        <url>uk,gov)/example.pdf</url>
+    </request>
+    <results>%s
+    </results>
+</wayback>''' % (xmlns, ''.join(RESULT % date for date in dates))).encode('utf-8')
+
+
+class CountingStream(io.BytesIO):
+    '''
+    Keeps track of how much has been read.
+    '''
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def test_capture_dates():
+    dates = ['20160204113813', '20170101000000', '20180101000000']
+    assert list(iter_capture_dates(io.BytesIO(wayback_xml(dates)))) == dates
+
+
+def test_namespaced():
+    xml = wayback_xml(['20160204113813'], namespace='http://archive.org/wayback')
+    assert list(iter_capture_dates(io.BytesIO(xml))) == ['20160204113813']
+
+
+def test_no_results():
+    assert list(iter_capture_dates(io.BytesIO(wayback_xml([])))) == []
+    # e.g. an error response from Wayback:
+    xml = b'<wayback><error><title>Resource Not In Archive</title></error></wayback>'
+    assert list(iter_capture_dates(io.BytesIO(xml))) == []
+
+
+def test_stops_early():
+    xml = wayback_xml(['2016%010i' % i for i in range(5000)])
+    stream = CountingStream(xml)
+    dates = iter_capture_dates(stream)
+    assert next(dates) == '20160000000000'
+    # Only the start of the response has been read:
+    assert stream.bytes_read < len(xml) / 10
+    dates.close()
@@ -2,6 +2,7 @@
 This file defines the command-line interface for performing web archive indexing tasks.
 '''
 import os
+import sys
 import json
 import logging
 import subprocess
@@ -11,14 +12,19 @@ import datetime
 import urllib.parse
 
 # For querying TrackDB status:
-from lib.trackdb.solr import SolrTrackDB
 from lib.trackdb.cmd import DEFAULT_TRACKDB
 
-# Specific code relating to index work
-from lib.windex.cdx import CdxIndex
-from lib.windex.trace import follow_redirects
-from lib.windex.mr_cdx_job import run_cdx_index_job
-from lib.windex.mr_solr_job import run_solr_index_job
+# Specific code relating to index work.
+# n.b. these modules only import their heavier dependencies (requests, warcio, mrjob, etc.) when used, 
+# and anything else that needs them is imported by the subcommand that uses it, so the CLI starts up quickly.
+from lib.windex.cdx import CdxIndex, DEFAULT_CONCURRENCY, DEFAULT_PER_HOST
+from lib.windex.cdx_cache import CdxCache, CachedCdxIndex, push_cache_metrics, DEFAULT_CDX_CACHE, DEFAULT_TTL, DEFAULT_NEGATIVE_TTL
+from lib.windex.trace import RedirectTracer, DEFAULT_TRACE_WEBHDFS, DEFAULT_TRACE_WORKERS, DEFAULT_MAX_DEPTH
+from lib.windex.local_cdx import DEFAULT_PROCESSES
+from lib.windex.cdx_verify import CdxVerifier, DEFAULT_SAMPLE_SIZE, DEFAULT_VERIFY_WORKERS
+from lib.windex.cdx_summary import summarise, DEFAULT_TOP
+from lib.windex.cdx_load import CdxLoader, list_inputs, merged_lines, DEFAULT_CHUNK_SIZE, DEFAULT_LOAD_WORKERS, DEFAULT_RETRIES
+from lib.windex.daemon import IndexingDaemon, DEFAULT_MAX_JOBS, DEFAULT_POLL_INTERVAL, DEFAULT_MAX_FAILURES
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s: %(levelname)s - %(name)s - %(message)s')
 
@@ -31,10 +37,44 @@ DEFAULT_CDX_COLLECTION = os.environ.get("CDX_COLLECTION","test-collection")
 # Default SOLR
 DEFAULT_SOLR_ZOOKEEPERS = os.environ.get("SOLR_ZOOKEEPERS", "dev-zk1:2182,dev-zk2:2182,dev-zk3:2182")
 DEFAULT_SOLR_COLLECTION = os.environ.get("SOLR_COLLECTION", "test-collection")
+DEFAULT_SOLR_URL = os.environ.get("SOLR_URL", "http://dev-solr:8983/solr/")
 
 # Other defaults
 DEFAULT_BATCH_SIZE = 100
 
+
+def get_cdx_index(args, cdx_url, **kwargs):
+    '''
+    Set up a CDX client, using the lookup cache if one has been specified.
+    '''
+    if args.cdx_cache:
+        cache = CdxCache(args.cdx_cache, ttl=args.cdx_cache_ttl, negative_ttl=args.cdx_cache_negative_ttl)
+        return CachedCdxIndex(cache, cdx_url, **kwargs)
+    else:
+        return CdxIndex(cdx_url, **kwargs)
+
+
+def get_store(store_uri, webhdfs_url=None):
+    '''
+    Set up a store client for the given store URI, or the default WebHDFS service if there is none.
+    '''
+    if store_uri:
+        from lib.store.base import open_store
+        return open_store(store_uri)
+    from lib.store.webhdfs import WebHDFSStore
+    if webhdfs_url:
+        return WebHDFSStore(webhdfs_url=webhdfs_url)
+    return WebHDFSStore()
+
+
+def get_trackdb(args):
+    '''
+    Set up a client for the TrackDB WARC records.
+    '''
+    from lib.trackdb.solr import SolrTrackDB
+    return SolrTrackDB(args.trackdb_url, kind='warcs',)
+
+
 # MAIN
 def main():
     # Set up a parser:
@@ -64,42 +104,150 @@ def main():
     cdx_parser.add_argument('-C', '--cdx-collection', type=str, 
         help='The CDX Collection to work with.', 
         default=DEFAULT_CDX_COLLECTION)
+    cdx_parser.add_argument('--cdx-cache', type=str,
+        help='A SQLite file to use to cache CDX lookups (defaults to $CDX_CACHE, or no caching).',
+        default=DEFAULT_CDX_CACHE)
+    cdx_parser.add_argument('--cdx-cache-ttl', type=int,
+        help='How long to cache CDX lookups for, in seconds.',
+        default=DEFAULT_TTL)
+    cdx_parser.add_argument('--cdx-cache-negative-ttl', type=int,
+        help='How long to cache CDX lookups that found nothing for, in seconds.',
+        default=DEFAULT_NEGATIVE_TTL)
 
     # Use sub-parsers for different operations:
     subparsers = root_parser.add_subparsers(dest="op")
 
     # Add a parser for the 'query' subcommand:
     parser_cdx = subparsers.add_parser('cdx-query', 
-        help='Look up a URL.', 
+        help='Look up a URL, or a list of URLs.', 
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-        parents=[cdx_parser])
+        parents=[common_parser, cdx_parser])
     parser_cdx.add_argument('-i', '--indent', type=int, help='Number of spaces to indent when emitting JSON.')
-    parser_cdx.add_argument('url', type=str, help='The URL to look up.')
+    parser_cdx.add_argument('-l', '--limit', type=int, help='Maximum number of results per URL.', default=25)
+    parser_cdx.add_argument('-P', '--parallel', type=int, help='Number of concurrent lookups, when reading URLs from STDIN.', default=DEFAULT_CONCURRENCY)
+    parser_cdx.add_argument('-H', '--per-host', type=int, help='Maximum number of concurrent lookups for URLs on the same host.', default=DEFAULT_PER_HOST)
+    parser_cdx.add_argument('url', type=str, help='The URL to look up, or "-" to read URLs from STDIN, one per line, outputting "URL<tab>CDX" lines as lookups complete.')
+
+    # Add a parser for the 'cdx-summary' subcommand:
+    parser_summary = subparsers.add_parser('cdx-summary', 
+        help='Summarise all the captures for a domain, host or URL prefix.', 
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        parents=[common_parser, cdx_parser])
+    parser_summary.add_argument('-m', '--match-type', choices=['domain', 'host', 'prefix', 'exact'], help='How to match the URL.', default='domain')
+    parser_summary.add_argument('-l', '--limit', type=int, help='Maximum number of captures to summarise (defaults to all of them).')
+    parser_summary.add_argument('-n', '--top', type=int, help='Number of the most common MIME types and hosts to list.', default=DEFAULT_TOP)
+    parser_summary.add_argument('-f', '--format', choices=['json', 'csv'], help='Output format.', default='json')
+    parser_summary.add_argument('-i', '--indent', type=int, help='Number of spaces to indent when emitting JSON.')
+    parser_summary.add_argument('url', type=str, help='The domain, host or URL prefix to summarise, e.g. example.co.uk')
 
     # Add a parser for the 'trace' subcommand:
     parser_trace = subparsers.add_parser('trace', 
-        help='Look up a URL, and follow redirects.', 
+        help='Look up URLs, and follow redirects, outputting each redirect chain as JSONL.', 
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        parents=[common_parser, cdx_parser])
+    parser_trace.add_argument('-s', '--store-uri', type=str, help='The store to read WARC records from, as a URI like webhdfs://USER@HOST/ (defaults to $STORE_URI, or WebHDFS at %s).' % DEFAULT_TRACE_WEBHDFS,
+        default=os.environ.get("STORE_URI", None))
+    parser_trace.add_argument('-P', '--parallel', type=int, help='Number of concurrent CDX lookups and WARC fetches.', default=DEFAULT_TRACE_WORKERS)
+    parser_trace.add_argument('-D', '--max-depth', type=int, help='Maximum number of redirects to follow.', default=DEFAULT_MAX_DEPTH)
+    parser_trace.add_argument('input_file', type=str, help='File containing the list of URLs to look up. Can be "-" for STDIN.')
+
+    # Add a parser for the 'cdx-cache' subcommand:
+    parser_cache = subparsers.add_parser('cdx-cache', 
+        help='Manage the CDX lookup cache.', 
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-        parents=[cdx_parser])
-    parser_trace.add_argument('input_file', type=str, help='File containing the list of URLs to look up.')
+        parents=[common_parser, cdx_parser])
+    parser_cache.add_argument('-i', '--indent', type=int, help='Number of spaces to indent when emitting JSON.')
+    parser_cache.add_argument('action', choices=['stats', 'expire', 'invalidate', 'invalidate-misses', 'clear'],
+        help='Show the cache statistics, drop expired entries, drop entries for the given URLs, drop all cached misses, or drop everything.')
+    parser_cache.add_argument('urls', nargs='*', help='The URLs to invalidate. Use "-" to read URLs from STDIN.')
 
     # Add a parser for the 'list' subcommand:
+    # Batch sizing args, shared by both kinds of indexing:
+    index_batch_parser = argparse.ArgumentParser(add_help=False)
+    index_batch_parser.add_argument('-B', '--batch-size', type=int, help='Number files to process in each run (the maximum, when sizing batches by bytes).', default=DEFAULT_BATCH_SIZE)
+    index_batch_parser.add_argument('--batch-bytes', type=str, help='Total size of the files to process in each run, e.g. 2T. This is the starting point when --target-duration is set.')
+    index_batch_parser.add_argument('--target-duration', type=int, help='Aim for jobs that take this long, in seconds, sizing batches by bytes based on the throughput of recent jobs.')
+
+    # CDX indexing args:
+    cdx_index_parser = argparse.ArgumentParser(add_help=False, parents=[index_batch_parser])
+    cdx_index_parser.add_argument('-L', '--local', action='store_true', help='Index the WARCs on this machine rather than running a Hadoop job (best for small batches).')
+    cdx_index_parser.add_argument('-P', '--processes', type=int, help='Number of WARCs to index at once, when indexing locally.', default=DEFAULT_PROCESSES)
+    cdx_index_parser.add_argument('-s', '--store-uri', type=str, help='The store to read WARCs from when indexing locally, as a URI like webhdfs://USER@HOST/ (defaults to $STORE_URI, or the default WebHDFS service).',
+        default=os.environ.get("STORE_URI", None))
+
     parser_index_cdx = subparsers.add_parser('cdx-index', 
         help="Index WARCs into a CDX service.", 
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        parents=[common_parser, trackdb_parser, cdx_parser, cdx_index_parser])
+
+    parser_load_cdx = subparsers.add_parser('cdx-load', 
+        help="Merge sorted CDX files (e.g. Hadoop job output) and load them into a CDX service in bulk.", 
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        parents=[common_parser, cdx_parser])
+    parser_load_cdx.add_argument('-s', '--store-uri', type=str, help='The store to read the CDX files from, as a URI like webhdfs://USER@HOST/ (defaults to $STORE_URI, or local files).',
+        default=os.environ.get("STORE_URI", "file:///"))
+    parser_load_cdx.add_argument('-k', '--checkpoint', type=str, help='File used to record progress, so an interrupted load can be resumed by running the same command again.')
+    parser_load_cdx.add_argument('-L', '--chunk-size', type=int, help='Number of CDX lines to send in each POST.', default=DEFAULT_CHUNK_SIZE)
+    parser_load_cdx.add_argument('-P', '--parallel', type=int, help='Number of POSTs to run at once.', default=DEFAULT_LOAD_WORKERS)
+    parser_load_cdx.add_argument('-R', '--retries', type=int, help='Number of times to try each POST.', default=DEFAULT_RETRIES)
+    parser_load_cdx.add_argument('--skip-bad-lines', action='store_true', help='Ask the CDX service to skip lines it cannot parse, rather than rejecting the whole chunk.')
+    parser_load_cdx.add_argument('-i', '--indent', type=int, help='Number of spaces to indent when emitting JSON.')
+    parser_load_cdx.add_argument('paths', nargs='+', help='The sorted CDX files to load, which can be gzipped. Directories are expanded to the part-* files in them.')
+
+    parser_verify_cdx = subparsers.add_parser('cdx-verify', 
+        help="Verify WARCs have been indexed into a CDX service, by looking up a sample of records from each.", 
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
         parents=[common_parser, trackdb_parser, cdx_parser])
-    parser_index_cdx.add_argument('-B', '--batch-size', type=int, help='Number files to process in each run.', default=DEFAULT_BATCH_SIZE)
+    parser_verify_cdx.add_argument('-B', '--batch-size', type=int, help='Number files to process in each run.', default=DEFAULT_BATCH_SIZE)
+    parser_verify_cdx.add_argument('-N', '--sample-size', type=int, help='Number of records to check from each WARC.', default=DEFAULT_SAMPLE_SIZE)
+    parser_verify_cdx.add_argument('-R', '--reservoir', action='store_true', help='Sample records from across the whole of each WARC, rather than checking the first records (slower, but more thorough).')
+    parser_verify_cdx.add_argument('-P', '--parallel', type=int, help='Number of concurrent WARC reads and CDX lookups.', default=DEFAULT_VERIFY_WORKERS)
+    parser_verify_cdx.add_argument('-s', '--store-uri', type=str, help='The store to read WARCs from, as a URI like webhdfs://USER@HOST/ (defaults to $STORE_URI, or the default WebHDFS service).',
+        default=os.environ.get("STORE_URI", None))
+    parser_verify_cdx.add_argument('-i', '--indent', type=int, help='Number of spaces to indent when emitting JSON.')
+
+    # Solr indexing args:
+    solr_index_parser = argparse.ArgumentParser(add_help=False, parents=[index_batch_parser])
+    solr_index_parser.add_argument('-Z', '--zks', help="Zookeepers to talk to, as comma-separated lost of HOST:PORT", default=DEFAULT_SOLR_ZOOKEEPERS)
+    solr_index_parser.add_argument('-C', '--solr-collection', help="The SolrCloud collection to index into.", default=DEFAULT_SOLR_COLLECTION)
+    solr_index_parser.add_argument('config', help="The indexer configuration file to use.")
+    solr_index_parser.add_argument('annotations', help="The annotations file to use with the indexer.")
+    solr_index_parser.add_argument('oasurts', help="The Open Access SURTS file to use with the indexer.")
 
     parser_index_solr = subparsers.add_parser('solr-index', 
         help="Index WARCs into a Solr service.", 
         formatter_class=argparse.ArgumentDefaultsHelpFormatter, 
+        parents=[common_parser, trackdb_parser, solr_index_parser])
+
+    parser_verify_solr = subparsers.add_parser('solr-verify', 
+        help="Verify WARCs have been indexed into a Solr service.", 
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter, 
         parents=[common_parser, trackdb_parser])
-    parser_index_solr.add_argument('-B', '--batch-size', type=int, help='Number files to process in each run.', default=DEFAULT_BATCH_SIZE)
-    parser_index_solr.add_argument('-Z', '--zks', help="Zookeepers to talk to, as comma-separated lost of HOST:PORT", default=DEFAULT_SOLR_ZOOKEEPERS)
-    parser_index_solr.add_argument('-C', '--solr-collection', help="The SolrCloud collection to index into.", default=DEFAULT_SOLR_COLLECTION)
-    parser_index_solr.add_argument('config', help="The indexer configuration file to use.")
-    parser_index_solr.add_argument('annotations', help="The annotations file to use with the indexer.")
-    parser_index_solr.add_argument('oasurts', help="The Open Access SURTS file to use with the indexer.")
+    parser_verify_solr.add_argument('-B', '--batch-size', type=int, help='Number files to process in each run.', default=DEFAULT_BATCH_SIZE)
+    parser_verify_solr.add_argument('-U', '--solr-url', help="The Solr service to query (the collection name is appended to this).", default=DEFAULT_SOLR_URL)
+    parser_verify_solr.add_argument('-C', '--solr-collection', help="The SolrCloud collection to verify.", default=DEFAULT_SOLR_COLLECTION)
+    parser_verify_solr.add_argument('-i', '--indent', type=int, help='Number of spaces to indent when emitting JSON.')
+
+    # Add a parser for the 'daemon' subcommand, which runs either kind of indexing continuously:
+    daemon_parser = argparse.ArgumentParser(add_help=False)
+    daemon_parser.add_argument('-K', '--max-jobs', type=int, help='Maximum number of indexing jobs to run at once.', default=DEFAULT_MAX_JOBS)
+    daemon_parser.add_argument('--poll-interval', type=int, help='How long to wait before looking again when there are no WARCs to index, in seconds.', default=DEFAULT_POLL_INTERVAL)
+    daemon_parser.add_argument('--state-file', type=str, help='File used to record which WARCs are being indexed, so they are not indexed twice.', default='windex-daemon-in-progress.json')
+    daemon_parser.add_argument('--retry-in-progress', action='store_true', help='Index any WARCs left in progress by a previous run again, rather than skipping them.')
+    daemon_parser.add_argument('--max-failures', type=int, help='Give up on WARCs that have been in this many failed jobs, leaving them marked as in progress.', default=DEFAULT_MAX_FAILURES)
+
+    parser_daemon = subparsers.add_parser('daemon', 
+        help="Keep indexing WARCs, running several batches at once.")
+    daemon_subparsers = parser_daemon.add_subparsers(dest="index_op")
+    daemon_subparsers.required = True
+    daemon_subparsers.add_parser('cdx-index', 
+        help="Keep indexing WARCs into a CDX service.", 
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        parents=[common_parser, trackdb_parser, cdx_parser, cdx_index_parser, daemon_parser])
+    daemon_subparsers.add_parser('solr-index', 
+        help="Keep indexing WARCs into a Solr service.", 
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        parents=[common_parser, trackdb_parser, solr_index_parser, daemon_parser])
 
     # And PARSE:
     args = root_parser.parse_args()
@@ -118,83 +266,130 @@ def main():
     logger.info("Got args: %s" % args)
     if args.op == 'cdx-query':
         # Set up CDX client:
-        cdxs = CdxIndex(cdx_url)
+        cdxs = get_cdx_index(args, cdx_url, pool_size=args.parallel)
         # and query:
-        for result in cdxs.query(args.url):
-            print(result)
+        if args.url == '-':
+            urls = (line.strip() for line in sys.stdin if line.strip())
+            failed = 0
+            for url, results, error in cdxs.bulk_query(urls, limit=args.limit, concurrency=args.parallel, per_host=args.per_host):
+                # (failures are logged by bulk_query)
+                if error:
+                    failed += 1
+                for result in results:
+                    print("%s\t%s" % (url, result), flush=True)
+            if failed > 0:
+                logger.error("%i lookups failed!" % failed)
+                sys.exit(1)
+        else:
+            for result in cdxs.query(args.url, limit=args.limit):
+                print(result)
+
+    elif args.op == 'cdx-summary':
+        # Not using the cache, as the results are streamed rather than kept:
+        summary = summarise(CdxIndex(cdx_url), args.url, match_type=args.match_type, limit=args.limit)
+        if args.format == 'csv':
+            sys.stdout.write(summary.to_csv(args.top))
+        else:
+            print(json.dumps(summary.to_dict(args.top), indent=args.indent))
 
     elif args.op == 'trace':
-        # Set up CDX client:
-        cdxs = CdxIndex(cdx_url)
-        with open(args.input_file) as fin:
-            for line in fin:
-                url = line.strip()
-                for result in follow_redirects(cdxs, url):
-                    print("%s\t%s" % (result,url))
+        # Set up CDX and store clients, shared by all the lookups:
+        cdxs = get_cdx_index(args, cdx_url, pool_size=args.parallel)
+        store = get_store(args.store_uri, DEFAULT_TRACE_WEBHDFS)
+        tracer = RedirectTracer(cdxs, store, workers=args.parallel, max_depth=args.max_depth)
+        fin = sys.stdin if args.input_file == '-' else open(args.input_file)
+        urls = (line.strip() for line in fin if line.strip())
+        for chain in tracer.trace(urls):
+            print(json.dumps(chain), flush=True)
+
+    elif args.op == 'cdx-cache':
+        if not args.cdx_cache:
+            raise Exception("No CDX cache specified! Use --cdx-cache or set $CDX_CACHE.")
+        cache = CdxCache(args.cdx_cache, ttl=args.cdx_cache_ttl, negative_ttl=args.cdx_cache_negative_ttl)
+        if args.action == 'expire':
+            logger.info("Expired %i entries." % cache.expire())
+        elif args.action == 'invalidate':
+            urls = args.urls
+            if urls == ['-']:
+                urls = (line.strip() for line in sys.stdin if line.strip())
+            logger.info("Invalidated %i entries." % cache.invalidate(urls))
+        elif args.action == 'invalidate-misses':
+            logger.info("Invalidated %i entries." % cache.invalidate_all(negative_only=True))
+        elif args.action == 'clear':
+            logger.info("Invalidated %i entries." % cache.invalidate_all())
+        push_cache_metrics(cache)
+        print(json.dumps(cache.stats(), indent=args.indent))
+
+    elif args.op == 'cdx-load':
+        store = get_store(args.store_uri)
+        paths = list_inputs(store, args.paths)
+        logger.info("Loading %i CDX files into %s..." % (len(paths), cdx_url))
+        # Cached lookups of the URLs being loaded are dropped as each chunk goes in:
+        cache = CdxCache(args.cdx_cache) if args.cdx_cache else None
+        loader = CdxLoader(cdx_url, checkpoint_file=args.checkpoint, chunk_size=args.chunk_size, workers=args.parallel, 
+            retries=args.retries, skip_bad_lines=args.skip_bad_lines, cdx_cache=cache)
+        with merged_lines(store, paths) as lines:
+            stats = loader.load(lines)
+        # Cached misses of other forms of query (e.g. prefix queries) may now be out of date too:
+        if cache:
+            cache.invalidate_all(negative_only=True)
+        print(json.dumps(stats, indent=args.indent))
+
+    elif args.op == 'cdx-verify':
+        # Setup TrackDB, CDX and store clients:
+        tdb = get_trackdb(args)
+        cdxs = get_cdx_index(args, cdx_url, pool_size=args.parallel)
+        store = get_store(args.store_uri)
+        # Get a list of items to verify:
+        cdx_field = "cdx_index_ss"
+        unverified = "%s|unverified" % args.cdx_collection
+        items = tdb.list(args.stream, args.year, [cdx_field, '"%s"' % unverified], limit=args.batch_size)
+        if len(items) == 0:
+            logger.warn("No WARCs found to verify!")
+            return
+        # Verify them:
+        verifier = CdxVerifier(cdxs, store, args.sample_size, args.reservoir, args.parallel)
+        ids = dict((item['file_path_s'], item['id']) for item in items)
+        verified, stats = verifier.verify(list(ids.keys()))
+        # And clear the unverified flags, in bulk:
+        if len(verified) > 0:
+            tdb.update([ids[path] for path in verified], cdx_field, unverified, action='remove')
+        print(json.dumps(stats, indent=args.indent))
+
+    elif args.op == 'solr-verify':
+        from lib.windex.solr_verify import verify_solr_index
+        tdb = get_trackdb(args)
+        # Get a list of items to verify:
+        solr_field = "solr_index_ss"
+        unverified = "%s|unverified" % args.solr_collection
+        items = tdb.list(args.stream, args.year, [solr_field, '"%s"' % unverified], limit=args.batch_size)
+        if len(items) == 0:
+            logger.warn("No WARCs found to verify!")
+            return
+        # Check them all with one query:
+        select_url = urllib.parse.urljoin(args.solr_url, "%s/select" % args.solr_collection)
+        ids = dict((item['file_path_s'], item['id']) for item in items)
+        verified, stats = verify_solr_index(select_url, list(ids.keys()))
+        # And clear the unverified flags, in one update:
+        if len(verified) > 0:
+            tdb.update([ids[path] for path in verified], solr_field, unverified, action='remove')
+        print(json.dumps(stats, indent=args.indent))
 
     elif args.op == 'cdx-index' or args.op == 'solr-index':
+        from lib.windex.batch import BatchIndexer
         # Setup TrackDB
-        tdb = SolrTrackDB(args.trackdb_url, kind='warcs',)
-        # Perform indexing job:
-        start_time = datetime.datetime.now()
-        ids = []
-        stats = {}
-        if args.op == 'cdx-index':
-            # Get a list of items to process:
-            cdx_field = "cdx_index_ss"
-            field_value = ["-%s" % cdx_field, "%s*" % args.cdx_collection]
-            items = tdb.list(args.stream, args.year, field_value, limit=args.batch_size)
-            if len(items) > 0:
-                # Run a job to index those items:
-                stats = run_cdx_index_job(items, cdx_url)
-                # If that worked (no exception thrown), update the tracking database accordingly:
-                ids = []
-                for item in items:
-                    ids.append(item['id'])
-                # Mark as indexed, but also as unverified:
-                tdb.update(ids, cdx_field, "%s" % args.cdx_collection)
-                tdb.update(ids, cdx_field, "%s|unverified" % args.cdx_collection)
-                # Add fields to store:
-                stats['cdx_endpoint_s'] = cdx_url
-            else:
-                logger.warn("No WARCs found to process!")
-                return
-        elif args.op == 'solr-index':
-            # Get a list of items to process:
-            solr_field = "solr_index_ss"
-            field_value = ["-%s" % solr_field, "%s*" % args.solr_collection]
-            items = tdb.list(args.stream, args.year, field_value, limit=args.batch_size)
-            if len(items) > 0:
-                # Run a job to index those items:
-                stats = run_solr_index_job(items, args.zks, args.solr_collection, args.config, args.annotations, args.oasurts)
-                # If that worked (no exception thrown), update the tracking database accordingly:
-                for item in items:
-                    ids.append(item['id'])
-                # Mark as indexed, but also as to-be-verified:
-                tdb.update(ids, solr_field, "%s" % args.solr_collection)
-                tdb.update(ids, solr_field, "%s|unverified" % args.solr_collection)
-                # Add fields to store:
-                stats['solr_collection_s'] = args.solr_collection
-            else:
-                logger.warn("No WARCs found to process!")
-
-        # Update event stats item in TrackDB
-        finish_time = datetime.datetime.now()
-        event = {
-            'id': 'task:%s:%s:%s:%s'% (args.op, args.stream, args.year, finish_time.isoformat()),
-            'kind_s': 'task',
-            'batch_size_i': len(ids),
-            'ids_ss' : ids,
-            'stream_s': args.stream,
-            'year_i': args.year,
-            "task_status_s": "success",
-            'started_at_dt': start_time.isoformat(),
-            'finished_at_dt': finish_time.isoformat(),
-            'runtime_secs_i': (finish_time-start_time).total_seconds()
-        }
-        for stat in stats:
-            event[stat] = stats[stat]
-        tdb.import_items([event])
+        tdb = get_trackdb(args)
+        # Perform indexing job, and record the outcome in the TrackDB:
+        indexer = BatchIndexer(tdb, args.op, args, cdx_url=cdx_url if args.op == 'cdx-index' else None)
+        indexer.run_once()
+
+    elif args.op == 'daemon':
+        from lib.windex.batch import BatchIndexer
+        tdb = get_trackdb(args)
+        indexer = BatchIndexer(tdb, args.index_op, args, cdx_url=cdx_url if args.index_op == 'cdx-index' else None)
+        daemon = IndexingDaemon(indexer, args.state_file, max_jobs=args.max_jobs, poll_interval=args.poll_interval, retry_in_progress=args.retry_in_progress,
+            max_failures=args.max_failures)
+        daemon.run()
 
     else:
         raise Exception("Not implemented!")
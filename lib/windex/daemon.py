@@ -0,0 +1,236 @@
+'''
+Runs indexing continuously, keeping a pipeline of batches going rather than one batch per invocation.
+
+- A prefetch thread gets the next batch from the TrackDB while jobs are running.
+- Up to K jobs run at once.
+- TrackDB updates happen on a separate thread, so the next job can start straight away.
+
+The IDs of the WARCs in each batch are recorded in a state file from the moment the batch is
+fetched until its TrackDB update is done, so they are not picked up again, even if the daemon
+is restarted part-way through. On SIGTERM or SIGINT, no new jobs are started, but running jobs
+are allowed to finish and be recorded before the daemon exits.
+
+When a job fails, its job slot is freed straight away, but no new jobs are started for a while, and
+the WARCs are released to be tried again. A WARC that has been in max_failures failed jobs is given up
+on, and left marked as in progress in the state file, so it is skipped until the daemon is restarted
+with retry_in_progress. If recording a batch in the TrackDB fails, its WARCs are left in progress too.
+Both are counted in the stats, which are pushed to Prometheus after each job.
+'''
+import os
+import json
+import time
+import queue
+import signal
+import logging
+import datetime
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from lib.windex.job_stats import push_daemon_metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_JOBS = 2
+DEFAULT_POLL_INTERVAL = 300
+DEFAULT_MAX_FAILURES = 3
+
+
+class IndexingDaemon():
+
+    def __init__(self, indexer, state_file, max_jobs=DEFAULT_MAX_JOBS, poll_interval=DEFAULT_POLL_INTERVAL, retry_in_progress=False,
+                 max_failures=DEFAULT_MAX_FAILURES):
+        '''
+        :param indexer: the BatchIndexer to use
+        :param state_file: JSON file used to persist the set of WARC IDs that are in progress
+        :param max_jobs: the maximum number of jobs to run at once
+        :param poll_interval: how long to wait before checking again when there's nothing to do, or after a job fails, in seconds
+        :param retry_in_progress: release any WARCs left in progress by a previous run, so they get indexed again
+        :param max_failures: how many failed jobs a WARC can be in before it is given up on
+        '''
+        self.indexer = indexer
+        self.state_file = state_file
+        self.max_jobs = max_jobs
+        self.poll_interval = poll_interval
+        self.max_failures = max_failures
+        # Number of failed jobs each WARC has been in, by ID:
+        self.failures = collections.Counter()
+        # No new jobs are started until this time, after a job fails:
+        self.backoff_until = 0
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.in_progress = self._load_state()
+        if self.in_progress:
+            if retry_in_progress:
+                logger.warning("Releasing %i WARCs left in progress by a previous run." % len(self.in_progress))
+                self.in_progress = {}
+                self._save_state()
+            else:
+                logger.warning("%i WARCs were left in progress by a previous run, and will be skipped. See %s" % (len(self.in_progress), self.state_file))
+        # Fetched batches, waiting for a job slot:
+        self.batches = queue.Queue(maxsize=1)
+        # Finished jobs, waiting for the TrackDB to be updated:
+        self.updates = queue.Queue()
+        self.slots = threading.Semaphore(max_jobs)
+        self.stats = { 'batches_i': 0, 'failed_batches_i': 0, 'warcs_i': 0, 'failed_updates_i': 0, 'abandoned_warcs_i': 0 }
+
+    def _load_state(self):
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                return json.load(f)
+        return {}
+
+    def _save_state(self):
+        tmp_path = "%s_temp_" % self.state_file
+        with open(tmp_path, 'w') as f:
+            json.dump(self.in_progress, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.state_file)
+
+    def _claim(self, items):
+        with self.lock:
+            now = datetime.datetime.now().isoformat()
+            for item in items:
+                self.in_progress[item['id']] = now
+            self._save_state()
+
+    def _release(self, items):
+        with self.lock:
+            for item in items:
+                self.in_progress.pop(item['id'], None)
+            self._save_state()
+
+    def _wait(self, secs):
+        # Sleep, but wake up if asked to stop:
+        self.stopping.wait(secs)
+
+    def _prefetch(self):
+        while not self.stopping.is_set():
+            try:
+                with self.lock:
+                    exclude = set(self.in_progress.keys())
+                items = self.indexer.next_batch(exclude)
+            except Exception as e:
+                logger.exception("Failed to get the next batch")
+                self._wait(self.poll_interval)
+                continue
+            if len(items) == 0:
+                logger.info("No WARCs found to process, waiting %i seconds..." % self.poll_interval)
+                self._wait(self.poll_interval)
+                continue
+            self._claim(items)
+            # Block until there's room in the queue (i.e. the next job has started):
+            while not self.stopping.is_set():
+                try:
+                    self.batches.put(items, timeout=1)
+                    items = None
+                    break
+                except queue.Full:
+                    pass
+            if items:
+                self._release(items)
+
+    def _run_job(self, items):
+        start_time = datetime.datetime.now()
+        try:
+            logger.info("Starting job for %i WARCs..." % len(items))
+            stats = self.indexer.run_job(items)
+            self.updates.put((items, stats, start_time, datetime.datetime.now(), None))
+        except Exception as e:
+            logger.exception("Indexing job failed")
+            # Back off, rather than immediately trying the same WARCs again, but without holding on to the job slot:
+            with self.lock:
+                self.backoff_until = time.time() + self.poll_interval
+            self.updates.put((items, {}, start_time, datetime.datetime.now(), e))
+        finally:
+            self.slots.release()
+
+    def _count_failures(self, items):
+        # Returns the items that have now failed too many times to try again:
+        abandoned = []
+        with self.lock:
+            for item in items:
+                self.failures[item['id']] += 1
+                if self.failures[item['id']] >= self.max_failures:
+                    del self.failures[item['id']]
+                    abandoned.append(item)
+        if abandoned:
+            self.stats['abandoned_warcs_i'] += len(abandoned)
+            logger.error("Giving up on %i WARCs after %i failed jobs, leaving them marked as in progress in %s: %s"
+                % (len(abandoned), self.max_failures, self.state_file, ", ".join(item['id'] for item in abandoned)))
+        return abandoned
+
+    def _push_metrics(self):
+        with self.lock:
+            stats = dict(self.stats, in_progress_warcs_i=len(self.in_progress))
+        push_daemon_metrics(self.indexer.op, self.indexer.args.stream, stats)
+
+    def _update(self):
+        while True:
+            job = self.updates.get()
+            if job is None:
+                break
+            items, stats, start_time, finish_time, error = job
+            try:
+                if error is None:
+                    self.indexer.mark_done(items)
+                    self.indexer.record_event(items, stats, start_time, finish_time)
+                    self.stats['batches_i'] += 1
+                    self.stats['warcs_i'] += len(items)
+                    with self.lock:
+                        for item in items:
+                            self.failures.pop(item['id'], None)
+                    release = items
+                else:
+                    self.stats['failed_batches_i'] += 1
+                    abandoned = self._count_failures(items)
+                    release = [item for item in items if item not in abandoned]
+                    self.indexer.record_event(items, { 'error_s': str(error) }, start_time, finish_time, status='failed')
+                # Only release the WARCs once the outcome has been recorded:
+                self._release(release)
+            except Exception as e:
+                # Leave these WARCs marked as in progress, so they are not indexed again:
+                self.stats['failed_updates_i'] += 1
+                logger.exception("Failed to update the TrackDB for %i WARCs, so leaving them marked as in progress in %s" % (len(items), self.state_file))
+            self._push_metrics()
+
+    def stop(self, signum=None, frame=None):
+        logger.warning("Stopping: waiting for running jobs to finish...")
+        self.stopping.set()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        prefetcher = threading.Thread(target=self._prefetch, name='prefetch', daemon=True)
+        updater = threading.Thread(target=self._update, name='update')
+        prefetcher.start()
+        updater.start()
+        with ThreadPoolExecutor(max_workers=self.max_jobs) as executor:
+            while not self.stopping.is_set():
+                # Hold off after a failure:
+                with self.lock:
+                    backoff = self.backoff_until - time.time()
+                if backoff > 0:
+                    self._wait(min(backoff, 1))
+                    continue
+                # Wait for a free job slot, then for a batch to run:
+                if not self.slots.acquire(timeout=1):
+                    continue
+                items = None
+                while items is None and not self.stopping.is_set():
+                    try:
+                        items = self.batches.get(timeout=1)
+                    except queue.Empty:
+                        pass
+                if items is None:
+                    self.slots.release()
+                    break
+                executor.submit(self._run_job, items)
+        # Any running jobs have now finished, so record the results and tidy up:
+        prefetcher.join()
+        try:
+            self._release(self.batches.get_nowait())
+        except queue.Empty:
+            pass
+        self.updates.put(None)
+        updater.join()
+        logger.info("Stopped: %s" % json.dumps(self.stats))
+        return self.stats
@@ -0,0 +1,99 @@
+import json
+import time
+import argparse
+import threading
+from lib.windex.daemon import IndexingDaemon
+
+
+class FakeIndexer(object):
+    '''
+    Hands out batches of the given WARCs, and stops the daemon once until(indexer) is true.
+    '''
+
+    def __init__(self, ids, until, batch_size=2, failing=(), fail_mark_done=False):
+        self.op = 'cdx-index'
+        self.args = argparse.Namespace(stream='frequent')
+        self.ids = ids
+        self.until = until
+        self.batch_size = batch_size
+        self.failing = set(failing)
+        self.fail_mark_done = fail_mark_done
+        self.daemon = None
+        self.lock = threading.Lock()
+        self.done = []
+        self.jobs = []
+        self.events = []
+
+    def next_batch(self, exclude=()):
+        with self.lock:
+            items = [{ 'id': i } for i in self.ids if i not in exclude and i not in self.done][:self.batch_size]
+        if self.until(self):
+            self.daemon.stop()
+        return items
+
+    def run_job(self, items):
+        with self.lock:
+            self.jobs.append([item['id'] for item in items])
+        if self.failing.intersection(item['id'] for item in items):
+            raise Exception("Simulated job failure")
+        return { 'job_secs_f': 1.0 }
+
+    def mark_done(self, items):
+        if self.fail_mark_done:
+            raise Exception("Simulated TrackDB failure")
+        with self.lock:
+            self.done.extend(item['id'] for item in items)
+
+    def record_event(self, items, stats, start_time, finish_time, status='success'):
+        with self.lock:
+            self.events.append(status)
+
+
+def run_daemon(tmp_path, indexer, **kwargs):
+    state_file = str(tmp_path / 'state.json')
+    daemon = IndexingDaemon(indexer, state_file, **kwargs)
+    indexer.daemon = daemon
+    stats = daemon.run()
+    with open(state_file) as f:
+        return stats, json.load(f)
+
+
+def test_indexes_everything(tmp_path):
+    indexer = FakeIndexer(['a', 'b', 'c', 'd', 'e'], until=lambda i: len(i.events) == 3)
+    stats, state = run_daemon(tmp_path, indexer, poll_interval=0.01)
+    assert sorted(indexer.done) == ['a', 'b', 'c', 'd', 'e']
+    assert stats['batches_i'] == 3
+    assert stats['warcs_i'] == 5
+    assert state == {}
+
+
+def test_gives_up_after_repeated_failures(tmp_path):
+    indexer = FakeIndexer(['bad', 'a', 'b'], until=lambda i: len(i.events) == 5, batch_size=1, failing=['bad'])
+    stats, state = run_daemon(tmp_path, indexer, poll_interval=0.01, max_failures=3)
+    assert indexer.jobs.count(['bad']) == 3
+    assert sorted(indexer.done) == ['a', 'b']
+    assert stats['failed_batches_i'] == 3
+    assert stats['abandoned_warcs_i'] == 1
+    assert indexer.events.count('failed') == 3
+    # The WARC is left marked as in progress, so it is skipped from now on:
+    assert list(state.keys()) == ['bad']
+
+
+def test_failed_job_frees_its_slot_before_backing_off(tmp_path):
+    indexer = FakeIndexer(['bad'], until=lambda i: True, failing=['bad'])
+    daemon = IndexingDaemon(indexer, str(tmp_path / 'state.json'), max_jobs=1, poll_interval=60)
+    daemon.slots.acquire()
+    start = time.time()
+    daemon._run_job([{ 'id': 'bad' }])
+    assert time.time() - start < 5
+    assert daemon.slots.acquire(blocking=False)
+    # New jobs are held off instead:
+    assert daemon.backoff_until > time.time() + 50
+
+
+def test_failed_updates_leave_warcs_in_progress(tmp_path):
+    indexer = FakeIndexer(['a', 'b'], until=lambda i: i.daemon.stats['failed_updates_i'] > 0, fail_mark_done=True)
+    stats, state = run_daemon(tmp_path, indexer, poll_interval=0.01)
+    assert indexer.jobs == [['a', 'b']]
+    assert stats['failed_updates_i'] == 1
+    assert sorted(state.keys()) == ['a', 'b']
@@ -0,0 +1,115 @@
+'''
+Telemetry for indexing jobs: summarising Hadoop job counters, working out throughput, and pushing
+the results to Prometheus (via the Push Gateway at $PUSH_GATEWAY, if set).
+'''
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Stats that are pushed to Prometheus, as (stat, metric name, description):
+JOB_METRICS = [
+    ('job_secs_f', 'ukwa_windex_job_duration_seconds', 'Wall-clock run time of the most recent indexing job.'),
+    ('records_per_sec_f', 'ukwa_windex_job_records_per_second', 'Records indexed per second by the most recent indexing job.'),
+    ('bytes_per_sec_f', 'ukwa_windex_job_bytes_per_second', 'WARC bytes indexed per second by the most recent indexing job.'),
+    ('batch_bytes_l', 'ukwa_windex_job_input_bytes', 'Total size of the WARCs in the most recent indexing job.'),
+    ('batch_size_i', 'ukwa_windex_job_input_files', 'Number of WARCs in the most recent indexing job.'),
+    ('map_task_time_secs_f', 'ukwa_windex_job_map_task_time_seconds',
+        'Run time of all the map tasks of the most recent indexing job, added up (not the wall-clock length of the map phase).'),
+    ('reduce_task_time_secs_f', 'ukwa_windex_job_reduce_task_time_seconds',
+        'Run time of all the reduce tasks of the most recent indexing job, added up (not the wall-clock length of the reduce phase).'),
+    ('failed_tasks_i', 'ukwa_windex_job_failed_tasks', 'Number of failed task attempts in the most recent indexing job.'),
+    ('killed_tasks_i', 'ukwa_windex_job_killed_tasks', 'Number of killed (e.g. speculative or pre-empted) task attempts in the most recent indexing job.'),
+]
+
+
+def counter_stats(counters):
+    '''
+    Summarise the Hadoop counters from mrjob's runner.counters() (a list with a dict of counter groups for each step).
+
+    The counters only record the total time spent in each kind of task, summed over all the tasks, so that is
+    what is reported, rather than how long each phase of the job took.
+    '''
+    totals = {}
+    for step in counters or []:
+        for group in step.values():
+            for name, value in group.items():
+                totals[name] = totals.get(name, 0) + value
+    stats = {
+        'hdfs_bytes_read_l': totals.get('HDFS: Number of bytes read', 0),
+        'map_task_time_secs_f': totals.get('Total time spent by all map tasks (ms)', 0) / 1000.0,
+        'reduce_task_time_secs_f': totals.get('Total time spent by all reduce tasks (ms)', 0) / 1000.0,
+        'launched_map_tasks_i': totals.get('Launched map tasks', 0),
+        'launched_reduce_tasks_i': totals.get('Launched reduce tasks', 0),
+        'failed_map_tasks_i': totals.get('Failed map tasks', 0),
+        'failed_reduce_tasks_i': totals.get('Failed reduce tasks', 0),
+        'killed_map_tasks_i': totals.get('Killed map tasks', 0),
+        'killed_reduce_tasks_i': totals.get('Killed reduce tasks', 0),
+    }
+    stats['failed_tasks_i'] = stats['failed_map_tasks_i'] + stats['failed_reduce_tasks_i']
+    stats['killed_tasks_i'] = stats['killed_map_tasks_i'] + stats['killed_reduce_tasks_i']
+    return stats
+
+
+def throughput_stats(records, num_bytes, secs):
+    '''
+    Work out the throughput of a job that indexed the given number of records and bytes in the given time.
+    '''
+    stats = { 'job_secs_f': secs }
+    if secs > 0:
+        stats['records_per_sec_f'] = records / secs
+        stats['bytes_per_sec_f'] = num_bytes / secs
+    return stats
+
+
+def push_job_metrics(op, stream, event):
+    '''
+    Push the telemetry from a task event to Prometheus, labelled by operation and stream.
+    '''
+    if not os.environ.get("PUSH_GATEWAY"):
+        logger.debug("No metrics gateway configured, so not pushing job metrics.")
+        return
+    from prometheus_client import CollectorRegistry, Gauge, push_to_gateway
+    registry = CollectorRegistry()
+    g = Gauge('ukwa_windex_job_event_timestamp',
+              'Timestamp of the most recent indexing job, labelled by status.',
+              labelnames=['status'], registry=registry)
+    g.labels(status=event.get('task_status_s', 'unknown')).set_to_current_time()
+    for stat, name, description in JOB_METRICS:
+        if stat in event:
+            Gauge(name, description, registry=registry).set(event[stat])
+    try:
+        push_to_gateway(os.environ.get("PUSH_GATEWAY"), job='windex', registry=registry,
+            grouping_key={ 'task': op, 'stream': stream or 'all' })
+    except Exception as e:
+        # Don't let monitoring problems hold up indexing:
+        logger.warning("Could not push job metrics: %s" % e)
+
+
+# Daemon stats that are pushed to Prometheus, as (stat, metric name, description):
+DAEMON_METRICS = [
+    ('batches_i', 'ukwa_windex_daemon_batches', 'Number of batches indexed since the daemon started.'),
+    ('failed_batches_i', 'ukwa_windex_daemon_failed_batches', 'Number of indexing jobs that failed since the daemon started.'),
+    ('failed_updates_i', 'ukwa_windex_daemon_failed_updates', 'Number of batches the daemon could not record in the TrackDB, leaving their WARCs stuck in progress.'),
+    ('abandoned_warcs_i', 'ukwa_windex_daemon_abandoned_warcs', 'Number of WARCs the daemon has given up on after repeated failures.'),
+    ('in_progress_warcs_i', 'ukwa_windex_daemon_in_progress_warcs', 'Number of WARCs recorded as in progress in the daemon state file.'),
+]
+
+
+def push_daemon_metrics(op, stream, stats):
+    '''
+    Push the running totals from an indexing daemon to Prometheus, labelled by operation and stream.
+    '''
+    if not os.environ.get("PUSH_GATEWAY"):
+        return
+    from prometheus_client import CollectorRegistry, Gauge, push_to_gateway
+    registry = CollectorRegistry()
+    for stat, name, description in DAEMON_METRICS:
+        if stat in stats:
+            Gauge(name, description, registry=registry).set(stats[stat])
+    try:
+        push_to_gateway(os.environ.get("PUSH_GATEWAY"), job='windex-daemon', registry=registry,
+            grouping_key={ 'task': op, 'stream': stream or 'all' })
+    except Exception as e:
+        # Don't let monitoring problems hold up indexing:
+        logger.warning("Could not push daemon metrics: %s" % e)
@@ -0,0 +1,69 @@
+from lib.windex.job_stats import counter_stats, throughput_stats, push_job_metrics
+
+
+def test_counter_stats():
+    # As from runner.counters(), with two steps:
+    counters = [
+        {
+            'File System Counters': { 'HDFS: Number of bytes read': 1000 },
+            'Job Counters': {
+                'Total time spent by all map tasks (ms)': 120000,
+                'Total time spent by all reduce tasks (ms)': 30500,
+                'Launched map tasks': 12,
+                'Launched reduce tasks': 2,
+                'Failed map tasks': 1,
+                'Killed map tasks': 2,
+            },
+        },
+        {
+            'File System Counters': { 'HDFS: Number of bytes read': 500 },
+            'Job Counters': { 'Total time spent by all map tasks (ms)': 6000, 'Failed reduce tasks': 3, 'Killed reduce tasks': 1 },
+        },
+    ]
+    assert counter_stats(counters) == {
+        'hdfs_bytes_read_l': 1500,
+        'map_task_time_secs_f': 126.0,
+        'reduce_task_time_secs_f': 30.5,
+        'launched_map_tasks_i': 12,
+        'launched_reduce_tasks_i': 2,
+        'failed_map_tasks_i': 1,
+        'failed_reduce_tasks_i': 3,
+        'killed_map_tasks_i': 2,
+        'killed_reduce_tasks_i': 1,
+        'failed_tasks_i': 4,
+        'killed_tasks_i': 3,
+    }
+
+
+def test_counter_stats_without_counters():
+    stats = counter_stats(None)
+    assert stats['map_task_time_secs_f'] == 0
+    assert stats['failed_tasks_i'] == 0
+
+
+def test_throughput_stats():
+    assert throughput_stats(1000, 4096, 8.0) == { 'job_secs_f': 8.0, 'records_per_sec_f': 125.0, 'bytes_per_sec_f': 512.0 }
+    # A job that took no measurable time has no throughput:
+    assert throughput_stats(1000, 4096, 0) == { 'job_secs_f': 0 }
+
+
+def test_push_job_metrics(monkeypatch):
+    pushed = []
+
+    def push_to_gateway(gateway, job=None, registry=None, grouping_key=None):
+        pushed.append((gateway, job, grouping_key, registry))
+    import prometheus_client
+    monkeypatch.setattr(prometheus_client, 'push_to_gateway', push_to_gateway)
+
+    # Nothing is pushed if there is no gateway:
+    monkeypatch.delenv('PUSH_GATEWAY', raising=False)
+    push_job_metrics('cdx-index', 'frequent', { 'job_secs_f': 10 })
+    assert pushed == []
+
+    monkeypatch.setenv('PUSH_GATEWAY', 'pushgateway:9091')
+    push_job_metrics('cdx-index', None, { 'task_status_s': 'success', 'job_secs_f': 10, 'map_task_time_secs_f': 100.0 })
+    gateway, job, grouping_key, registry = pushed[0]
+    assert (gateway, job, grouping_key) == ('pushgateway:9091', 'windex', { 'task': 'cdx-index', 'stream': 'all' })
+    assert registry.get_sample_value('ukwa_windex_job_duration_seconds') == 10
+    assert registry.get_sample_value('ukwa_windex_job_map_task_time_seconds') == 100.0
+    assert registry.get_sample_value('ukwa_windex_job_reduce_task_time_seconds') is None
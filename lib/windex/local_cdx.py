@@ -0,0 +1,166 @@
+'''
+Indexes WARCs into a CDX service without using Hadoop, for small batches where the job start-up time dominates.
+
+WARCs are read from the store and indexed by a pool of worker processes, generating the same
+'CDX N b a m s k r M S V g' fields as the Hadoop indexer. Each worker sorts the lines for its WARC and writes
+them to a temporary file, and these sorted runs are then merged and POSTed to the CDX service in bulk (with
+retries, as for `cdx-load`), so only one WARC's worth of lines per worker is ever held in memory.
+'''
+import os
+import re
+import json
+import heapq
+import shutil
+import logging
+import tempfile
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROCESSES = 4
+
+# Number of CDX lines to send in each POST:
+DEFAULT_POST_SIZE = 10000
+
+# Maximum number of sorted runs to merge at once, to stay well within open file limits:
+MAX_MERGE_FILES = 256
+
+# Record types to index:
+INDEXED_RECORD_TYPES = ['response', 'revisit', 'resource']
+
+
+def _field(value):
+    # CDX fields cannot contain spaces or be empty:
+    if value is None or value == '':
+        return '-'
+    return re.sub(r'\s', '%20', str(value))
+
+
+def record_to_cdx(record, offset, length, filename):
+    '''
+    Generate a CDX line for a WARC record, in 'N b a m s k r M S V g' format.
+    '''
+    import surt
+    url = record.rec_headers.get_header('WARC-Target-URI')
+    timestamp = re.sub('[^0-9]', '', record.rec_headers.get_header('WARC-Date'))[:14]
+    status = '-'
+    redirect = '-'
+    if record.rec_type == 'revisit':
+        mimetype = 'warc/revisit'
+    elif record.http_headers:
+        mimetype = record.http_headers.get_header('Content-Type', '-')
+    else:
+        mimetype = record.rec_headers.get_header('Content-Type', '-')
+    mimetype = mimetype.split(';')[0].strip().lower()
+    if record.http_headers:
+        status = record.http_headers.get_statuscode() or '-'
+        redirect = record.http_headers.get_header('Location', '-')
+    digest = record.rec_headers.get_header('WARC-Payload-Digest', '-')
+    if digest.startswith('sha1:'):
+        digest = digest[5:]
+    try:
+        urlkey = surt.surt(url)
+    except Exception as e:
+        logger.warning("Could not SURT %s: %s" % (url, e))
+        urlkey = url
+    return ' '.join(_field(f) for f in [urlkey, timestamp, url, mimetype, status, digest, redirect, '-', length, offset, filename])
+
+
+def index_warc(path, store=None):
+    '''
+    Read a WARC from the store and return the list of CDX lines for it.
+    '''
+    # Imported here, so command-line tools that only need the defaults above start up quickly:
+    from warcio.archiveiterator import ArchiveIterator
+    from lib.store.webhdfs import WebHDFSStore
+    if store is None:
+        store = WebHDFSStore()
+    lines = []
+    with store.stream(path) as stream:
+        it = ArchiveIterator(stream)
+        for record in it:
+            if record.rec_type in INDEXED_RECORD_TYPES:
+                # Need to read the record through to know the length:
+                it.read_to_end()
+                lines.append(record_to_cdx(record, it.get_record_offset(), it.get_record_length(), path))
+    logger.info("Generated %i CDX lines for %s" % (len(lines), path))
+    return lines
+
+
+def _write_run(lines, tmp_dir):
+    fd, run_path = tempfile.mkstemp(prefix='local-cdx-', suffix='.cdx', dir=tmp_dir)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(line)
+            f.write("\n")
+    return run_path
+
+
+def _read_run(run_path):
+    with open(run_path, encoding='utf-8') as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+
+def _merge_runs(run_paths, tmp_dir):
+    '''
+    Merges sorted runs down to at most MAX_MERGE_FILES, writing intermediate runs as needed.
+    '''
+    while len(run_paths) > MAX_MERGE_FILES:
+        merged_paths = []
+        for i in range(0, len(run_paths), MAX_MERGE_FILES):
+            group = run_paths[i:i + MAX_MERGE_FILES]
+            merged_paths.append(_write_run(heapq.merge(*[_read_run(p) for p in group]), tmp_dir))
+            for p in group:
+                os.remove(p)
+        run_paths = merged_paths
+    return run_paths
+
+
+def _index_warc_worker(args):
+    from lib.store.base import open_store
+    path, store_uri, tmp_dir = args
+    store = open_store(store_uri) if store_uri else None
+    # Only one WARC's worth of lines is sorted in memory, and then written out as a sorted run:
+    lines = index_warc(path, store)
+    lines.sort()
+    return path, _write_run(lines, tmp_dir), len(lines)
+
+
+def run_local_cdx_index_job(items, cdx_endpoint, store_uri=None, processes=DEFAULT_PROCESSES, post_size=DEFAULT_POST_SIZE, tmp_dir=None,
+        cdx_cache=None):
+    '''
+    Index the given TrackDB items into the CDX service, returning stats like run_cdx_index_job does.
+
+    If a CdxCache is given, cached lookups of the URLs that were indexed are dropped as they go in.
+    '''
+    # Imported here, so command-line tools that only need the defaults above start up quickly:
+    from lib.windex.cdx_load import CdxLoader
+    paths = [item['file_path_s'] for item in items]
+    stats = { 'total_warcs_i': 0, 'total_records_i': 0 }
+    run_dir = tempfile.mkdtemp(prefix='local-cdx-', dir=tmp_dir)
+    try:
+        run_paths = []
+        # Start the workers afresh rather than forking, as this may be called from a thread (e.g. by the daemon),
+        # and a forked child can deadlock on locks other threads held at the time:
+        with multiprocessing.get_context('spawn').Pool(processes) as pool:
+            for path, run_path, count in pool.imap_unordered(_index_warc_worker, [(path, store_uri, run_dir) for path in paths]):
+                run_paths.append(run_path)
+                stats['total_warcs_i'] += 1
+                stats['total_records_i'] += count
+
+        # Merge the sorted runs, and send the lines in order, using the bulk loader's retrying POSTs:
+        run_paths = _merge_runs(run_paths, run_dir)
+        loader = CdxLoader(cdx_endpoint, chunk_size=post_size, cdx_cache=cdx_cache)
+        load_stats = loader.load(heapq.merge(*[_read_run(p) for p in run_paths]))
+        stats['total_post_requests_i'] = load_stats['total_post_requests_i']
+        stats['total_post_retries_i'] = load_stats['total_retries_i']
+        stats['total_sent_records_i'] = load_stats['total_sent_lines_i']
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    # Raise an exception if the output looks wrong, as for the Hadoop job:
+    if stats['total_sent_records_i'] == 0:
+        raise Exception("CDX job stats has total_sent_records_i == 0! \n%s" % json.dumps(stats))
+
+    return stats
@@ -0,0 +1,70 @@
+import io
+import os
+import threading
+import http.server
+import lib.windex.local_cdx as local_cdx
+from lib.windex.local_cdx import run_local_cdx_index_job
+from lib.windex.cdx_cache import CdxCache
+from warcio.warcwriter import WARCWriter
+from warcio.statusandheaders import StatusAndHeaders
+
+
+def write_warc(path, urls):
+    with open(path, 'wb') as f:
+        writer = WARCWriter(f, gzip=True)
+        for url in urls:
+            http_headers = StatusAndHeaders('200 OK', [('Content-Type', 'text/html; charset=utf-8')], protocol='HTTP/1.1')
+            record = writer.create_warc_record(url, 'response', payload=io.BytesIO(b'<html></html>'),
+                http_headers=http_headers, warc_headers_dict={ 'WARC-Date': '2020-01-01T12:00:00Z' })
+            writer.write_record(record)
+
+
+class CdxHandler(http.server.BaseHTTPRequestHandler):
+    posts = []
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        CdxHandler.posts.append(data.decode('utf-8').split('\n'))
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_index_and_post(tmp_path, tmp_path_factory, monkeypatch):
+    # Force the sorted runs to be merged in more than one pass:
+    monkeypatch.setattr(local_cdx, 'MAX_MERGE_FILES', 2)
+    items = []
+    for i, urls in enumerate([['http://c.com/', 'http://a.com/'], ['http://b.com/'], ['http://d.com/', 'http://a.com/x']]):
+        path = str(tmp_path / ('test-%i.warc.gz' % i))
+        write_warc(path, urls)
+        items.append({ 'file_path_s': path })
+
+    # Cached lookups of URLs that get indexed are dropped, but others are kept:
+    cache = CdxCache(str(tmp_path_factory.mktemp('cache') / 'cache.db'))
+    cache.put('http://a.com/x', { 'limit': 25 }, ['com,a)/x 20190101000000 http://a.com/x'])
+    cache.put('http://b.com/', { 'limit': 25 }, [])
+    cache.put('http://e.com/', { 'limit': 25 }, [])
+
+    server = http.server.HTTPServer(('127.0.0.1', 0), CdxHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        stats = run_local_cdx_index_job(items, 'http://127.0.0.1:%i/test' % server.server_port, store_uri='file:///',
+            processes=2, post_size=2, tmp_dir=str(tmp_path), cdx_cache=cache)
+    finally:
+        server.shutdown()
+
+    assert stats['total_warcs_i'] == 3
+    assert stats['total_records_i'] == 5
+    assert stats['total_sent_records_i'] == 5
+    assert stats['total_post_requests_i'] == 3
+    # The POSTs are sent in parallel, but each chunk is in order, and the chunks follow on from each other:
+    lines = [line for post in sorted(CdxHandler.posts) for line in post]
+    assert [line.split(' ')[0] for line in lines] == ['com,a)/', 'com,a)/x', 'com,b)/', 'com,c)/', 'com,d)/']
+    assert lines[0].split(' ')[3:5] == ['text/html', '200']
+    assert cache.get('http://a.com/x', { 'limit': 25 }) is None
+    assert cache.get('http://b.com/', { 'limit': 25 }) is None
+    assert cache.get('http://e.com/', { 'limit': 25 }) == []
+    # The temporary runs are cleaned up:
+    assert sorted(os.listdir(str(tmp_path))) == ['test-0.warc.gz', 'test-1.warc.gz', 'test-2.warc.gz']
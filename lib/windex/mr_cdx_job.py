@@ -1,8 +1,10 @@
 import json
+import time
 import tempfile
 from mrjob.job import MRJob
 from mrjob.step import JarStep, INPUT, OUTPUT, GENERIC_ARGS
 from mrjob.protocol import TextProtocol
+from lib.windex.job_stats import counter_stats
 
 def run_cdx_index_job(items, cdx_endpoint):
     with tempfile.NamedTemporaryFile('w+') as fpaths:
@@ -22,7 +24,9 @@ def run_cdx_index_job(items, cdx_endpoint):
         # Run and gather output:
         stats = {}
         with mr_job.make_runner() as runner:
+            start = time.time()
             runner.run()
+            elapsed = time.time() - start
             for key, value in mr_job.parse_output(runner.cat_output()):
                 # Normalise key if needed:
                 key = key.lower()
@@ -31,6 +35,9 @@ def run_cdx_index_job(items, cdx_endpoint):
                 # Update counter for the stat:
                 i = stats.get(key, 0)
                 stats[key] = i + int(value)
+            # Add the job telemetry:
+            stats.update(counter_stats(runner.counters()))
+            stats['job_secs_f'] = elapsed
 
         # Raise an exception if the output looks wrong:
         if not "total_sent_records_i" in stats:
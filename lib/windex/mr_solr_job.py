@@ -1,9 +1,11 @@
 import os
+import time
 import json
 import tempfile
 from mrjob.job import MRJob
 from mrjob.step import JarStep, INPUT, OUTPUT, GENERIC_ARGS
 from mrjob.protocol import TextProtocol
+from lib.windex.job_stats import counter_stats
 
 def run_solr_index_job(items, zks, collection, config, annotations, oa_surts):
     with tempfile.NamedTemporaryFile('w+') as fpaths:
@@ -28,7 +30,9 @@ def run_solr_index_job(items, zks, collection, config, annotations, oa_surts):
         # Run and gather output:
         stats = {}
         with mr_job.make_runner() as runner:
+            start = time.time()
             runner.run()
+            elapsed = time.time() - start
             for key, value in mr_job.parse_output(runner.cat_output()):
                 # Normalise key if needed:
                 key = key.lower()
@@ -37,6 +41,9 @@ def run_solr_index_job(items, zks, collection, config, annotations, oa_surts):
                 # Update counter for the stat:
                 i = stats.get(key, 0)
                 stats[key] = i + int(value)
+            # Add the job telemetry:
+            stats.update(counter_stats(runner.counters()))
+            stats['job_secs_f'] = elapsed
         
         # Print stats:
         for k in stats:
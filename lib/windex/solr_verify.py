@@ -0,0 +1,75 @@
+'''
+Verifies that WARCs have been indexed into Solr, checking a whole batch with a single facet query.
+'''
+import os
+import logging
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+def count_records_by_source_file(select_url, filenames):
+    '''
+    Count how many Solr records there are for each of the given WARC filenames, using one facet query.
+
+    :return: dict of filename to record count (filenames with no records are included, with a count of 0)
+    '''
+    counts = dict((filename, 0) for filename in filenames)
+    if len(counts) == 0:
+        return counts
+    params = {
+        'q': '*:*',
+        # The terms query parser avoids the boolean clause limit, and is cached as a filter:
+        'fq': '{!terms f=source_file}%s' % ','.join(counts.keys()),
+        'rows': 0,
+        'facet': 'true',
+        'facet.field': 'source_file',
+        'facet.limit': -1,
+        'facet.mincount': 1,
+        'wt': 'json',
+        'json.nl': 'map'
+    }
+    # POST, as the list of filenames can be long:
+    logger.info("Querying %s for %i source files..." % (select_url, len(counts)))
+    r = requests.post(select_url, data=params)
+    if r.status_code != 200:
+        raise Exception("Solr returned an error! HTTP %i\n%s" %(r.status_code, r.text))
+    for filename, count in r.json()['facet_counts']['facet_fields']['source_file'].items():
+        if filename in counts:
+            counts[filename] = count
+    return counts
+
+
+def verify_solr_index(select_url, paths):
+    '''
+    Check which of the given WARC paths have records in Solr.
+
+    Solr only records the filename of each WARC, so WARCs that share a filename (e.g. from different crawl jobs)
+    cannot be told apart. These all count as verified if there are records for the filename, and are counted in
+    total_shared_name_warcs_i.
+
+    :return: a tuple of (list of verified paths, dict of stats)
+    '''
+    by_name = {}
+    for path in paths:
+        by_name.setdefault(os.path.basename(path), []).append(path)
+    counts = count_records_by_source_file(select_url, list(by_name.keys()))
+    verified = []
+    shared = 0
+    for filename, count in counts.items():
+        if len(by_name[filename]) > 1:
+            logger.warning("%i WARCs share the filename %s, so their records cannot be told apart: %s" % (len(by_name[filename]), filename, by_name[filename]))
+            shared += len(by_name[filename])
+        if count > 0:
+            logger.info("%s records found for %s" % (count, filename))
+            verified.extend(by_name[filename])
+        else:
+            logger.warning("No records found in Solr for %s" % filename)
+    stats = {
+        'total_warcs_i': len(paths),
+        'total_verified_warcs_i': len(verified),
+        'total_missing_warcs_i': len(paths) - len(verified),
+        'total_shared_name_warcs_i': shared,
+        'total_solr_records_i': sum(counts.values())
+    }
+    return verified, stats
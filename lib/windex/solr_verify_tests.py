@@ -0,0 +1,73 @@
+import pytest
+import lib.windex.solr_verify as solr_verify
+from lib.windex.solr_verify import count_records_by_source_file, verify_solr_index
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, facets=None):
+        self.status_code = status_code
+        self.facets = facets or {}
+        self.text = 'status %i' % status_code
+
+    def json(self):
+        return { 'response': { 'numFound': sum(self.facets.values()) },
+            'facet_counts': { 'facet_fields': { 'source_file': self.facets } } }
+
+
+@pytest.fixture
+def solr(monkeypatch):
+    '''
+    Answers facet queries from the record counts in solr.records, recording the queries made.
+    '''
+    class Solr(object):
+        records = {}
+        queries = []
+        status_code = 200
+
+    def post(url, data=None):
+        Solr.queries.append((url, data))
+        names = data['fq'][len('{!terms f=source_file}'):].split(',')
+        return FakeResponse(Solr.status_code, dict((name, Solr.records[name]) for name in names if Solr.records.get(name)))
+    monkeypatch.setattr(solr_verify.requests, 'post', post)
+    return Solr
+
+
+def test_counts_from_one_query(solr):
+    solr.records = { 'a.warc.gz': 10, 'c.warc.gz': 2, 'other.warc.gz': 5 }
+    counts = count_records_by_source_file('http://solr/c/select', ['a.warc.gz', 'b.warc.gz', 'c.warc.gz'])
+    assert counts == { 'a.warc.gz': 10, 'b.warc.gz': 0, 'c.warc.gz': 2 }
+    assert len(solr.queries) == 1
+    assert solr.queries[0][1]['facet.field'] == 'source_file'
+
+
+def test_no_files_no_query(solr):
+    assert count_records_by_source_file('http://solr/c/select', []) == {}
+    assert solr.queries == []
+
+
+def test_errors_raised(solr):
+    solr.status_code = 500
+    with pytest.raises(Exception, match='HTTP 500'):
+        count_records_by_source_file('http://solr/c/select', ['a.warc.gz'])
+
+
+def test_verify(solr):
+    solr.records = { 'a.warc.gz': 10, 'c.warc.gz': 2 }
+    verified, stats = verify_solr_index('http://solr/c/select', ['/heritrix/output/a.warc.gz', '/heritrix/output/b.warc.gz', '/dls/c.warc.gz'])
+    assert sorted(verified) == ['/dls/c.warc.gz', '/heritrix/output/a.warc.gz']
+    assert stats == { 'total_warcs_i': 3, 'total_verified_warcs_i': 2, 'total_missing_warcs_i': 1,
+        'total_shared_name_warcs_i': 0, 'total_solr_records_i': 12 }
+
+
+def test_verify_shared_filenames(solr):
+    # The same filename from two crawl jobs, once with records and once without:
+    solr.records = { 'a.warc.gz': 10 }
+    paths = ['/frequent/1/a.warc.gz', '/daily/2/a.warc.gz', '/frequent/1/b.warc.gz', '/daily/2/b.warc.gz', '/c.warc.gz']
+    verified, stats = verify_solr_index('http://solr/c/select', paths)
+    assert sorted(verified) == ['/daily/2/a.warc.gz', '/frequent/1/a.warc.gz']
+    assert stats['total_verified_warcs_i'] == 2
+    assert stats['total_missing_warcs_i'] == 3
+    assert stats['total_shared_name_warcs_i'] == 4
+    # Each filename is only asked about once:
+    assert sorted(solr.queries[0][1]['fq'].split('}')[1].split(',')) == ['a.warc.gz', 'b.warc.gz', 'c.warc.gz']
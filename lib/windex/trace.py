@@ -1,32 +1,144 @@
+import time
 import logging
+import threading
 import urllib.parse
-from lib.store.webhdfs import WebHDFSStore
-from warcio.archiveiterator import ArchiveIterator
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 logger = logging.getLogger(__name__)
 
-def follow_redirects(cdxs, url, urls=None):
+DEFAULT_TRACE_WEBHDFS = "http://hdfs.bapi.wa.bl.uk/"
+DEFAULT_TRACE_WORKERS = 8
+DEFAULT_MAX_DEPTH = 10
+
+
+class RedirectTracer():
+    '''
+    Traces redirect chains through the archive, breadth-first.
+
+    Each hop needs a CDX lookup and a WARC record fetch, so hops are resolved on a pool of workers,
+    and the result for each URL is remembered, so URLs shared by many chains are only looked up once.
+    '''
+
+    def __init__(self, cdxs, store=None, workers=DEFAULT_TRACE_WORKERS, max_depth=DEFAULT_MAX_DEPTH):
+        self.cdxs = cdxs
+        if store is None:
+            from lib.store.webhdfs import WebHDFSStore
+            store = WebHDFSStore(webhdfs_url=DEFAULT_TRACE_WEBHDFS)
+        self.store = store
+        self.workers = workers
+        self.max_depth = max_depth
+        # Map of URL to the (future) result of resolving that hop:
+        self.memo = {}
+        self.memo_lock = threading.Lock()
+
+    def _hop(self, url):
+        '''
+        Look up one URL, and find where each capture of it redirects to.
+        '''
+        # Imported here, so command-line tools that only need the defaults above start up quickly:
+        from warcio.archiveiterator import ArchiveIterator
+        logger.info("Looking up: %s" % url)
+        hop = { 'url': url, 'captures': 0, 'redirects': [], 'locations': [] }
+        start = time.time()
+        try:
+            results = self.cdxs.lookup(url)
+            hop['cdx_secs'] = time.time() - start
+            start = time.time()
+            for result in results:
+                if result.original != url:
+                    continue
+                hop['captures'] += 1
+                with self.store.stream(result.filename, int(result.offset), int(result.length)) as stream:
+                    for record in ArchiveIterator(stream):
+                        if record.rec_type in ['response', 'revisit']:
+                            loc = record.http_headers.get('Location', None)
+                            sc = record.http_headers.get_statuscode()
+                            logger.info("%s < %s %s" %(loc, sc, url))
+                            if loc:
+                                # Resolve server-relative redirects if necessary:
+                                loc = urllib.parse.urljoin(url, loc)
+                                hop['redirects'].append({ 'timestamp': result.timestamp, 'status': sc, 'location': loc })
+                                if not loc in hop['locations']:
+                                    hop['locations'].append(loc)
+                            break
+            hop['fetch_secs'] = time.time() - start
+        except Exception as e:
+            logger.exception("Failed to resolve %s" % url)
+            hop['error'] = str(e)
+        return hop
+
+    def _resolve(self, executor, url):
+        with self.memo_lock:
+            future = self.memo.get(url, None)
+            if future is None:
+                future = executor.submit(self._hop, url)
+                self.memo[url] = future
+            return future
+
+    def trace(self, urls, window=None):
+        '''
+        Trace the redirect chains for the given URLs, yielding each chain as soon as it is complete.
+
+        Up to `window` chains are traced at once (default is a few per worker).
+        '''
+        window = window or self.workers * 4
+        urls = iter(urls)
+        exhausted = False
+        active = 0
+        # Map of hop futures to the (chain, depth) pairs waiting on them:
+        waiting = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                # Start more chains, if there is room:
+                while not exhausted and active < window:
+                    url = next(urls, None)
+                    if url is None:
+                        exhausted = True
+                        break
+                    chain = { 'url': url, 'hops': [], 'final_urls': [], '_seen': set([url]), '_pending': 1, '_started': time.time() }
+                    waiting.setdefault(self._resolve(executor, url), []).append((chain, 0))
+                    active += 1
+                if not waiting:
+                    break
+                # Process the hops that have been resolved:
+                done, not_done = wait(list(waiting), return_when=FIRST_COMPLETED)
+                for future in done:
+                    hop = future.result()
+                    for chain, depth in waiting.pop(future):
+                        chain['_pending'] -= 1
+                        chain_hop = dict(hop)
+                        chain_hop['depth'] = depth
+                        chain['hops'].append(chain_hop)
+                        if not hop['locations']:
+                            chain['final_urls'].append(hop['url'])
+                        elif depth >= self.max_depth:
+                            logger.warning("Giving up on %s after %i hops." % (chain['url'], depth))
+                        for loc in hop['locations']:
+                            # Follow each location the first time it turns up in this chain:
+                            if depth < self.max_depth and not loc in chain['_seen']:
+                                chain['_seen'].add(loc)
+                                chain['_pending'] += 1
+                                waiting.setdefault(self._resolve(executor, loc), []).append((chain, depth + 1))
+                        if chain['_pending'] == 0:
+                            active -= 1
+                            yield self._finish(chain)
+
+    def _finish(self, chain):
+        chain['total_secs'] = time.time() - chain.pop('_started')
+        chain['hops'].sort(key=lambda hop: hop['depth'])
+        chain.pop('_seen')
+        chain.pop('_pending')
+        return chain
+
+
+def follow_redirects(cdxs, url, urls=None, store=None):
+    '''
+    Returns the set of all the URLs the given URL redirects to, directly or indirectly.
+    '''
     if urls is None:
         urls = set()
-    logger.info("Looking up: %s" % url)
-    store = WebHDFSStore(webhdfs_url="http://hdfs.bapi.wa.bl.uk/")
-    for result in cdxs.query(url):
-        if result.original == url:
-            with store.stream(result.filename, result.offset, result.length) as stream:
-                for record in ArchiveIterator(stream):
-                    if record.rec_type in ['response', 'revisit']:
-                        #target = record.rec_headers.get_header('WARC-Target-URI')
-                        loc = record.http_headers.get('Location', None)
-                        sc = record.http_headers.get_statuscode()
-                        logger.info("%s < %s %s" %(loc, sc, url))
-                        if loc:
-                            # Resolve server-relative redirects if necessary:
-                            loc = urllib.parse.urljoin(url, loc)
-                            # Add to the list, if we don't already have it:
-                            if not loc in urls:
-                                urls.add(loc)
-                                # See if the URL leads to further redirects...
-                                urls = follow_redirects(cdxs, loc, urls)
-                        break
+    tracer = RedirectTracer(cdxs, store)
+    for chain in tracer.trace([url]):
+        for hop in chain['hops']:
+            urls.update(hop['locations'])
     return urls
-    
\ No newline at end of file
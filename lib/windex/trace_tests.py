@@ -0,0 +1,115 @@
+import io
+import threading
+import collections
+from lib.windex.cdx import CDX11
+from lib.windex.trace import RedirectTracer, follow_redirects
+from warcio.warcwriter import WARCWriter
+from warcio.statusandheaders import StatusAndHeaders
+
+
+class FakeCdxIndex(object):
+    '''
+    Has one capture for each URL in the given map of URL to redirect location (or None for a 200), and counts the
+    lookups made. URLs in `failing` raise an exception.
+    '''
+
+    def __init__(self, redirects, failing=()):
+        self.redirects = redirects
+        self.failing = failing
+        self.lookups = collections.Counter()
+        self.lock = threading.Lock()
+
+    def lookup(self, url, limit=25, sort='reverse', **kwargs):
+        with self.lock:
+            self.lookups[url] += 1
+        if url in self.failing:
+            raise Exception("Simulated CDX failure")
+        if url not in self.redirects:
+            return []
+        return [CDX11('key 20200101120000 %s text/html 301 DIGEST - - 100 0 %s' % (url, url))]
+
+
+class FakeStore(object):
+    '''
+    Serves a WARC response record for each capture, named after the URL.
+    '''
+
+    def __init__(self, redirects):
+        self.redirects = redirects
+
+    def stream(self, path, offset=0, length=None):
+        f = io.BytesIO()
+        location = self.redirects[path]
+        if location:
+            http_headers = StatusAndHeaders('301 Moved Permanently', [('Location', location)], protocol='HTTP/1.1')
+        else:
+            http_headers = StatusAndHeaders('200 OK', [('Content-Type', 'text/html')], protocol='HTTP/1.1')
+        writer = WARCWriter(f, gzip=False)
+        writer.write_record(writer.create_warc_record(path, 'response', payload=io.BytesIO(b''), http_headers=http_headers))
+        f.seek(0)
+        return f
+
+
+def tracer(redirects, failing=(), **kwargs):
+    return RedirectTracer(FakeCdxIndex(redirects, failing), FakeStore(redirects), workers=4, **kwargs)
+
+
+def test_chain():
+    t = tracer({ 'http://a/': 'http://b/', 'http://b/': '/c', 'http://b/c': None })
+    chains = list(t.trace(['http://a/']))
+    assert len(chains) == 1
+    chain = chains[0]
+    assert [(hop['url'], hop['depth'], hop['locations']) for hop in chain['hops']] == [
+        ('http://a/', 0, ['http://b/']),
+        # Relative redirects are resolved:
+        ('http://b/', 1, ['http://b/c']),
+        ('http://b/c', 2, []),
+    ]
+    assert chain['hops'][0]['redirects'][0]['status'] == '301'
+    assert chain['final_urls'] == ['http://b/c']
+    assert follow_redirects(t.cdxs, 'http://a/', store=t.store) == set(['http://b/', 'http://b/c'])
+
+
+def test_shared_hops_looked_up_once():
+    redirects = dict(('http://%i/' % i, 'http://shared/') for i in range(20))
+    redirects['http://shared/'] = 'http://final/'
+    redirects['http://final/'] = None
+    t = tracer(redirects)
+    chains = list(t.trace(sorted(url for url in redirects if url not in ['http://shared/', 'http://final/']), window=5))
+    assert len(chains) == 20
+    assert all(chain['final_urls'] == ['http://final/'] for chain in chains)
+    assert t.cdxs.lookups['http://shared/'] == 1
+    assert t.cdxs.lookups['http://final/'] == 1
+
+
+def test_cycles_followed_once():
+    t = tracer({ 'http://a/': 'http://b/', 'http://b/': 'http://a/' })
+    chain = next(t.trace(['http://a/']))
+    assert [(hop['url'], hop['depth']) for hop in chain['hops']] == [('http://a/', 0), ('http://b/', 1)]
+    # Neither is a final URL, as both redirect:
+    assert chain['final_urls'] == []
+
+
+def test_max_depth():
+    redirects = dict(('http://%i/' % i, 'http://%i/' % (i + 1)) for i in range(10))
+    t = tracer(redirects, max_depth=3)
+    chain = next(t.trace(['http://0/']))
+    assert [hop['url'] for hop in chain['hops']] == ['http://0/', 'http://1/', 'http://2/', 'http://3/']
+    assert chain['final_urls'] == []
+    assert 'http://4/' not in t.cdxs.lookups
+
+
+def test_failed_hop():
+    t = tracer({ 'http://a/': 'http://b/' }, failing=['http://b/'])
+    chain = next(t.trace(['http://a/']))
+    hop = chain['hops'][1]
+    assert hop['url'] == 'http://b/'
+    assert hop['error'] == 'Simulated CDX failure'
+    # A hop that could not be resolved is the end of the chain:
+    assert chain['final_urls'] == ['http://b/']
+
+
+def test_uncaptured_url():
+    chain = next(tracer({}).trace(['http://missing/']))
+    assert chain['hops'][0]['captures'] == 0
+    assert chain['final_urls'] == ['http://missing/']
@@ -22,7 +22,8 @@ setup(
         'console_scripts': [
             'trackdb=lib.trackdb.cmd:main',
             'windex=lib.windex.cmd:main',
-            'store=lib.store.cmd:main'
+            'store=lib.store.cmd:main',
+            'crawlctl=lib.heritrix3.crawlctl:main'
         ]
     }
 )
@@ -5,12 +5,13 @@ import logging
 from urllib.parse import urlparse
 import requests
 from requests.utils import quote
-import xml.dom.minidom
 import luigi.contrib.hdfs
 import luigi.contrib.hadoop
 
 from w3act.client import w3act
-from lib.docharvester.document_mdex import DocumentMDEx
+from lib.docharvester.document_mdex import DocumentMDEx, watched_targets_trie
+from lib.docharvester.http_cache import get_http_cache
+from lib.windex.cdx_xml import iter_capture_dates
 from tasks.crawl.w3act import CrawlFeed, ENV_ACT_PASSWORD, ENV_ACT_URL, ENV_ACT_USER
 from lib.targets import TaskTarget
 
@@ -35,6 +36,30 @@ def get_w3act(wurl):
         w3act_client = w3act(w3act_url, act_user, act_password)
     return w3act_client
 
+# Keep the most recently loaded Targets list, and the watched-seeds trie built from it, so they are re-used for
+# all the documents that need them, as long as the file they came from has not changed:
+targets_cache = None
+
+def get_targets(targets_target):
+    '''
+    Returns the Targets list in the given file, and the trie of the seeds of the Watched Targets.
+    '''
+    global targets_cache
+    try:
+        key = (targets_target.path, os.path.getmtime(targets_target.path))
+    except OSError:
+        # Not a local file, so there's no telling whether it has changed:
+        key = None
+    if key is None or targets_cache is None or targets_cache[0] != key:
+        targets = json.load(targets_target.open('r'))
+        targets_cache = (key, targets, watched_targets_trie(targets))
+    return targets_cache[1], targets_cache[2]
+
+
+def http_cache_run(job, launch_id):
+    # The name the HTTP cache stats for a crawl launch are gathered under:
+    return '{}/{}'.format(job, launch_id)
+
 
 class AvailableInWayback(luigi.ExternalTask):
     """
@@ -111,15 +136,15 @@ class AvailableInWayback(luigi.ExternalTask):
         """
         wburl = "%s?q=type:urlquery+url:%s" % (self.cdxserver_endpoint, quote(self.url))
         logger.debug("Checking availability %s" % wburl)
-        r = requests.get(wburl)
-        logger.debug("Availability response: %d" % r.status_code)
-        # Is it known, with a matching timestamp?
-        if r.status_code == 200:
-            dom = xml.dom.minidom.parseString(r.text)
-            for de in dom.getElementsByTagName('capturedate'):
-                if de.firstChild.nodeValue == self.ts:
-                    # Excellent, it's been found:
-                    return True
+        with requests.get(wburl, stream=True) as r:
+            logger.debug("Availability response: %d" % r.status_code)
+            # Is it known, with a matching timestamp? (Parsed as it streams in, stopping once found)
+            if r.status_code == 200:
+                r.raw.decode_content = True
+                for capture_date in iter_capture_dates(r.raw):
+                    if capture_date == self.ts:
+                        # Excellent, it's been found:
+                        return True
 
         # Otherwise, not found:
         return False
@@ -179,8 +204,10 @@ class ExtractDocumentAndPost(luigi.Task):
         w = get_w3act(self.w3act)
 
         # Lookup Target and extract any additional metadata:
-        targets = json.load(self.input()['targets'].open('r'))
-        doc = DocumentMDEx(targets, self.doc.get_wrapped().copy(), self.source).mdex()
+        targets, watched = get_targets(self.input()['targets'])
+        doc = DocumentMDEx(targets, self.doc.get_wrapped().copy(), self.source, watched=watched).mdex()
+        # Add this task's HTTP cache stats to the totals for the crawl, which get logged once it's all done:
+        get_http_cache().flush_stats(http_cache_run(self.job, self.launch_id))
 
         # Documents may be rejected at this point:
         if 'match_failed' in doc:
@@ -7,7 +7,8 @@ import luigi.contrib.hadoop
 from luigi.contrib.hdfs.format import Plain, PlainDir
 
 from tasks.analyse.crawl_logs.log_analysis_hadoop import AnalyseLogFile, SummariseLogFiles
-from tasks.analyse.crawl_logs.documents import ExtractDocumentAndPost
+from tasks.analyse.crawl_logs.documents import ExtractDocumentAndPost, http_cache_run
+from lib.docharvester.http_cache import get_http_cache
 from tasks.crawl.w3act import CrawlFeed
 from tasks.common import state_file, logger
 from lib.webhdfs import webhdfs
@@ -142,6 +143,9 @@ class AnalyseAndProcessDocuments(luigi.Task):
                 if len(tasks) > 0:
                     yield tasks
 
+        # All the documents are done, so log how well the HTTP cache did across them:
+        get_http_cache().log_stats(http_cache_run(self.job, self.launch_id))
+
 
 class GenerateCrawlLogReports(luigi.Task):
     """
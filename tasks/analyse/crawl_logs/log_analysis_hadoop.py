@@ -9,6 +9,7 @@ import luigi.contrib.hdfs
 import luigi.contrib.hadoop
 from luigi.contrib.hdfs.format import Plain, PlainDir
 from lib.surt import url_to_surt
+from lib.docharvester.surt_trie import SurtPrefixTrie
 
 import lib, dateutil, six # Imported so extra_modules MR-bundle can access them
 #import surt, tldextract, idna, requests, urllib3, certifi, chardet, requests_file, six # Unfortunately the surt module has a LOT of dependencies.
@@ -139,11 +140,12 @@ class CrawlLogExtractors(object):
                 if t['watched']:
                     watched.add(seed)
 
-        # Convert to SURT form:
-        watched_surts = []
+        # Convert to SURT form, and build a trie so each URL can be checked against all of them at once:
+        watched_surts = SurtPrefixTrie()
         for url in watched:
-            watched_surts.append(url_to_surt(url))
-        logger.warning("WATCHED SURTS %s" % watched_surts)
+            surt = url_to_surt(url)
+            watched_surts.add(surt, surt)
+        logger.warning("WATCHED SURTS %i" % len(watched_surts))
 
         self.watched_surts = watched_surts
         self.target_map = target_map
@@ -174,26 +176,24 @@ class CrawlLogExtractors(object):
             return
         # Check the URL and Content-Type:
         if "application/pdf" in log.mime:
-            for prefix in self.watched_surts:
-                document_surt = url_to_surt(log.url)
-                landing_page_surt = url_to_surt(log.via)
-                #logger.warning("Looking for prefix '%s' in '%s' and '%s'" % (prefix,document_surt, landing_page_surt))
-                # Are both URIs under the same watched SURT:
-                if document_surt.startswith(prefix) or landing_page_surt.startswith(prefix):
-                    # Proceed to extract metadata and pass on to W3ACT:
-                    doc = {
-                        'wayback_timestamp': log.start_time_plus_duration[:14],
-                        'landing_page_url': log.via,
-                        'document_url': log.url,
-                        'filename': os.path.basename(urlparse(log.url).path),
-                        'size': int(log.content_length),
-                        # Add some more metadata to the output so we can work out where this came from later:
-                        'job_name': self.job,
-                        'launch_id': self.launch_id,
-                        'source': log.source
-                    }
-                    #logger.info("Found document: %s" % doc)
-                    return json.dumps(doc)
+            document_surt = url_to_surt(log.url)
+            landing_page_surt = url_to_surt(log.via)
+            # Is either URI under a watched SURT:
+            if self.watched_surts.has_match(document_surt) or self.watched_surts.has_match(landing_page_surt):
+                # Proceed to extract metadata and pass on to W3ACT:
+                doc = {
+                    'wayback_timestamp': log.start_time_plus_duration[:14],
+                    'landing_page_url': log.via,
+                    'document_url': log.url,
+                    'filename': os.path.basename(urlparse(log.url).path),
+                    'size': int(log.content_length),
+                    # Add some more metadata to the output so we can work out where this came from later:
+                    'job_name': self.job,
+                    'launch_id': self.launch_id,
+                    'source': log.source
+                }
+                #logger.info("Found document: %s" % doc)
+                return json.dumps(doc)
 
         return None
 
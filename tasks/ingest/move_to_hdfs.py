@@ -12,6 +12,7 @@ import luigi.contrib.hdfs
 import luigi.contrib.hadoop_jar
 import shutil
 from tasks.common import logger, taskdb_target
+from lib.store.scheduler import get_scheduler, TransferSchedulerCollector
 
 
 HDFS_PREFIX = os.environ.get('HDFS_PREFIX','')
@@ -48,6 +49,7 @@ class UploadFileToHDFS(luigi.Task):
     """
     task_namespace = 'file'
     path = luigi.Parameter()
+    transfer_class = luigi.Parameter(default='crawl', significant=False)
     resources = {'hdfs': 1}
 
     def output(self):
@@ -62,10 +64,14 @@ class UploadFileToHDFS(luigi.Task):
 
         :return: None
         """
-        self.uploader(self.path, self.output().path)
+        self.uploader(self.path, self.output().path, self.transfer_class)
+
+    def get_metrics(self, registry):
+        # type: (CollectorRegistry) -> None
+        registry.register(TransferSchedulerCollector(get_scheduler()))
 
     @staticmethod
-    def uploader(local_path, hdfs_path):
+    def uploader(local_path, hdfs_path, transfer_class='crawl'):
         """
         Copy up to HDFS, making it suitably atomic by using a temporary filename during upload.
 
@@ -82,8 +88,9 @@ class UploadFileToHDFS(luigi.Task):
         # Now upload the file, allowing overwrites as this is a temporary file and
         # simultanous updates should not be possible:
         logger.info("Uploading as %s" % tmp_path)
-        with open(local_path, 'r') as f:
-            client.client.write(data=f, hdfs_path=tmp_path, overwrite=True)
+        # The upload shares the store bandwidth budget (see lib.store.scheduler):
+        with open(local_path, 'rb') as f:
+            client.client.write(data=get_scheduler().reader(f, transfer_class), hdfs_path=tmp_path, overwrite=True)
 
         # Check if the destination file exists and raise an exception if so:
         if client.exists(hdfs_path):